@@ -1,15 +1,17 @@
 import os
 import sys
-import re
 import json
-import struct
 import threading
-from datetime import datetime
-from io import BytesIO
+import time
+
+# Command-line modes never need Kivy; hand them off before it is imported
+if __name__ == '__main__' and len(sys.argv) > 1:
+    from metaprobe_cli import main
+    sys.exit(main(sys.argv[1:]))
 
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.core.window import Window
+from kivy.core.window import Window, Keyboard
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.scrollview import ScrollView
@@ -22,30 +24,29 @@ from kivy.uix.popup import Popup
 from kivy.uix.progressbar import ProgressBar
 from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelItem
 from kivy.uix.treeview import TreeView, TreeViewNode, TreeViewLabel
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.behaviors import ButtonBehavior
 from kivy.graphics import Color, Rectangle
 from kivy.properties import StringProperty, ObjectProperty, BooleanProperty
 from kivy.metrics import dp, sp
 from kivy.factory import Factory
 from kivy.lang import Builder
 
-# Try to import PIL for image processing
-try:
-    from PIL import Image as PILImage
-    from PIL import ExifTags
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-    print("Warning: PIL/Pillow is not installed. Image metadata will be limited.")
-    print("Install with: pip install pillow")
+from metaprobe_core import (
+    MetadataExtractor, SUPPORTED_IMAGE_EXT, SUPPORTED_VIDEO_EXT, DEEP_SCAN_UPDATE_INTERVAL,
+    have_pil, ParameterTable, LibraryStats, parse_compare_query, iter_jsonl_records,
+    COMPARE_COLUMNS, BlobRef, blob_json_default, ThumbnailCache, folder_media_files,
+    NeighbourPrefetcher
+)
 
-# Try to import pymediainfo for media file analysis
-try:
-    import pymediainfo
-    HAS_MEDIAINFO = True
-except ImportError:
-    HAS_MEDIAINFO = False
-    print("Warning: pymediainfo is not installed. Video metadata will be limited.")
-    print("Install with: pip install pymediainfo")
+# Comparison grid columns and their relative widths
+COMPARE_GRID_COLUMNS = ("path",) + tuple(name for name, _, _, _ in COMPARE_COLUMNS)
+COMPARE_GRID_WIDTHS = {"path": 3, "generator": 1.5, "model": 2, "sampler": 1.5}
+# Longest large value shown in an opened tree node; exports always get all of it
+BLOB_TREE_MAX_CHARS = 20000
+# Folder grid thumbnails decoded at once
+FOLDER_THUMBNAIL_WORKERS = 4
 
 # Define the Kivy UI
 KV = '''
@@ -115,6 +116,44 @@ KV = '''
             pos: self.pos
             size: self.size
     
+<CompareRow>:
+    size_hint_y: None
+    height: dp(28)
+    canvas.before:
+        Color:
+            rgba: (0.17, 0.17, 0.2, 1) if self.is_even else (0.13, 0.13, 0.15, 1)
+        Rectangle:
+            pos: self.pos
+            size: self.size
+
+<ThumbnailTile>:
+    orientation: 'vertical'
+    padding: dp(4)
+    canvas.before:
+        Color:
+            rgba: (0.25, 0.35, 0.5, 1) if self.state == 'down' else (0.17, 0.17, 0.2, 1)
+        Rectangle:
+            pos: self.pos
+            size: self.size
+    Image:
+        source: root.thumb
+        opacity: 1 if root.thumb else 0
+    Label:
+        text: root.file_name
+        color: 0.9, 0.9, 0.9, 1
+        font_size: sp(12)
+        size_hint_y: None
+        height: dp(20)
+        shorten: True
+        text_size: self.width, None
+
+<CompareHeaderButton@Button>:
+    background_color: 0.2, 0.2, 0.25, 1
+    background_normal: ''
+    color: 0.95, 0.95, 0.95, 1
+    font_size: sp(13)
+    bold: True
+
 <MetadataTreeView>:
     size_hint_y: None
     height: self.minimum_height
@@ -159,7 +198,7 @@ KV = '''
     TabbedPanel:
         id: tab_panel
         do_default_tab: False
-        tab_width: Window.width / 3
+        tab_width: Window.width / 6
         background_color: 0.15, 0.15, 0.15, 1
         
         TabbedPanelItem:
@@ -242,6 +281,89 @@ KV = '''
                         readonly: False  # Allow selection and copying
                         size_hint: 1, None
                         height: max(self.minimum_height, tree_scroll.height)
+                        
+        TabbedPanelItem:
+            text: 'Compare'
+            background_color: 0.2, 0.2, 0.25, 1
+            BoxLayout:
+                orientation: 'vertical'
+                spacing: dp(5)
+                BoxLayout:
+                    size_hint_y: None
+                    height: dp(40)
+                    spacing: dp(5)
+                    SearchInput:
+                        id: compare_filter
+                        size_hint_x: 0.7
+                        hint_text: 'Filter, e.g. model:sdxl steps:20..30 seed:>1000 forest (Ctrl+F)'
+                        on_text_validate: root.refresh_comparison()
+                    Button:
+                        size_hint_x: 0.3
+                        text: 'Load Batch Results'
+                        on_release: root.show_comparison_chooser()
+                BoxLayout:
+                    id: compare_header
+                    size_hint_y: None
+                    height: dp(30)
+                RecycleView:
+                    id: compare_grid
+                    viewclass: 'CompareRow'
+                    bar_width: dp(10)
+                    bar_color: 0.3, 0.4, 0.5, 0.7
+                    scroll_type: ['bars', 'content']
+                    RecycleBoxLayout:
+                        default_size: None, dp(28)
+                        default_size_hint: 1, None
+                        size_hint_y: None
+                        height: self.minimum_height
+                        orientation: 'vertical'
+                        
+        TabbedPanelItem:
+            text: 'Stats'
+            background_color: 0.2, 0.2, 0.25, 1
+            DarkScrollView:
+                SelectableTextInput:
+                    id: stats_text
+                    readonly: True
+                    font_name: 'RobotoMono-Regular'
+                    text: 'Load batch results or open files to see library statistics.'
+                    size_hint: 1, None
+                    height: max(self.minimum_height, tree_scroll.height)
+                    
+        TabbedPanelItem:
+            text: 'Folder'
+            background_color: 0.2, 0.2, 0.25, 1
+            BoxLayout:
+                orientation: 'vertical'
+                spacing: dp(5)
+                BoxLayout:
+                    size_hint_y: None
+                    height: dp(40)
+                    spacing: dp(5)
+                    DarkLabel:
+                        id: folder_label
+                        size_hint_x: 0.7
+                        text: 'No folder open'
+                        shorten: True
+                        text_size: self.size
+                        valign: 'middle'
+                    Button:
+                        size_hint_x: 0.3
+                        text: 'Open Folder'
+                        on_release: root.show_folder_chooser()
+                RecycleView:
+                    id: folder_grid
+                    viewclass: 'ThumbnailTile'
+                    bar_width: dp(10)
+                    bar_color: 0.3, 0.4, 0.5, 0.7
+                    scroll_type: ['bars', 'content']
+                    RecycleGridLayout:
+                        cols: max(1, int(self.width // dp(180)))
+                        default_size: dp(176), dp(150)
+                        default_size_hint: None, None
+                        size_hint_y: None
+                        height: self.minimum_height
+                        spacing: dp(4)
                     
     BoxLayout:
         size_hint_y: None
@@ -359,11 +481,60 @@ Builder.load_string(KV)
 class LoadDialog(Popup):
     load = ObjectProperty(None)
     cancel = ObjectProperty(None)
-    filters = ObjectProperty(['*.png', '*.jpg', '*.jpeg', '*.webp', '*.mp4', '*.mov', '*.webm'])
+    filters = ObjectProperty(['*.png', '*.jpg', '*.jpeg', '*.webp', '*.avif', '*.heic', '*.heif', '*.mp4', '*.mov', '*.webm'])
     default_path = StringProperty(os.path.expanduser('~'))
 
 class AlternatingTreeViewLabel(TreeViewLabel):
     is_even = BooleanProperty(False)
+    # A large value still in the file, read when the node is first opened
+    blob = ObjectProperty(None, allownone=True)
+
+class CompareRow(RecycleDataViewBehavior, BoxLayout):
+    """One row of the comparison grid; cells are read from the table when shown
+    
+    The grid's data holds only row numbers, so sorting or filtering 100k
+    files never formats a cell that isn't on screen.
+    """
+    is_even = BooleanProperty(False)
+    
+    def __init__(self, **kwargs):
+        super(CompareRow, self).__init__(**kwargs)
+        self.cells = []
+        for name in COMPARE_GRID_COLUMNS:
+            cell = Label(color=(0.9, 0.9, 0.9, 1), font_size=sp(13), halign='left', valign='middle',
+                         shorten=True, shorten_from='left' if name == "path" else 'right',
+                         size_hint_x=COMPARE_GRID_WIDTHS.get(name, 1))
+            cell.bind(size=cell.setter('text_size'))
+            self.cells.append(cell)
+            self.add_widget(cell)
+    
+    def refresh_view_attrs(self, rv, index, data):
+        table, row = data['table'], data['row']
+        self.is_even = index % 2 == 0
+        for cell, name in zip(self.cells, COMPARE_GRID_COLUMNS):
+            cell.text = table.cell(row, name)
+        return super(CompareRow, self).refresh_view_attrs(rv, index, data)
+
+class ThumbnailTile(RecycleDataViewBehavior, ButtonBehavior, BoxLayout):
+    """One file of the folder grid; its thumbnail is requested when the tile is shown
+    
+    The grid recycles a screenful of tiles, so a folder of thousands of
+    files only ever decodes the thumbnails scrolled into view.
+    """
+    file_path = StringProperty('')
+    file_name = StringProperty('')
+    thumb = StringProperty('')
+    
+    def refresh_view_attrs(self, rv, index, data):
+        previous = self.file_path
+        self.browser = data['browser']
+        self.file_path = data['file_path']
+        self.file_name = os.path.basename(self.file_path)
+        self.thumb = self.browser.request_thumbnail(self, previous)
+        return super(ThumbnailTile, self).refresh_view_attrs(rv, index, data)
+    
+    def on_release(self):
+        self.browser.open_browsed_file(self.file_path)
 
 class SearchInput(TextInput):
     def __init__(self, **kwargs):
@@ -378,7 +549,7 @@ class SearchInput(TextInput):
             return True
         return super(SearchInput, self).keyboard_on_key_down(window, keycode, text, modifiers)
 
-class MetadataDisplay(BoxLayout):
+class MetadataDisplay(MetadataExtractor, BoxLayout):
     def __init__(self, **kwargs):
         super(MetadataDisplay, self).__init__(**kwargs)
         self.current_file = None
@@ -388,6 +559,25 @@ class MetadataDisplay(BoxLayout):
         self.tree_search_results = []  # Store tree search results
         self.tree_search_index = -1  # Current index in tree search results
         self.text_search_positions = {}  # Store search positions for each text widget
+        self.compare_table = None  # ParameterTable of the loaded batch results
+        self.library_stats = LibraryStats()  # Loaded batch results plus files opened since
+        self.stats_counted = {}  # path -> ((size, mtime_ns) or None, LibraryStats.entry) in the stats
+        self.compare_sort = None
+        self.compare_descending = False
+        self.compare_buttons = {}
+        self.thumbnail_cache = ThumbnailCache(self)
+        self.thumb_pool = None  # Created with the first folder opened
+        self.thumb_sources = {}  # path -> cached thumbnail ('' when there is none)
+        self.thumb_pending = set()  # paths queued for decoding
+        self.thumb_tiles = {}  # path -> the tile showing it
+        # Extracts the folder neighbours of each file shown, with its own extractor
+        self.prefetcher = NeighbourPrefetcher(MetadataExtractor(), self.thumbnail_cache)
+        for name in COMPARE_GRID_COLUMNS:
+            button = Factory.CompareHeaderButton(text=name.capitalize(),
+                                                 size_hint_x=COMPARE_GRID_WIDTHS.get(name, 1))
+            button.bind(on_release=lambda button, name=name: self.sort_comparison(name))
+            self.compare_buttons[name] = button
+            self.ids.compare_header.add_widget(button)
         Window.bind(on_drop_file=self._on_drop_file)
         
         # Setup keyboard bindings
@@ -411,6 +601,8 @@ class MetadataDisplay(BoxLayout):
                 self.ids.prompt_search.focus = True
             elif current_tab == 'Raw JSON':
                 self.ids.json_search.focus = True
+            elif current_tab == 'Compare':
+                self.ids.compare_filter.focus = True
             return True
             
         # Check for Ctrl+G (Find Next)
@@ -425,6 +617,13 @@ class MetadataDisplay(BoxLayout):
                 self.search_text_next(self.ids.json_text, self.ids.json_search.text)
             return True
         
+        # PageDown / PageUp and Alt+Right / Alt+Left step through the folder
+        elif keyboard in (Keyboard.keycodes['pagedown'], Keyboard.keycodes['pageup']) or (
+                keyboard in (Keyboard.keycodes['right'], Keyboard.keycodes['left']) and 'alt' in modifiers):
+            forward = keyboard in (Keyboard.keycodes['pagedown'], Keyboard.keycodes['right'])
+            self.navigate(1 if forward else -1)
+            return True
+        
         # Check for F3 (Find Next)
         elif keycode_str == 'f3':
             current_tab = self.ids.tab_panel.current_tab.text
@@ -444,6 +643,11 @@ class MetadataDisplay(BoxLayout):
         if isinstance(file_path, bytes):
             file_path = file_path.decode('utf-8')
         
+        # Batch results go to the comparison grid
+        if file_path.lower().endswith('.jsonl'):
+            self.open_comparison(file_path)
+            return
+        
         # Clear previous metadata and UI before processing new file
         self.clear_data()
         
@@ -479,7 +683,7 @@ class MetadataDisplay(BoxLayout):
         content = LoadDialog(
             load=self.load_file, 
             cancel=self.dismiss_popup,
-            filters=['*.png', '*.jpg', '*.jpeg', '*.webp', '*.mp4', '*.mov', '*.webm']
+            filters=['*.png', '*.jpg', '*.jpeg', '*.webp', '*.avif', '*.heic', '*.heif', '*.mp4', '*.mov', '*.webm']
         )
         self._popup = Popup(
             title="Load file", 
@@ -513,10 +717,7 @@ class MetadataDisplay(BoxLayout):
         _, file_ext = os.path.splitext(file_path)
         file_ext = file_ext.lower()
         
-        supported_image_ext = ['.png', '.jpg', '.jpeg', '.webp']
-        supported_video_ext = ['.mp4', '.mov', '.webm']
-        
-        if file_ext not in supported_image_ext and file_ext not in supported_video_ext:
+        if file_ext not in SUPPORTED_IMAGE_EXT and file_ext not in SUPPORTED_VIDEO_EXT:
             self.update_status(f"Error: Unsupported file type - {file_ext}")
             return
         
@@ -527,36 +728,83 @@ class MetadataDisplay(BoxLayout):
         filename = os.path.basename(file_path)
         self.update_status(f"Processing {filename}...")
         
+        # A neighbour of the last file shown may already be extracted
+        result = self.prefetcher.get(file_path)
+        
         # Process in a separate thread to avoid UI freezing
-        threading.Thread(target=self._process_file_thread, args=(file_path, file_ext)).start()
+        threading.Thread(target=self._process_file_thread, args=(file_path, file_ext, result)).start()
     
-    def _process_file_thread(self, file_path, file_ext):
-        """Background thread for file processing"""
+    def _process_file_thread(self, file_path, file_ext, result=None):
+        """Background thread for file processing; result is a prefetched one to show instead"""
         try:
-            # Determine file type
-            supported_image_ext = ['.png', '.jpg', '.jpeg', '.webp']
-            supported_video_ext = ['.mp4', '.mov', '.webm']
-            
-            if file_ext in supported_image_ext:
-                metadata, ai_prompt = self.process_image(file_path, file_ext)
-            elif file_ext in supported_video_ext:
-                metadata, ai_prompt = self.process_video(file_path, file_ext)
-            else:
-                # This shouldn't happen due to earlier check
-                return
-            
-            # Store metadata and prompt
-            self.current_metadata = metadata
-            self.detected_ai_prompt = ai_prompt
+            if result is None:
+                result = self.extract_result(file_path)
+            metadata = result.to_dict()
+            # A deferred Description is read here, not on the UI thread
+            description = None if result.prompt else self.read_description(metadata)
             
             # Update UI on the main thread
-            Clock.schedule_once(lambda dt: self.update_ui(file_path, metadata, ai_prompt), 0)
+            Clock.schedule_once(lambda dt: self._show_result(file_path, result, metadata, description), 0)
             
         except Exception as e:
             Clock.schedule_once(lambda dt: self.update_status(f"Error: {str(e)}"), 0)
     
-    def update_ui(self, file_path, metadata, ai_prompt):
-        """Update UI with processing results"""
+    def _show_result(self, file_path, result, metadata, description=None):
+        """Show an extracted file, then prefetch the files around it"""
+        # Another file may have been opened while this one was extracted
+        if file_path != self.current_file:
+            return
+        ai_prompt = result.prompt
+        self.count_in_stats(file_path, result)
+        
+        # Store metadata and prompt
+        self.current_metadata = metadata
+        self.detected_ai_prompt = ai_prompt
+        self.update_ui(file_path, metadata, ai_prompt, description)
+        self.prefetcher.focus(file_path)
+    
+    def read_description(self, metadata):
+        """The Format_Specific Description of a metadata tree, read in full if it was deferred"""
+        desc = metadata.get("Format_Specific", {}).get("Description")
+        if isinstance(desc, BlobRef):
+            try:
+                return desc.load()
+            except (OSError, ValueError):
+                return str(desc)
+        return desc
+    
+    def count_in_stats(self, file_path, result):
+        """Add a displayed file to the library stats once per version, replacing an older one"""
+        try:
+            stat = os.stat(file_path)
+            version = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            version = None
+        key = os.path.abspath(file_path)
+        previous = self.stats_counted.get(key)
+        if previous is not None and previous[0] == version:
+            return
+        entry = LibraryStats.entry(result)
+        if previous is not None:
+            self.library_stats.remove(previous[1])
+        self.library_stats.add(entry)
+        self.stats_counted[key] = (version, entry)
+    
+    def navigate(self, step):
+        """Open the next (step 1) or previous (step -1) media file in the current file's folder"""
+        if not self.current_file:
+            self.update_status("No file loaded. Please load a file first.")
+            return
+        previous, following = self.prefetcher.neighbours(self.current_file)
+        target = following if step > 0 else previous
+        if target is None:
+            self.update_status("Last file in this folder" if step > 0 else "First file in this folder")
+            return
+        self.clear_data()
+        self.process_file(target)
+    
+    def update_ui(self, file_path, metadata, ai_prompt, description=None):
+        """Update UI with processing results; description is the Format_Specific one, already read"""
         # Update file info
         filename = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
@@ -573,11 +821,12 @@ class MetadataDisplay(BoxLayout):
         
         # Update metadata tree
         self.update_metadata_tree(metadata)
+        self.update_stats()
         
         # Check for Midjourney prompts in Description field
         # (This is necessary since some Midjourney images store the prompt in the Format_Specific/Description field)
-        if not ai_prompt and "Format_Specific" in metadata and "Description" in metadata["Format_Specific"]:
-            desc = metadata["Format_Specific"]["Description"]
+        if not ai_prompt and description:
+            desc = description
             if any(marker in desc for marker in ['--ar', '--v', '--style', 'Job ID:', '/imagine']):
                 ai_prompt = desc
                 # Add to AI_Metadata if not already there
@@ -597,7 +846,8 @@ class MetadataDisplay(BoxLayout):
             self.ids.prompt_text.text = "No AI prompt detected.\nTry using the Deep Scan button."
             self.ids.ai_info.text = "No AI generation info detected"
         
-        # Update JSON view - format with indentation for readability
+        # Update JSON view - format with indentation for readability; large
+        # values show as their preview, as in the tree
         try:
             self.ids.json_text.text = json.dumps(metadata, indent=4, default=str)
         except Exception as e:
@@ -606,6 +856,202 @@ class MetadataDisplay(BoxLayout):
         # Update status
         self.update_status(f"Loaded metadata from {filename}")
     
+    def show_comparison_chooser(self):
+        """Show a file chooser for `batch` JSON lines output"""
+        content = LoadDialog(
+            load=self.load_comparison,
+            cancel=self.dismiss_popup,
+            filters=['*.jsonl']
+        )
+        self._popup = Popup(
+            title="Load batch results",
+            content=content,
+            size_hint=(0.9, 0.9),
+            background_color=(0.2, 0.2, 0.2, 1)
+        )
+        self._popup.open()
+    
+    def load_comparison(self, path, selection):
+        """Handle batch results selection from dialog"""
+        if selection:
+            self.dismiss_popup()
+            self.open_comparison(selection[0])
+    
+    def open_comparison(self, file_path):
+        """Load batch results into the comparison grid in the background"""
+        self.update_status(f"Loading {os.path.basename(file_path)}...")
+        threading.Thread(target=self._load_comparison_thread, args=(file_path,), daemon=True).start()
+    
+    def _load_comparison_thread(self, file_path):
+        """Background thread building the comparison table"""
+        table = ParameterTable()
+        stats = LibraryStats()
+        # Records carry no mtime: opening one of their files later replaces its entry
+        counted = {}
+        try:
+            # One pass feeds both the grid columns and the aggregates
+            for record in iter_jsonl_records(file_path):
+                table.add(record)
+                entry = LibraryStats.entry(record)
+                stats.add(entry)
+                counted[os.path.abspath(record.get("path", ""))] = (None, entry)
+        except (OSError, UnicodeDecodeError) as e:
+            message = f"Error loading batch results: {e}"
+            Clock.schedule_once(lambda dt: self.update_status(message), 0)
+            return
+        Clock.schedule_once(lambda dt: self._show_comparison(file_path, table, stats, counted), 0)
+    
+    def _show_comparison(self, file_path, table, stats, counted):
+        """Show a freshly loaded table in the comparison grid"""
+        self.library_stats = stats
+        self.stats_counted = counted
+        self.update_stats()
+        self.compare_table = table
+        self.compare_sort = None
+        self.compare_descending = False
+        self._update_compare_headers()
+        self.switch_to_tab('Compare')
+        self.refresh_comparison()
+    
+    def switch_to_tab(self, text):
+        """Show the tab with the given title"""
+        for tab in self.ids.tab_panel.tab_list:
+            if tab.text == text:
+                self.ids.tab_panel.switch_to(tab)
+                return
+    
+    def show_folder_chooser(self):
+        """Show a chooser for the folder to browse; picking a file opens its folder"""
+        content = LoadDialog(
+            load=self.load_folder,
+            cancel=self.dismiss_popup,
+            filters=['*.png', '*.jpg', '*.jpeg', '*.webp', '*.avif', '*.heic', '*.heif', '*.mp4', '*.mov', '*.webm']
+        )
+        self._popup = Popup(
+            title="Open folder",
+            content=content,
+            size_hint=(0.9, 0.9),
+            background_color=(0.2, 0.2, 0.2, 1)
+        )
+        self._popup.open()
+    
+    def load_folder(self, path, selection):
+        """Handle folder selection from dialog"""
+        folder = selection[0] if selection else path
+        if not os.path.isdir(folder):
+            folder = os.path.dirname(folder)
+        self.dismiss_popup()
+        self.open_folder(folder)
+    
+    def open_folder(self, folder):
+        """List a folder's media files into the thumbnail grid in the background"""
+        self.update_status(f"Listing {folder}...")
+        threading.Thread(target=self._list_folder_thread, args=(folder,), daemon=True).start()
+    
+    def _list_folder_thread(self, folder):
+        """Background thread listing a folder"""
+        try:
+            files = folder_media_files(folder)
+        except OSError as e:
+            message = f"Error opening folder: {e}"
+            Clock.schedule_once(lambda dt: self.update_status(message), 0)
+            return
+        Clock.schedule_once(lambda dt: self._show_folder(folder, files), 0)
+    
+    def _show_folder(self, folder, files):
+        """Show a listed folder in the grid"""
+        if self.thumb_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.thumb_pool = ThreadPoolExecutor(FOLDER_THUMBNAIL_WORKERS)
+        # Files may have changed since the folder was last shown
+        self.thumb_sources.clear()
+        self.ids.folder_label.text = folder
+        self.ids.folder_grid.data = [{'browser': self, 'file_path': file_path} for file_path in files]
+        self.ids.folder_grid.scroll_y = 1
+        self.switch_to_tab('Folder')
+        self.update_status(f"{len(files)} media files in {folder}")
+    
+    def request_thumbnail(self, tile, previous=None):
+        """Thumbnail path for a tile being shown, or '' while it is decoded
+        
+        Decoding is queued at most once per file; the tile is updated when
+        it finishes, if it still shows that file.
+        """
+        if self.thumb_tiles.get(previous) is tile:
+            del self.thumb_tiles[previous]
+        file_path = tile.file_path
+        self.thumb_tiles[file_path] = tile
+        if file_path in self.thumb_sources:
+            return self.thumb_sources[file_path]
+        if file_path not in self.thumb_pending:
+            self.thumb_pending.add(file_path)
+            self.thumb_pool.submit(self._thumbnail_task, file_path)
+        return ''
+    
+    def _thumbnail_task(self, file_path):
+        """Worker thread: decode (or find in the cache) one grid thumbnail"""
+        if file_path not in self.thumb_tiles:
+            # Scrolled out of view before its turn; it is queued again when shown
+            Clock.schedule_once(lambda dt: self.thumb_pending.discard(file_path), 0)
+            return
+        try:
+            entry = self.thumbnail_cache.get(file_path) or ''
+        except OSError:
+            entry = ''
+        Clock.schedule_once(lambda dt: self._show_thumbnail(file_path, entry), 0)
+    
+    def _show_thumbnail(self, file_path, entry):
+        """Put a decoded thumbnail on its tile"""
+        self.thumb_pending.discard(file_path)
+        self.thumb_sources[file_path] = entry
+        tile = self.thumb_tiles.get(file_path)
+        if tile is not None and tile.file_path == file_path:
+            tile.thumb = entry
+    
+    def open_browsed_file(self, file_path):
+        """Load the metadata of a file clicked in the folder grid"""
+        self.clear_data()
+        self.process_file(file_path)
+        self.switch_to_tab('Metadata Tree')
+    
+    def sort_comparison(self, name):
+        """Sort the grid by a column; sorting by the same column again reverses it"""
+        if self.compare_sort == name:
+            self.compare_descending = not self.compare_descending
+        else:
+            self.compare_sort = name
+            self.compare_descending = False
+        self._update_compare_headers()
+        self.refresh_comparison()
+    
+    def _update_compare_headers(self):
+        """Mark the sorted column in the header"""
+        for name, button in self.compare_buttons.items():
+            arrow = ""
+            if name == self.compare_sort:
+                arrow = " v" if self.compare_descending else " ^"
+            button.text = name.capitalize() + arrow
+    
+    def refresh_comparison(self):
+        """Recompute the visible rows from the current sort and filter"""
+        table = self.compare_table
+        if table is None:
+            self.update_status("Load batch results (batch -o results.jsonl) to compare files")
+            return
+        filters, text = parse_compare_query(self.ids.compare_filter.text)
+        try:
+            rows = table.view(self.compare_sort, self.compare_descending, filters, text)
+        except ValueError as e:
+            self.update_status(f"Filter error: {e}")
+            return
+        # Only row numbers go into the grid; CompareRow formats the visible cells
+        self.ids.compare_grid.data = [{'table': table, 'row': row} for row in rows]
+        self.update_status(f"Comparing {len(rows)} of {len(table)} files")
+    
+    def update_stats(self):
+        """Show the current library statistics in the Stats tab"""
+        self.ids.stats_text.text = self.library_stats.summary()
+    
     def update_status(self, message):
         """Update status bar"""
         self.ids.status_bar.text = message
@@ -615,24 +1061,20 @@ class MetadataDisplay(BoxLayout):
         _, file_ext = os.path.splitext(file_path)
         file_ext = file_ext.lower()
         
-        if file_ext in ['.png', '.jpg', '.jpeg', '.webp']:
+        if file_ext in SUPPORTED_IMAGE_EXT:
             # For images, create a thumbnail
-            if HAS_PIL:
+            if have_pil():
                 try:
-                    img = PILImage.open(file_path)
-                    # Create a thumbnail and save to a BytesIO object
-                    img.thumbnail((160, 120))
-                    buf = BytesIO()
-                    img.save(buf, format='PNG')
-                    buf.seek(0)
-                    
-                    # Create a temporary file for Kivy to load
-                    temp_path = os.path.join(os.path.dirname(__file__), '_temp_thumb.png')
-                    with open(temp_path, 'wb') as f:
-                        f.write(buf.read())
+                    # Reuse the thumbnail decoded while hashing, if it is this file's;
+                    # either way it lands in the cache the folder grid reads
+                    if self.last_thumbnail and self.last_thumbnail[0] == file_path:
+                        source = self.thumbnail_cache.put(file_path, self.last_thumbnail[1])
+                        self.last_thumbnail = None
+                    else:
+                        source = self.thumbnail_cache.get(file_path)
                     
                     # Update the image source
-                    self.ids.preview_image.source = temp_path
+                    self.ids.preview_image.source = source or ''
                     self.ids.preview_image.reload()
                 except Exception as e:
                     print(f"Error creating thumbnail: {e}")
@@ -686,6 +1128,19 @@ class MetadataDisplay(BoxLayout):
             for i, item in enumerate(data):
                 self._add_metadata_to_tree(tree, node, item, f"Item {i+1}")
                 
+        elif isinstance(data, BlobRef):
+            # Large value left in the file: show its preview, read the rest on open
+            self.row_count += 1
+            node_label = AlternatingTreeViewLabel(
+                text=f"{key}: {data}",
+                is_open=False,
+                is_even=(self.row_count % 2 == 0),
+                blob=data
+            )
+            node = tree.add_node(node_label, parent)
+            tree.add_node(AlternatingTreeViewLabel(text="Loading...", is_even=node_label.is_even), node)
+            node_label.bind(is_open=self._open_blob_node)
+            
         else:
             # Leaf node - just add the value
             value = str(data)
@@ -700,446 +1155,24 @@ class MetadataDisplay(BoxLayout):
             )
             tree.add_node(node_label, parent)
     
-    def process_image(self, file_path, file_ext):
-        """Process image files - extract ALL possible metadata"""
-        metadata = {}
-        ai_prompt = None
-        
-        # Basic file info
-        file_size = os.path.getsize(file_path)
-        metadata["Basic"] = {
-            "File Name": os.path.basename(file_path),
-            "File Size": f"{file_size / 1024:.1f} KB" if file_size < 1024*1024 else f"{file_size / (1024*1024):.2f} MB",
-            "File Path": file_path,
-            "File Extension": file_ext.upper().replace('.', '')
-        }
-        
-        if HAS_PIL:
-            try:
-                # Open the image with PIL
-                img = PILImage.open(file_path)
-                
-                # Add basic image info
-                metadata["Basic"].update({
-                    "Image Format": img.format,
-                    "Mode": img.mode,
-                    "Dimensions": f"{img.width} x {img.height} pixels",
-                    "Bit Depth": str(getattr(img, 'bits', 'Unknown')),
-                    "Compression": getattr(img, 'compression', 'Unknown'),
-                    "Palette": "Yes" if getattr(img, 'palette', None) else "No"
-                })
-                
-                # Extract ALL format-specific data first
-                if hasattr(img, 'info'):
-                    format_info = {}
-                    for key, value in img.info.items():
-                        if isinstance(value, (str, int, float, bool, type(None))):
-                            format_info[key] = value
-                        elif isinstance(value, bytes):
-                            try:
-                                # Try to decode bytes as UTF-8
-                                decoded = value.decode('utf-8', errors='replace')
-                                if len(decoded) > 100:
-                                    format_info[key] = f"{decoded[:100]}... (truncated)"
-                                else:
-                                    format_info[key] = decoded
-                            except:
-                                format_info[key] = f"{str(type(value))} ({len(value)} bytes)"
-                        else:
-                            format_info[key] = f"{str(type(value))}"
-                    
-                    if format_info:
-                        metadata["Format_Specific"] = format_info
-                
-                # Check if this is a Midjourney image based on filename patterns
-                if 'Job ID:' in os.path.basename(file_path) or '_' in os.path.basename(file_path):
-                    parts = os.path.basename(file_path).split('_')
-                    if len(parts) >= 3:
-                        # Looks like a Midjourney naming pattern
-                        metadata["AI_Metadata"] = metadata.get("AI_Metadata", {})
-                        metadata["AI_Metadata"]["Generator"] = "Midjourney (from filename)"
-                
-                # Extract AI metadata and prompt
-                ai_metadata, prompt = self.extract_ai_metadata_from_image(img, file_path)
-                
-                if ai_metadata:
-                    # Merge with any existing AI metadata
-                    if "AI_Metadata" in metadata:
-                        metadata["AI_Metadata"].update(ai_metadata)
-                    else:
-                        metadata["AI_Metadata"] = ai_metadata
-                    
-                if prompt:
-                    ai_prompt = prompt
-                
-                # Extract EXIF data - get ALL possible EXIF tags
-                exif_data = self.extract_exif_data(img)
-                if exif_data:
-                    metadata["EXIF"] = exif_data
-                
-                # Extract ICC Profile data if available
-                if "icc_profile" in img.info:
-                    try:
-                        metadata["ICC_Profile"] = {"Present": "Yes", "Size": f"{len(img.info['icc_profile'])} bytes"}
-                    except:
-                        metadata["ICC_Profile"] = {"Present": "Yes", "Size": "Unknown"}
-                
-                # Extract XMP data
-                if "XML:com.adobe.xmp" in img.info:
-                    xmp_data = {"Present": "Yes"}
-                    
-                    # Try to extract key XMP fields
-                    xmp_text = img.info["XML:com.adobe.xmp"]
-                    xmp_data["Raw"] = xmp_text[:100] + "... (truncated)" if len(xmp_text) > 100 else xmp_text
-                    
-                    # Extract creator information
-                    creator_match = re.search(r'<dc:creator>(.*?)</dc:creator>', xmp_text, re.DOTALL)
-                    if creator_match:
-                        xmp_data["Creator"] = creator_match.group(1).strip()
-                    
-                    # Extract description
-                    desc_match = re.search(r'<dc:description>(.*?)</dc:description>', xmp_text, re.DOTALL)
-                    if desc_match:
-                        xmp_data["Description"] = desc_match.group(1).strip()
-                    
-                    # Extract rights
-                    rights_match = re.search(r'<dc:rights>(.*?)</dc:rights>', xmp_text, re.DOTALL)
-                    if rights_match:
-                        xmp_data["Rights"] = rights_match.group(1).strip()
-                    
-                    # Look for AI-specific fields
-                    if "trainedAlgorithmicMedia" in xmp_text:
-                        xmp_data["AI_Generated"] = "Yes"
-                    
-                    # Extract digital source type
-                    source_match = re.search(r'DigitalSourceType="([^"]+)"', xmp_text)
-                    if source_match:
-                        xmp_data["Digital_Source_Type"] = source_match.group(1).strip()
-                    
-                    # Look for GUID
-                    guid_match = re.search(r'DigImageGUID="([^"]+)"', xmp_text)
-                    if guid_match:
-                        xmp_data["Image_GUID"] = guid_match.group(1).strip()
-                    
-                    metadata["XMP_Metadata"] = xmp_data
-                
-                # For PNG files, extract additional chunk information
-                if file_ext.lower() == '.png':
-                    # Use binary mode to investigate PNG chunks
-                    with open(file_path, 'rb') as f:
-                        f.seek(8)  # Skip PNG signature
-                        
-                        chunks = []
-                        while True:
-                            try:
-                                chunk_len = struct.unpack('>I', f.read(4))[0]
-                                chunk_type = f.read(4).decode('ascii')
-                                
-                                # Skip data but record info
-                                f.seek(chunk_len, 1)  # Skip data
-                                f.seek(4, 1)  # Skip CRC
-                                
-                                chunks.append({"Type": chunk_type, "Length": chunk_len})
-                                
-                                if chunk_type == 'IEND':
-                                    break
-                            except:
-                                break
-                        
-                        if chunks:
-                            metadata["PNG_Structure"] = {
-                                "Chunk_Count": len(chunks),
-                                "Chunks": chunks
-                            }
-            
-            except Exception as e:
-                metadata["Error"] = {"Processing Error": str(e)}
-        
-        return metadata, ai_prompt
+    def _open_blob_node(self, node, is_open):
+        """Read a large value from its file the first time its node is opened"""
+        if not is_open or node.blob is None:
+            return
+        blob, node.blob = node.blob, None
+        threading.Thread(target=self._load_blob_thread, args=(node, blob), daemon=True).start()
     
-    def process_video(self, file_path, file_ext):
-        """Process video files"""
-        metadata = {}
-        ai_prompt = None
-        
-        # Basic file info
-        file_size = os.path.getsize(file_path)
-        metadata["Basic"] = {
-            "File Name": os.path.basename(file_path),
-            "File Size": f"{file_size / (1024*1024):.2f} MB",
-            "File Path": file_path,
-            "File Extension": file_ext.upper().replace('.', '')
-        }
-        
-        # Extract video metadata
-        if HAS_MEDIAINFO:
-            try:
-                media_info = pymediainfo.MediaInfo.parse(file_path)
-                
-                # Process general track
-                general_track = next((track for track in media_info.tracks if track.track_type == 'General'), None)
-                if general_track:
-                    general_data = {}
-                    for attr_name in dir(general_track):
-                        if not attr_name.startswith('_') and not callable(getattr(general_track, attr_name)):
-                            value = getattr(general_track, attr_name)
-                            if value and not attr_name.startswith('parse_'):
-                                general_data[attr_name] = value
-                    metadata["General"] = general_data
-                
-                # Process video track
-                video_track = next((track for track in media_info.tracks if track.track_type == 'Video'), None)
-                if video_track:
-                    video_data = {}
-                    for attr_name in dir(video_track):
-                        if not attr_name.startswith('_') and not callable(getattr(video_track, attr_name)):
-                            value = getattr(video_track, attr_name)
-                            if value and not attr_name.startswith('parse_'):
-                                video_data[attr_name] = value
-                    metadata["Video"] = video_data
-                
-                # Process audio track
-                audio_track = next((track for track in media_info.tracks if track.track_type == 'Audio'), None)
-                if audio_track:
-                    audio_data = {}
-                    for attr_name in dir(audio_track):
-                        if not attr_name.startswith('_') and not callable(getattr(audio_track, attr_name)):
-                            value = getattr(audio_track, attr_name)
-                            if value and not attr_name.startswith('parse_'):
-                                audio_data[attr_name] = value
-                    metadata["Audio"] = audio_data
-            
-            except Exception as e:
-                metadata["Error"] = {"MediaInfo Error": str(e)}
-        else:
-            metadata["Notice"] = {"Limited Information": "Install pymediainfo for more detailed video metadata."}
-        
-        # Try to extract AI metadata from binary data
+    def _load_blob_thread(self, node, blob):
+        """Background thread for reading one large value"""
         try:
-            # Read the first chunk of the file to check for metadata in headers
-            with open(file_path, 'rb') as f:
-                # Read a large chunk to capture metadata in the header
-                file_header = f.read(32768)  # 32KB should be enough for most headers
-            
-            # Look for JSON data or prompt patterns
-            ai_metadata, prompt = self.extract_metadata_from_binary(file_header)
-            
-            if ai_metadata:
-                metadata["AI_Metadata"] = ai_metadata
-                
-            if prompt:
-                ai_prompt = prompt
-        
-        except Exception as e:
-            if "Error" not in metadata:
-                metadata["Error"] = {}
-            metadata["Error"]["Binary Analysis Error"] = str(e)
-        
-        return metadata, ai_prompt
-    
-    def extract_ai_metadata_from_image(self, img, file_path):
-        """Extract AI metadata from image file"""
-        metadata = {}
-        prompt = None
-        
-        # Read the file in binary mode
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-        
-        # 0. Check for direct metadata in image info - highest priority
-        if hasattr(img, 'info'):
-            # Check Description field - Midjourney often puts prompts here
-            if 'Description' in img.info:
-                desc_text = str(img.info['Description'])
-                if any(marker in desc_text for marker in ['--ar', '--v', '--style', 'Job ID:', '/imagine']):
-                    metadata["Generator"] = "Midjourney"
-                    metadata["prompt"] = desc_text
-                    prompt = desc_text
-                    return metadata, prompt
-            
-            # Check Author field - Often indicates AI generator
-            if 'Author' in img.info and img.info['Author']:
-                metadata["Author"] = img.info['Author']
-        
-        # 1. Check for Stable Diffusion metadata
-        sd_pattern = re.compile(rb'parameters\s*:\s*(.*?)(?:\n\n|\Z)', re.DOTALL)
-        matches = sd_pattern.findall(file_data)
-        
-        if matches:
-            prompt_text = matches[0].decode('utf-8', errors='ignore').strip()
-            metadata["Generator"] = "Stable Diffusion"
-            metadata["prompt"] = prompt_text
-            prompt = prompt_text
-            
-            # Try to extract additional parameters
-            if "Negative prompt:" in prompt_text:
-                parts = prompt_text.split("Negative prompt:")
-                metadata["positive_prompt"] = parts[0].strip()
-                
-                neg_and_params = parts[1].strip()
-                param_start = neg_and_params.find("Steps: ")
-                
-                if param_start != -1:
-                    metadata["negative_prompt"] = neg_and_params[:param_start].strip()
-                    metadata["parameters"] = neg_and_params[param_start:].strip()
-                else:
-                    metadata["negative_prompt"] = neg_and_params
-            
-            return metadata, prompt
-        
-        # 2. Check for Midjourney metadata in EXIF
-        if hasattr(img, '_getexif') and img._getexif():
-            exif = img._getexif()
-            
-            # Midjourney often stores in ImageDescription or UserComment
-            description_tags = [270, 0x9286, 0x010e]
-            for tag in description_tags:
-                if tag in exif and exif[tag]:
-                    desc_text = exif[tag]
-                    if isinstance(desc_text, bytes):
-                        try:
-                            desc_text = desc_text.decode('utf-8')
-                        except UnicodeDecodeError:
-                            continue
-                    
-                    # Look for Midjourney patterns
-                    if desc_text and ("--ar" in desc_text or "--v" in desc_text or "/imagine" in desc_text):
-                        metadata["Generator"] = "Midjourney"
-                        metadata["prompt"] = desc_text
-                        prompt = desc_text
-                        return metadata, prompt
-        
-        # 3. Check for DALL-E metadata
-        if hasattr(img, '_getexif') and img._getexif():
-            exif = img._getexif()
-            
-            # Check Software field - DALL-E often identifies itself there
-            if 305 in exif and exif[305] and "DALL-E" in str(exif[305]):
-                metadata["Generator"] = "DALL-E"
-                
-                # Check for prompt in UserComment or ImageDescription
-                for tag in [270, 0x9286, 0x010e]:
-                    if tag in exif and exif[tag]:
-                        desc = exif[tag]
-                        if isinstance(desc, bytes):
-                            try:
-                                desc = desc.decode('utf-8')
-                            except UnicodeDecodeError:
-                                continue
-                                
-                        if desc and len(desc) > 10:
-                            metadata["prompt"] = desc
-                            prompt = desc
-                            return metadata, prompt
-        
-        # 4. Look for generic metadata in PNG text chunks
-        if hasattr(img, 'info'):
-            for key in ['parameters', 'prompt', 'sd-metadata', 'ai_metadata']:
-                if key in img.info:
-                    prompt_text = str(img.info[key])
-                    metadata["Generator"] = "AI Image Generator"
-                    metadata["prompt"] = prompt_text
-                    prompt = prompt_text
-                    return metadata, prompt
-        
-        # 5. As a last resort, try to find AI patterns in binary data
-        if not prompt:
-            bin_metadata, bin_prompt = self.extract_metadata_from_binary(file_data)
-            if bin_metadata:
-                metadata.update(bin_metadata)
-            if bin_prompt:
-                prompt = bin_prompt
-                
-        return metadata, prompt
-    
-    def extract_metadata_from_binary(self, binary_data):
-        """Extract metadata from binary file data"""
-        metadata = {}
-        prompt = None
-        
-        # JSON patterns
-        json_patterns = [
-            rb'{"prompt":.*?}',
-            rb'{"positive_prompt":.*?}',
-            rb'{"data":.*?}',
-            rb'{"parameters":.*?}'
-        ]
-        
-        for pattern in json_patterns:
-            matches = re.findall(pattern, binary_data)
-            for match in matches:
-                try:
-                    json_data = json.loads(match)
-                    if "prompt" in json_data:
-                        metadata["Generator"] = "AI Generator (from JSON)"
-                        metadata["prompt"] = json_data["prompt"]
-                        prompt = json_data["prompt"]
-                        return metadata, prompt
-                    elif "positive_prompt" in json_data:
-                        metadata["Generator"] = "AI Generator (from JSON)"
-                        metadata["prompt"] = json_data["positive_prompt"]
-                        prompt = json_data["positive_prompt"]
-                        return metadata, prompt
-                except:
-                    pass
-        
-        # Prompt patterns
-        prompt_patterns = [
-            rb'"prompt"\s*:\s*"([^"]+)"',
-            rb'"prompt"\s*:\s*\'([^\']+)\'',
-            rb'"description"\s*:\s*"([^"]+)"',
-            rb'prompt[=:]\s*([^\r\n&]+)',
-            rb'Prompt:\s*([^\r\n]+)',
-            rb'<prompt>(.*?)</prompt>'
-        ]
-        
-        for pattern in prompt_patterns:
-            matches = re.findall(pattern, binary_data)
-            for match in matches:
-                try:
-                    text = match.decode('utf-8', errors='ignore')
-                    # Clean up the text
-                    text = re.sub(r'[^\x20-\x7E]', ' ', text).strip()
-                    if len(text) > 15:  # Filter out very short matches
-                        metadata["Generator"] = "AI Generator (from binary data)"
-                        metadata["prompt"] = text
-                        prompt = text
-                        return metadata, prompt
-                except:
-                    pass
-        
-        return metadata, prompt
-    
-    def extract_exif_data(self, img):
-        """Extract EXIF data from an image"""
-        if not hasattr(img, '_getexif') or not img._getexif():
-            return {}
-            
-        exif = img._getexif()
-        processed_exif = {}
-        
-        for tag_id, value in exif.items():
-            # Get tag name if available
-            tag_name = ExifTags.TAGS.get(tag_id, str(tag_id))
-            
-            # Format dates if possible
-            if 'Date' in tag_name and isinstance(value, str):
-                try:
-                    date_obj = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                    value = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    pass
-            
-            # Convert byte arrays to strings where possible
-            if isinstance(value, bytes):
-                try:
-                    value = value.decode('utf-8')
-                except UnicodeDecodeError:
-                    value = str(value)
-            
-            processed_exif[tag_name] = value
-        
-        return processed_exif
+            text = blob.load()
+        except (OSError, ValueError) as e:
+            text = f"Could not read this value: {str(e)}"
+        else:
+            if len(text) > BLOB_TREE_MAX_CHARS:
+                text = (text[:BLOB_TREE_MAX_CHARS] + f"\n... ({len(text) - BLOB_TREE_MAX_CHARS} more "
+                        "characters - use Export Metadata for the whole value)")
+        Clock.schedule_once(lambda dt: setattr(node.nodes[0], 'text', text), 0)
     
     def deep_scan(self):
         """Perform a deep scan for AI metadata"""
@@ -1155,88 +1188,56 @@ class MetadataDisplay(BoxLayout):
     
     def _deep_scan_thread(self):
         """Background thread for deep scanning"""
+        file_path = self.current_file
+        last_push = [0.0]
+        
+        def push(candidates, bytes_scanned):
+            # Stream the current best candidates, at most every DEEP_SCAN_UPDATE_INTERVAL
+            now = time.monotonic()
+            if now - last_push[0] < DEEP_SCAN_UPDATE_INTERVAL:
+                return
+            last_push[0] = now
+            best, total = candidates.best(), candidates.total
+            Clock.schedule_once(lambda dt: self._update_deep_scan_results(
+                file_path, best, total, bytes_scanned), 0)
+        
         try:
-            # Read file data
-            with open(self.current_file, 'rb') as f:
-                file_data = f.read()
-            
-            # Patterns to search for
-            prompt_patterns = [
-                # JSON patterns
-                rb'"prompt"\s*:\s*"([^"]+)"',
-                rb'"prompt"\s*:\s*\'([^\']+)\'',
-                rb'"description"\s*:\s*"([^"]+)"',
-                rb'"text"\s*:\s*"([^"]+)"',
-                rb'"positive_prompt"\s*:\s*"([^"]+)"',
-                
-                # Key-value patterns
-                rb'prompt[=:]\s*([^\r\n&]+)',
-                rb'description[=:]\s*([^\r\n&]+)',
-                
-                # Tagged patterns
-                rb'<prompt>(.*?)</prompt>',
-                rb'<description>(.*?)</description>',
-                rb'Prompt:\s*([^\r\n]+)',
-                rb'Generated with:\s*([^\r\n]+)',
-                
-                # Midjourney patterns
-                rb'/imagine\s+([^\r\n]+)',
-                rb'--ar \d+:\d+\s+([^\r\n]+)',
-                rb'--v \d+\s+([^\r\n]+)',
-                
-                # Stable Diffusion patterns
-                rb'Steps: \d+, Sampler: [^,]+, CFG scale: [\d\.]+, Seed: \d+',
-                rb'Negative prompt:(.*?)Steps:',
-                
-                # Additional patterns
-                rb'parameters\s*:\s*(.*?)(?:\n\n|\Z)',
-                rb'DALL-E\s+\d\s+([^\r\n]+)'
-            ]
-            
-            # Collect all potential prompts
-            found_prompts = []
-            
-            for pattern in prompt_patterns:
-                matches = re.findall(pattern, file_data)
-                for match in matches:
-                    try:
-                        text = match.decode('utf-8', errors='ignore')
-                        # Clean up the text
-                        text = re.sub(r'[^\x20-\x7E]', ' ', text).strip()
-                        # Deduplicate and filter very short matches
-                        if len(text) > 15 and text not in [p[0] for p in found_prompts]:
-                            found_prompts.append((text, len(text)))
-                    except:
-                        pass
-            
-            # Sort by length (longer texts are more likely to be actual prompts)
-            found_prompts.sort(key=lambda x: x[1], reverse=True)
-            
-            # Update UI on main thread
-            Clock.schedule_once(lambda dt: self._update_deep_scan_results(found_prompts), 0)
+            candidates = self.deep_scan_file(file_path, on_update=push)
+            best, total = candidates.best(), candidates.total
+            Clock.schedule_once(lambda dt: self._update_deep_scan_results(file_path, best, total), 0)
             
         except Exception as e:
             Clock.schedule_once(lambda dt: self.update_status(f"Deep scan error: {str(e)}"), 0)
     
-    def _update_deep_scan_results(self, found_prompts):
-        """Update UI with deep scan results"""
-        if found_prompts:
+    def _update_deep_scan_results(self, file_path, best, total, bytes_scanned=None):
+        """Update UI with deep scan results; bytes_scanned is None once the scan is done"""
+        # Ignore results for a file that is no longer displayed
+        if file_path != self.current_file:
+            return
+        
+        if best:
             # Update prompt text area with selectable text
-            self.ids.prompt_text.text = "Possible AI prompts found:\n\n"
-            
-            for i, (prompt, length) in enumerate(found_prompts[:10]):  # Show top 10
-                self.ids.prompt_text.text += f"#{i+1} (Length: {length}):\n{prompt}\n\n"
+            lines = ["Possible AI prompts found:\n"]
+            for i, (prompt, score) in enumerate(best):
+                lines.append(f"#{i+1} (Score: {score}, Length: {len(prompt)}):\n{prompt}\n")
+            self.ids.prompt_text.text = "\n".join(lines)
             
             # Update AI info
-            self.ids.ai_info.text = f"Deep scan found {len(found_prompts)} potential prompts"
-            self.update_status(f"Deep scan complete. Found {len(found_prompts)} potential prompts.")
+            self.ids.ai_info.text = f"Deep scan found {total} potential prompts"
             
             # Save the best prompt
-            if found_prompts:
-                self.detected_ai_prompt = found_prompts[0][0]
-        else:
+            self.detected_ai_prompt = best[0][0]
+        elif bytes_scanned is None:
             self.ids.prompt_text.text = "No potential AI prompts found in deep scan."
             self.ids.ai_info.text = "Deep scan found no AI prompts"
+        
+        if bytes_scanned is not None:
+            file_size = max(os.path.getsize(file_path), 1)
+            self.update_status(f"Deep scanning... {min(100, bytes_scanned * 100 // file_size)}% "
+                               f"({total} potential prompts so far)")
+        elif total:
+            self.update_status(f"Deep scan complete. Found {total} potential prompts.")
+        else:
             self.update_status("Deep scan complete. No prompts found.")
         
         # Make sure the prompt text is editable and selectable
@@ -1257,14 +1258,21 @@ class MetadataDisplay(BoxLayout):
         
         # Launch save dialog - but this isn't available in Kivy by default
         # In a full app, you'd implement a proper save dialog
+        output_path = os.path.join(os.path.dirname(self.current_file), default_name)
+        # Values left in the file are read back in full, so write on a thread
+        threading.Thread(target=self._export_metadata_thread,
+                         args=(output_path, self.current_metadata)).start()
+    
+    def _export_metadata_thread(self, output_path, metadata):
+        """Background thread writing an export; reports back on the main thread"""
         try:
-            output_path = os.path.join(os.path.dirname(self.current_file), default_name)
             with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_metadata, f, indent=4, default=str)
+                json.dump(metadata, f, indent=4, default=blob_json_default)
             
-            self.update_status(f"Metadata exported to {output_path}")
+            Clock.schedule_once(lambda dt: self.update_status(f"Metadata exported to {output_path}"), 0)
         except Exception as e:
-            self.update_status(f"Export error: {str(e)}")
+            message = f"Export error: {str(e)}"
+            Clock.schedule_once(lambda dt: self.update_status(message), 0)
     
     def export_prompt(self):
         """Export detected prompt to a text file"""
@@ -1463,4 +1471,4 @@ class AIMetadataApp(App):
         return MetadataDisplay()
 
 if __name__ == '__main__':
-    AIMetadataApp().run()
\ No newline at end of file
+    AIMetadataApp().run()
@@ -0,0 +1,740 @@
+"""Command-line modes of MetaProbe
+
+Run as `python metaprobe_cli.py <command>` or `python MetaProbe.py <command>`.
+Nothing here imports Kivy, and Pillow/pymediainfo are only loaded once a
+file actually needs them.
+"""
+import os
+import sys
+import json
+import time
+
+from metaprobe_core import (
+    MetadataExtractor, NearDuplicateIndex, ExtractionCache, AsyncBatchRunner,
+    LibraryStats, BatchJournal, BatchMerger, SUPPORTED_IMAGE_EXT, iter_media_files, iter_jsonl_records,
+    is_archive, shard_of, blob_json_default
+)
+from metaprobe_mediainfo import MEDIAINFO_DEPTHS, MEDIAINFO_TIMEOUT
+
+def add_video_arguments(parser):
+    """Options of the process-isolated video parser"""
+    parser.add_argument('--video-depth', choices=list(MEDIAINFO_DEPTHS), default='normal',
+                        help='MediaInfo parse depth: quick reads container headers, full the whole '
+                             'file (default: normal)')
+    parser.add_argument('--video-timeout', type=float, default=MEDIAINFO_TIMEOUT, metavar='SECONDS',
+                        help=f'give up on a video after this long (default: {MEDIAINFO_TIMEOUT:g})')
+
+def shard_argument(value):
+    """argparse type of --shard i/N; returns (i - 1, N)"""
+    import argparse
+    index, _, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"expected i/N with 1 <= i <= N, got {value!r}")
+    return index - 1, count
+
+def add_shard_argument(parser):
+    """Option splitting a scan across machines"""
+    parser.add_argument('--shard', type=shard_argument, metavar='I/N',
+                        help='only process shard I of N (1-based), chosen by a hash of each path; '
+                             'run every shard with the same paths and combine them with merge')
+
+def run_similar(args):
+    """Command-line mode: find near-duplicate images by perceptual hash"""
+    extractor = MetadataExtractor()
+    index = NearDuplicateIndex()
+    
+    for file_path in iter_media_files(args.paths, SUPPORTED_IMAGE_EXT):
+        result = extractor.extract_result(file_path)
+        extractor.last_thumbnail = None
+        if result.dhash is not None:
+            index.add(file_path, result.dhash)
+        else:
+            print(f"Skipped {file_path}: {result.sections.get('Error', {}).get('Processing Error', 'no hash')}",
+                  file=sys.stderr)
+    
+    if args.query:
+        result = extractor.extract_result(args.query)
+        if result.dhash is None:
+            print(f"Error: could not hash {args.query}", file=sys.stderr)
+            return 1
+        for distance, file_path in index.query(result.dhash, args.distance):
+            print(f"{distance:2d}  {file_path}")
+        return 0
+    
+    groups = index.groups(args.distance)
+    for i, group in enumerate(groups):
+        print(f"Group {i + 1} ({len(group)} files):")
+        for file_path in group:
+            print(f"    {file_path}")
+    print(f"{len(groups)} near-duplicate groups among {len(index)} images")
+    return 0
+
+def extract_paths(paths, cache, args, on_result, skip=()):
+    """Extract media files, folders and archives with the async batch runner
+    
+    on_result(path, (ExtractionResult, duplicate_of), error) is called once
+    per file or archive member, in completion order. Files and members
+    whose path is in `skip` are left out. With args.shard set, only the
+    files (and whole archives) of that shard are extracted.
+    """
+    runner = AsyncBatchRunner(cache, concurrency=args.concurrency, workers=args.workers)
+    archives = []
+    shard = getattr(args, 'shard', None)
+    
+    def plain_files():
+        # Archives are read sequentially afterwards; tar members can't be fetched in parallel
+        for file_path in iter_media_files(paths, archives=True):
+            if shard is not None and shard_of(file_path, shard[1]) != shard[0]:
+                continue
+            if is_archive(file_path):
+                archives.append(file_path)
+            elif file_path not in skip:
+                yield file_path
+    
+    runner.run(plain_files(), on_result)
+    for archive_path in archives:
+        try:
+            for key, extraction, error in cache.extract_archive(archive_path, skip):
+                on_result(key, extraction, error)
+        except Exception as e:
+            # Unreadable or corrupt archive; members already reported stay valid
+            on_result(archive_path, None, e)
+
+def run_batch(args):
+    """Command-line mode: extract metadata for many files as JSON lines"""
+    extractor = MetadataExtractor()
+    extractor.scan_budget = args.scan_budget
+    extractor.perceptual_hash = not args.no_dhash
+    extractor.mediainfo_depth = args.video_depth
+    extractor.mediainfo_timeout = args.video_timeout
+    cache = ExtractionCache(extractor, fast=args.fast_hash)
+    stats = LibraryStats() if args.stats else None
+    count = 0
+    
+    if args.resume and (not args.output or args.no_journal):
+        print("Error: --resume needs the -o file of the interrupted run, and its journal", file=sys.stderr)
+        return 1
+    journal = None
+    if args.output and not args.no_journal:
+        try:
+            journal = BatchJournal(args.output, resume=args.resume)
+            # Stats and duplicate groups also cover the files finished before
+            for record in journal.records():
+                if stats is not None:
+                    stats.add(record)
+                if record.get("content_hash"):
+                    cache.add_known(record["path"], record["content_hash"])
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot resume {args.output}: {e}", file=sys.stderr)
+            return 1
+        if journal.done:
+            print(f"Resuming: {len(journal.done)} files already done", file=sys.stderr)
+        output = None
+    else:
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    
+    def write_result(file_path, result, error):
+        nonlocal count
+        if error is not None:
+            print(f"Error: {file_path}: {error}", file=sys.stderr)
+            return
+        extraction, duplicate_of = result
+        record = extraction.to_record()
+        record["duplicate_of"] = duplicate_of
+        try:
+            # Large values are read back from the file as the line is written
+            line = json.dumps(record, default=blob_json_default)
+        except (OSError, ValueError) as e:
+            print(f"Error: {file_path}: {e}", file=sys.stderr)
+            return
+        if journal is not None:
+            if not journal.write(file_path, line):
+                # Listed twice in this run's input
+                return
+        else:
+            output.write(line + "\n")
+        if stats is not None:
+            stats.add(record)
+        count += 1
+    
+    try:
+        extract_paths(args.paths, cache, args, write_result, journal.done.copy() if journal else ())
+    finally:
+        if journal is not None:
+            journal.close()
+        elif output is not sys.stdout:
+            output.close()
+    
+    if stats is not None:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, indent=4)
+    
+    groups = cache.duplicate_groups()
+    if args.duplicates:
+        with open(args.duplicates, 'w', encoding='utf-8') as f:
+            json.dump(groups, f, indent=4)
+    duplicate_count = sum(len(group) - 1 for group in groups)
+    print(f"Extracted {count} files ({duplicate_count} duplicates in {len(groups)} groups)",
+          file=sys.stderr)
+    return 0
+
+def run_merge(args):
+    """Command-line mode: combine the `batch` outputs of several shards into one index"""
+    merger = BatchMerger()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    count = 0
+    try:
+        for path in args.inputs:
+            try:
+                for record in iter_jsonl_records(path):
+                    merged = merger.add(record)
+                    if merged is not None:
+                        output.write(json.dumps(merged) + "\n")
+                        count += 1
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Error: {path}: {e}", file=sys.stderr)
+                return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(merger.stats.to_dict(), f, indent=4)
+    groups = merger.duplicate_groups()
+    if args.duplicates:
+        with open(args.duplicates, 'w', encoding='utf-8') as f:
+            json.dump(groups, f, indent=4)
+    duplicate_count = sum(len(group) - 1 for group in groups)
+    print(f"Merged {count} files from {len(args.inputs)} outputs ({duplicate_count} duplicates in "
+          f"{len(groups)} groups)", file=sys.stderr)
+    if merger.repeated:
+        # Shards of one scan never overlap; repeats mean mixed paths or shard counts
+        print(f"Warning: skipped {merger.repeated} records whose path was already merged", file=sys.stderr)
+    return 0
+
+def run_stats(args):
+    """Command-line mode: aggregate generators, models, samplers, sizes and prompt lengths
+    
+    Inputs may be media files, folders and archives (extracted now), batch
+    .jsonl output (aggregated without extracting) or .json partial stats
+    from `stats -o` / `batch --stats` (merged).
+    """
+    stats = LibraryStats()
+    media = []
+    for path in args.inputs:
+        lower = path.lower()
+        try:
+            if lower.endswith('.jsonl'):
+                for record in iter_jsonl_records(path):
+                    stats.add(record)
+            elif lower.endswith('.json'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    stats.merge(LibraryStats.from_dict(json.load(f)))
+            else:
+                media.append(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: {path}: {e}", file=sys.stderr)
+            return 1
+    
+    if media:
+        extractor = MetadataExtractor()
+        extractor.scan_budget = args.scan_budget
+        # Stats never look at the dHash; skip the pixel decode it needs
+        extractor.perceptual_hash = False
+        extractor.mediainfo_depth = args.video_depth
+        extractor.mediainfo_timeout = args.video_timeout
+        cache = ExtractionCache(extractor, fast=args.fast_hash)
+        live = sys.stderr.isatty()
+        last_update = 0
+        
+        def add_result(file_path, result, error):
+            nonlocal last_update
+            if error is not None:
+                print(f"Error: {file_path}: {error}", file=sys.stderr)
+                return
+            stats.add(result[0])
+            # Stats are complete after every file; show them as they grow
+            now = time.monotonic()
+            if live and now - last_update >= 0.5:
+                last_update = now
+                top = stats.generators.most_common(1)
+                leader = f", top generator {top[0][0]} ({top[0][1]})" if top else ""
+                print(f"\r{stats.files} files{leader}\033[K", end="", file=sys.stderr)
+        
+        extract_paths(media, cache, args, add_result)
+        if live:
+            print(file=sys.stderr)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, indent=4)
+    if args.json:
+        print(json.dumps(stats.to_dict(), indent=4))
+    else:
+        print(stats.summary(args.top))
+    return 0
+
+def run_strip(args):
+    """Command-line mode: remove or rewrite metadata without re-encoding pixels"""
+    from metaprobe_strip import MetadataStripper, StripPlan, STRIP_CATEGORIES, iter_strip_targets
+    keep = {name.strip() for value in args.keep for name in value.split(',') if name.strip()}
+    unknown = keep - set(STRIP_CATEGORIES)
+    if unknown:
+        print(f"Error: unknown --keep {', '.join(sorted(unknown))} (choose from {', '.join(STRIP_CATEGORIES)})",
+              file=sys.stderr)
+        return 1
+    set_text = {}
+    for assignment in args.set:
+        key, sep, value = assignment.partition('=')
+        if not sep or not 0 < len(key) < 80:
+            print(f"Error: --set expects KEY=VALUE with a 1-79 character key: {assignment}", file=sys.stderr)
+            return 1
+        set_text[key] = value
+    
+    plan = StripPlan(drop=frozenset(STRIP_CATEGORIES) - keep, keep_keys=frozenset(args.keep_key),
+                     set_text=set_text)
+    stripper = MetadataStripper(plan, dry_run=args.dry_run, workers=args.workers)
+    count = changed = errors = 0
+    saved = processed = 0
+    start = time.perf_counter()
+    
+    def report(file_path, result, error):
+        nonlocal count, changed, errors, saved, processed
+        count += 1
+        if error is not None:
+            errors += 1
+            print(f"Error: {file_path}: {error}", file=sys.stderr)
+            return
+        processed += result.size_before
+        if result.changed:
+            changed += 1
+            saved += result.size_before - result.size_after
+            edits = [f"-{name}" for name in result.removed] + [f"+{name}" for name in result.added]
+            print(f"{file_path}: {', '.join(edits)}")
+    
+    stripper.run(iter_strip_targets(args.paths, args.output_dir), report)
+    elapsed = time.perf_counter() - start
+    verb = "Would change" if args.dry_run else "Changed"
+    print(f"{verb} {changed} of {count} files, {saved / 1024:.1f} KB of metadata removed "
+          f"({processed / 1024 / 1024 / max(elapsed, 1e-6):.0f} MB/s)", file=sys.stderr)
+    return 1 if errors else 0
+
+def run_extract(args):
+    """Command-line mode: print one file's metadata as JSON"""
+    extractor = MetadataExtractor()
+    extractor.scan_budget = args.scan_budget
+    extractor.mediainfo_depth = args.video_depth
+    extractor.mediainfo_timeout = args.video_timeout
+    try:
+        result = extractor.extract_result(args.path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if args.raw:
+        print(result.to_json())
+    else:
+        print(json.dumps(result.to_dict(), indent=4, default=blob_json_default))
+    return 0
+
+def run_serve(args):
+    """Command-line mode: run the extraction daemon"""
+    from metaprobe_server import MetaProbeServer
+    server = MetaProbeServer(args.socket, workers=args.workers, max_in_flight=args.max_in_flight,
+                             cache_entries=args.cache_entries, fast_hash=args.fast_hash,
+                             scan_budget=args.scan_budget, video_depth=args.video_depth,
+                             video_timeout=args.video_timeout)
+    try:
+        server.serve_forever()
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+def run_call(args):
+    """Command-line mode: send one request to a running daemon"""
+    from metaprobe_server import MetaProbeClient, RPCError
+    try:
+        params = json.loads(args.params)
+    except ValueError as e:
+        print(f"Error: params are not valid JSON: {e}", file=sys.stderr)
+        return 1
+    try:
+        with MetaProbeClient(args.socket) as client:
+            result = client.call(args.method, **params)
+    except (OSError, RPCError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=4, default=str))
+    return 0
+
+def run_startup_check(args):
+    """Command-line mode: fail if importing the command-line modes got slow
+    
+    Imports this module in a fresh interpreter, so the measurement includes
+    everything a scripted call pays before it can start extracting.
+    """
+    import subprocess
+    probe = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import metaprobe_cli\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        "heavy = sorted(m for m in ('kivy', 'PIL', 'pymediainfo', 'asyncio') if m in sys.modules)\n"
+        "print(elapsed, ','.join(heavy))\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', probe], cwd=here, check=True,
+                            capture_output=True, text=True).stdout.split()
+    total_ms = (time.perf_counter() - start) * 1000
+    import_ms = float(output[0])
+    heavy = output[1].split(',') if len(output) > 1 else []
+    
+    print(f"import metaprobe_cli: {import_ms:.1f} ms")
+    print(f"interpreter start + import: {total_ms:.1f} ms (budget {args.budget_ms} ms)")
+    failed = False
+    if heavy:
+        print(f"FAIL: imported at startup: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("FAIL: startup over budget")
+        failed = True
+    return 1 if failed else 0
+
+def run_golden(args):
+    """Command-line mode: record reference outputs and timings of a corpus"""
+    from metaprobe_golden import collect_outputs, relative_record
+    files = list(iter_media_files(args.paths))
+    try:
+        records = collect_outputs(files, args.tree, args.repeat)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for file_path in files:
+            record = records[os.path.abspath(file_path)]
+            if args.relative_to:
+                record = relative_record(record, args.relative_to)
+            f.write(json.dumps(record) + "\n")
+    print(f"Recorded {len(records)} files to {args.output}", file=sys.stderr)
+    return 0
+
+def run_equivalence(args):
+    """Command-line mode: check this tree's extractors against a reference
+    
+    Fails if any output field differs from the reference (a speed-up that
+    changes results doesn't count), or if a format's mean time per file is
+    over its budget or, with --max-slowdown, too far behind the reference.
+    """
+    from metaprobe_golden import (
+        collect_outputs, compare_records, relative_path, relative_record, GOLDEN_BUDGETS_MS
+    )
+    budgets = dict(GOLDEN_BUDGETS_MS)
+    for budget in args.budget:
+        ext, sep, ms = budget.partition('=')
+        try:
+            budgets['.' + ext.lower().lstrip('.')] = float(ms)
+        except ValueError:
+            print(f"Error: --budget expects FORMAT=MS: {budget}", file=sys.stderr)
+            return 1
+    
+    files = list(iter_media_files(args.paths))
+    try:
+        if args.golden:
+            with open(args.golden, 'r', encoding='utf-8') as f:
+                reference = {record["path"]: record for record in map(json.loads, f)}
+        else:
+            reference = collect_outputs(files, args.reference, args.repeat)
+        candidate = collect_outputs(files, None, args.repeat)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if args.relative_to:
+        # Golden files recorded with --relative-to store paths inside the corpus folder
+        root = args.relative_to
+        reference = {relative_path(path, root): relative_record(record, root) for path, record in reference.items()}
+        candidate = {relative_path(path, root): relative_record(record, root) for path, record in candidate.items()}
+    
+    failed = False
+    differing = 0
+    totals = {}  # format -> [files, reference ms, candidate ms]
+    for file_path in files:
+        key = os.path.abspath(file_path)
+        if args.relative_to:
+            key = relative_path(key, args.relative_to)
+        if key not in reference:
+            print(f"MISSING: no reference for {file_path}")
+            failed = True
+            continue
+        expected, actual = reference[key], candidate[key]
+        differences = compare_records(expected, actual)
+        if differences:
+            differing += 1
+            print(f"DIFF {file_path}:")
+            for name, field, a, b in differences[:args.show]:
+                print(f"    {name} {field}: {a!r} -> {b!r}")
+            if len(differences) > args.show:
+                print(f"    ... {len(differences) - args.show} more")
+        total = totals.setdefault(expected["format"], [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += sum(expected["ms"].values())
+        total[2] += sum(actual["ms"].values())
+    
+    print(f"{'format':8s} {'files':>6s} {'reference':>12s} {'candidate':>12s} {'speed-up':>9s} {'budget':>9s}")
+    for file_ext, (count, reference_ms, candidate_ms) in sorted(totals.items()):
+        reference_mean, candidate_mean = reference_ms / count, candidate_ms / count
+        budget = budgets.get(file_ext)
+        speedup = reference_mean / candidate_mean if candidate_mean else float('inf')
+        print(f"{file_ext:8s} {count:6d} {reference_mean:9.1f} ms {candidate_mean:9.1f} ms "
+              f"{speedup:8.2f}x {budget if budget is not None else '-':>9}")
+        if budget is not None and candidate_mean > budget:
+            print(f"FAIL: {file_ext} takes {candidate_mean:.1f} ms per file, over its {budget:g} ms budget")
+            failed = True
+        if args.max_slowdown and candidate_mean > reference_mean * args.max_slowdown:
+            print(f"FAIL: {file_ext} is {1 / speedup:.2f}x slower than the reference")
+            failed = True
+    if differing:
+        print(f"FAIL: {differing} of {len(files)} files differ from the reference")
+        failed = True
+    return 1 if failed else 0
+
+# Building blocks of the scan-check inputs: pattern prefixes, their closers
+# and JSON punctuation, repeated and mixed in ways that used to backtrack
+SCAN_CHECK_ATOMS = (
+    b'{"prompt":', b'{"data":', b'{"data":"x"}', b'"prompt":"', b'"prompt":\'', b'"text": "',
+    b'<prompt>', b'</prompt>', b'<description>', b'Negative prompt:', b'Steps: 20, Sampler: ',
+    b'parameters:', b'prompt=', b'Prompt: ', b'/imagine ', b'--ar 2:3 ', b'DALL-E 3 ',
+    b'{', b'}', b'[', b'"', b'\\', b' ' * 32, b'\n', b'\n\n', b'x' * 61, b'\xff\xd8'
+)
+
+def scan_check_inputs(rng, size, rounds):
+    """Yield (name, data) inputs for the binary matchers"""
+    yield "random bytes", rng.randbytes(size)
+    for atom in SCAN_CHECK_ATOMS:
+        yield f"repeated {atom[:24]!r}", (atom * (size // len(atom) + 1))[:size]
+        padded = atom + b'x' * 64
+        yield f"spaced {atom[:24]!r}", (padded * (size // len(padded) + 1))[:size]
+    for i in range(rounds):
+        parts, length = [], 0
+        while length < size:
+            parts.append(rng.choice(SCAN_CHECK_ATOMS))
+            length += len(parts[-1])
+        yield f"atom mix #{i + 1}", b''.join(parts)[:size]
+        data = bytearray(rng.randbytes(size))
+        for _ in range(size // 256):
+            atom = rng.choice(SCAN_CHECK_ATOMS)
+            offset = rng.randrange(size - len(atom))
+            data[offset:offset + len(atom)] = atom
+        yield f"random bytes with atoms #{i + 1}", bytes(data)
+
+def scan_check_scanners(extractor):
+    """(name, function of the data) of each binary matcher the scan check times"""
+    from metaprobe_core import PromptCandidates, SD_BINARY_PATTERN
+    return (
+        ("binary fallback", extractor.extract_metadata_from_binary),
+        ("parameters block", SD_BINARY_PATTERN.search),
+        ("deep scan", lambda data: extractor._scan_for_candidates(data, len(data), PromptCandidates())),
+    )
+
+def run_scan_check(args):
+    """Command-line mode: fail if any fuzz input makes the binary scans slow
+    
+    Times the binary fallback, the Stable Diffusion block search and the
+    deep-scan matchers on generated inputs and reports the slowest, in
+    milliseconds per MB scanned. tests/test_scan_time.py runs the same
+    check on smaller inputs; this mode is for trying other sizes and seeds.
+    """
+    import random
+    scanners = scan_check_scanners(MetadataExtractor())
+    rng = random.Random(args.seed)
+    size = args.size_kb * 1024
+    timings = []
+    for name, data in scan_check_inputs(rng, size, args.rounds):
+        for scanner, scan in scanners:
+            start = time.perf_counter()
+            scan(data)
+            ms_per_mb = (time.perf_counter() - start) * 1000 * 1024 * 1024 / len(data)
+            timings.append((ms_per_mb, scanner, name))
+    
+    timings.sort(reverse=True)
+    print(f"{len(timings) // len(scanners)} inputs of {args.size_kb} KB, slowest (budget {args.budget_ms} ms/MB):")
+    for ms_per_mb, scanner, name in timings[:args.top]:
+        print(f"{ms_per_mb:8.1f} ms/MB  {scanner}: {name}")
+    over = [timing for timing in timings if timing[0] > args.budget_ms]
+    if over:
+        print(f"FAIL: {len(over)} scans over budget")
+        return 1
+    return 0
+
+def main(argv=None):
+    """Entry point for the command-line modes"""
+    argv = sys.argv[1:] if argv is None else argv
+    
+    import argparse
+    parser = argparse.ArgumentParser(prog='metaprobe', description='AI media metadata extractor')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    extract = subparsers.add_parser('extract', help='print the metadata of one file')
+    extract.add_argument('path', help='media file, or archive!member inside a zip/tar')
+    extract.add_argument('--raw', action='store_true',
+                         help='print the raw record (numbers, hashes) instead of the display tree')
+    extract.add_argument('--scan-budget', type=int, default=None, metavar='BYTES',
+                         help='binary fallbacks read only the first and last BYTES / 2 of the file')
+    add_video_arguments(extract)
+    extract.set_defaults(func=run_extract)
+    
+    similar = subparsers.add_parser('similar', help='find near-duplicate images')
+    similar.add_argument('paths', nargs='+', help='image files or folders to index')
+    similar.add_argument('--query', help='list only the images similar to this file')
+    similar.add_argument('--distance', type=int, default=6,
+                         help='maximum dHash Hamming distance (default: 6)')
+    similar.set_defaults(func=run_similar)
+    
+    batch = subparsers.add_parser('batch', help='extract metadata from many files')
+    batch.add_argument('paths', nargs='+', help='media files, zip/tar archives or folders')
+    batch.add_argument('-o', '--output', help='JSON lines output file (default: stdout)')
+    batch.add_argument('--fast-hash', action='store_true',
+                       help='identify duplicates by size + head + tail instead of full contents')
+    batch.add_argument('--duplicates', help='write duplicate groups to this JSON file')
+    batch.add_argument('--concurrency', type=int, default=16,
+                       help='files read ahead and in flight at once (default: 16)')
+    batch.add_argument('--workers', type=int, default=None,
+                       help='parse worker threads (default: up to 4)')
+    batch.add_argument('--scan-budget', type=int, default=None, metavar='BYTES',
+                       help='quick scan: binary fallbacks read only the first and last BYTES / 2 of each file')
+    batch.add_argument('--no-dhash', action='store_true',
+                       help='leave out the perceptual hash and the pixel decode it needs')
+    batch.add_argument('--stats', metavar='FILE',
+                       help='also write mergeable library stats (see the stats command) to FILE')
+    batch.add_argument('--resume', action='store_true',
+                       help='continue an interrupted run: keep the results committed to -o FILE '
+                            '(per FILE.journal) and skip those files; pass the same paths as before')
+    batch.add_argument('--no-journal', action='store_true',
+                       help='do not keep the FILE.journal that --resume needs')
+    add_shard_argument(batch)
+    add_video_arguments(batch)
+    batch.set_defaults(func=run_batch)
+    
+    stats = subparsers.add_parser('stats', help='aggregate generators, models, samplers, sizes '
+                                                'and prompt lengths')
+    stats.add_argument('inputs', nargs='+',
+                       help='media files, folders or archives to extract; batch .jsonl output; '
+                            'or .json partial stats to merge')
+    stats.add_argument('-o', '--output', help='write the mergeable stats as JSON to this file')
+    stats.add_argument('--json', action='store_true', help='print the stats as JSON')
+    stats.add_argument('--top', type=int, default=10, help='values listed per field (default: 10)')
+    stats.add_argument('--fast-hash', action='store_true',
+                       help='identify duplicates by size + head + tail instead of full contents')
+    stats.add_argument('--concurrency', type=int, default=16,
+                       help='files read ahead at once (default: 16)')
+    stats.add_argument('--workers', type=int, default=None,
+                       help='parse worker threads (default: CPU count, at most 4)')
+    stats.add_argument('--scan-budget', type=int, default=None, metavar='BYTES',
+                       help='binary fallbacks read only the first and last BYTES / 2 of the file')
+    add_shard_argument(stats)
+    add_video_arguments(stats)
+    stats.set_defaults(func=run_stats)
+    
+    merge = subparsers.add_parser('merge', help='combine the batch outputs of several shards into one index')
+    merge.add_argument('inputs', nargs='+', help='batch .jsonl outputs, one per shard')
+    merge.add_argument('-o', '--output', help='merged JSON lines output file (default: stdout)')
+    merge.add_argument('--stats', metavar='FILE', help='write library stats of the merged index to FILE')
+    merge.add_argument('--duplicates', help='write duplicate groups across all shards to this JSON file')
+    merge.set_defaults(func=run_merge)
+    
+    strip = subparsers.add_parser('strip', help='remove or rewrite PNG/JPEG metadata without '
+                                                're-encoding the image')
+    strip.add_argument('paths', nargs='+', help='PNG/JPEG files or folders')
+    strip.add_argument('-o', '--output-dir',
+                       help='write stripped copies here, keeping folder layout (default: rewrite in place)')
+    strip.add_argument('--keep', action='append', default=[], metavar='CATEGORIES',
+                       help='comma-separated categories to leave alone: text, exif, xmp, iptc, trailer '
+                            '(default: strip all)')
+    strip.add_argument('--keep-key', action='append', default=[], metavar='KEY',
+                       help='keep PNG text chunks with this keyword (e.g. Software); "Comment" keeps '
+                            'JPEG comments')
+    strip.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                       help='write this text chunk instead (a comment segment in JPEGs)')
+    strip.add_argument('--dry-run', action='store_true', help='report what would change, write nothing')
+    strip.add_argument('--workers', type=int, default=8, help='files rewritten in parallel (default: 8)')
+    strip.set_defaults(func=run_strip)
+    
+    serve = subparsers.add_parser('serve', help='run a JSON-RPC extraction daemon on a Unix socket')
+    serve.add_argument('--socket', help='socket path (default: metaprobe-<uid>.sock in '
+                                        '$XDG_RUNTIME_DIR or the temp dir)')
+    serve.add_argument('--workers', type=int, default=None,
+                       help='extraction threads (default: CPU count, at most 4)')
+    serve.add_argument('--max-in-flight', type=int, default=64,
+                       help='requests running per connection before reads pause (default: 64)')
+    serve.add_argument('--cache-entries', type=int, default=10000,
+                       help='files and contents kept in the result caches (default: 10000)')
+    serve.add_argument('--fast-hash', action='store_true',
+                       help='identify duplicates by size + head + tail instead of full contents')
+    serve.add_argument('--scan-budget', type=int, default=None, metavar='BYTES',
+                       help='binary fallbacks read only the first and last BYTES / 2 of the file')
+    add_video_arguments(serve)
+    serve.set_defaults(func=run_serve)
+    
+    call = subparsers.add_parser('call', help='send one request to a running daemon')
+    call.add_argument('method', help='extract, deep_scan, batch or stats')
+    call.add_argument('params', nargs='?', default='{}',
+                      help='JSON object of parameters, e.g. \'{"path": "a.png"}\'')
+    call.add_argument('--socket', help='socket path of the daemon')
+    call.set_defaults(func=run_call)
+    
+    startup = subparsers.add_parser('startup-check',
+                                    help='regression check: command-line startup time and imports')
+    startup.add_argument('--budget-ms', type=float, default=100,
+                         help='maximum interpreter start + import time (default: 100)')
+    startup.set_defaults(func=run_startup_check)
+    
+    golden = subparsers.add_parser('golden', help='record reference outputs and timings for equivalence')
+    golden.add_argument('paths', nargs='+', help='media files or folders of the corpus')
+    golden.add_argument('-o', '--output', required=True, help='golden JSON lines file to write')
+    golden.add_argument('--tree', help='source tree to record (default: this one)')
+    golden.add_argument('--repeat', type=int, default=3, help='timed runs per call, best kept (default: 3)')
+    golden.add_argument('--relative-to', metavar='DIR',
+                        help='store paths relative to this folder, so the file can be committed with the corpus')
+    golden.set_defaults(func=run_golden)
+    
+    equivalence = subparsers.add_parser('equivalence',
+                                        help='regression check: outputs and speed against a reference')
+    equivalence.add_argument('paths', nargs='+', help='media files or folders of the corpus')
+    reference = equivalence.add_mutually_exclusive_group(required=True)
+    reference.add_argument('--golden', help='reference outputs recorded by the golden command')
+    reference.add_argument('--reference', metavar='TREE',
+                           help='source tree to run as the reference, e.g. a git worktree of main')
+    equivalence.add_argument('--budget', action='append', default=[], metavar='FORMAT=MS',
+                             help='mean ms per file allowed for a format, e.g. png=40 '
+                                  '(default: 100 for images, 2000 for videos)')
+    equivalence.add_argument('--max-slowdown', type=float, default=None, metavar='FACTOR',
+                             help='also fail if a format is this many times slower than the reference')
+    equivalence.add_argument('--repeat', type=int, default=3,
+                             help='timed runs per call, best kept (default: 3)')
+    equivalence.add_argument('--show', type=int, default=10, help='differences listed per file (default: 10)')
+    equivalence.add_argument('--relative-to', metavar='DIR',
+                             help='compare paths relative to this folder, as a golden file recorded with '
+                                  '--relative-to stores them')
+    equivalence.set_defaults(func=run_equivalence)
+    
+    scan_check = subparsers.add_parser('scan-check',
+                                       help='regression check: binary scan time on fuzzed inputs')
+    scan_check.add_argument('--budget-ms', type=float, default=500,
+                            help='maximum scan time per MB of input (default: 500)')
+    scan_check.add_argument('--size-kb', type=int, default=1024, help='size of each input (default: 1024)')
+    scan_check.add_argument('--rounds', type=int, default=10,
+                            help='randomly mixed inputs of each kind (default: 10)')
+    scan_check.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    scan_check.add_argument('--top', type=int, default=10, help='slowest scans listed (default: 10)')
+    scan_check.set_defaults(func=run_scan_check)
+    
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,3388 @@
+"""Metadata extraction for MetaProbe, free of any UI code
+
+Pillow and pymediainfo are imported the first time they are needed, so
+importing this module - and running the command-line modes - is cheap.
+"""
+import os
+import sys
+import io
+import re
+import json
+import struct
+import hashlib
+import zlib
+import threading
+import time
+import heapq
+import bisect
+from collections import Counter, OrderedDict
+import math
+import operator
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+
+# Optional dependencies, imported on first use by have_pil() / have_mediainfo()
+PILImage = None
+ExifTags = None
+HAS_PIL = None
+pymediainfo = None
+HAS_MEDIAINFO = None
+
+def have_pil():
+    """Import PIL for image processing on first call; True if available"""
+    global PILImage, ExifTags, HAS_PIL
+    if HAS_PIL is None:
+        try:
+            from PIL import Image as PILImage
+            from PIL import ExifTags
+            HAS_PIL = True
+        except ImportError:
+            HAS_PIL = False
+            print("Warning: PIL/Pillow is not installed. Image metadata will be limited.", file=sys.stderr)
+            print("Install with: pip install pillow", file=sys.stderr)
+    return HAS_PIL
+
+def have_mediainfo():
+    """Import pymediainfo for media file analysis on first call; True if available"""
+    global pymediainfo, HAS_MEDIAINFO
+    if HAS_MEDIAINFO is None:
+        try:
+            import pymediainfo
+            HAS_MEDIAINFO = True
+        except ImportError:
+            HAS_MEDIAINFO = False
+            print("Warning: pymediainfo is not installed. Video metadata will be limited.", file=sys.stderr)
+            print("Install with: pip install pymediainfo", file=sys.stderr)
+    return HAS_MEDIAINFO
+
+def open_image(file_path):
+    """PIL.Image.open, importing Pillow if needed"""
+    if not have_pil():
+        raise RuntimeError("PIL/Pillow is not installed")
+    return PILImage.open(file_path)
+
+SUPPORTED_IMAGE_EXT = ['.png', '.jpg', '.jpeg', '.webp', '.avif', '.heic', '.heif']
+# Read by the header-only ISO-BMFF parser instead of Pillow
+BMFF_IMAGE_EXT = ['.avif', '.heic', '.heif']
+SUPPORTED_VIDEO_EXT = ['.mp4', '.mov', '.webm']
+ARCHIVE_EXT = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Archive members are keyed "archive.zip!dir/member.png"
+ARCHIVE_MEMBER_SEP = '!'
+# Members are parsed from their headers; binary fallbacks read at most this much
+ARCHIVE_HEADER_BYTES = 256 * 1024
+# What was read of a tar member is kept for seeking back, in memory up to this size
+ARCHIVE_SPOOL_MEMORY = 16 * 1024 * 1024
+
+# Content hashing reads files in blocks; fast mode hashes size + head + tail
+HASH_BLOCK_SIZE = 1024 * 1024
+FAST_HASH_SPAN = 64 * 1024
+
+# Batch mode reads images up to this size into memory on its I/O threads,
+# so parse workers never wait on storage; larger files are streamed
+PREFETCH_MAX_BYTES = 32 * 1024 * 1024
+
+# Resumable batches commit their progress journal every this many records
+# or seconds, whichever comes first
+JOURNAL_COMMIT_RECORDS = 256
+JOURNAL_COMMIT_SECONDS = 5.0
+
+# Stepping through a folder extracts this many files ahead of the current
+# one (and behind it), keeping at most PREFETCH_MAX_BYTES of results
+PREFETCH_AHEAD = 4
+PREFETCH_BEHIND = 1
+PREFETCH_MAX_BYTES = 32 * 1024 * 1024
+
+# Binary scans read files in windows; the overlap must exceed the longest
+# match a scan pattern is expected to produce
+SCAN_WINDOW_SIZE = 4 * 1024 * 1024
+SCAN_OVERLAP = 64 * 1024
+
+# Binary scans run over untrusted bytes, so every pattern starts with a
+# literal and every repeat is capped. Open-ended bodies also stop at the
+# next occurrence of their own opening literal, so failed attempts never
+# rescan each other's bytes and a whole window costs linear time. Capped
+# matches always fit in the window overlap.
+BINARY_TEXT_MAX = SCAN_OVERLAP - 1024
+# Embedded JSON objects: longest one decoded, deepest nesting followed and
+# decode attempts per scan
+BINARY_JSON_MAX = 1024 * 1024
+BINARY_JSON_MAX_DEPTH = 256
+BINARY_JSON_MAX_TRIES = 64
+
+def compile_bounded(pattern, flags=0):
+    """Compile a binary pattern, with MAX standing for BINARY_TEXT_MAX"""
+    return re.compile(pattern.replace(b'MAX', b'%d' % BINARY_TEXT_MAX), flags)
+
+# One JSON token: a whole string, a brace, or a byte that can't appear in JSON text
+JSON_TOKEN = re.compile(rb'"[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*"|[{}]|[^\s\w,:.+\-\[\]]')
+# Where objects worth decoding start
+BINARY_JSON_START = re.compile(rb'\{"(?:prompt|positive_prompt|data|parameters)":')
+
+# Prompt-like text in raw bytes, tried in order by extract_metadata_from_binary
+BINARY_PROMPT_PATTERNS = [compile_bounded(pattern) for pattern in [
+    rb'"prompt"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    rb'"prompt"\s{0,16}:\s{0,16}\'((?:(?!"prompt")[^\']){1,MAX})\'',
+    rb'"description"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    rb'prompt[=:]\s{0,16}([^\r\n&]{1,MAX})',
+    rb'Prompt:\s{0,16}([^\r\n]{1,MAX})',
+    rb'<prompt>((?:(?!<prompt>)[^\r\n]){0,MAX}?)</prompt>'
+]]
+# An AUTOMATIC1111 "parameters" block, up to a blank line
+SD_BINARY_PATTERN = compile_bounded(rb'parameters\s{0,16}:\s{0,16}((?:(?!\n\n).){0,MAX})', re.DOTALL)
+
+# Deep scan: what to look for, how many results to keep and how often the
+# UI is refreshed while it runs. Smaller windows get first results out sooner.
+DEEP_SCAN_PATTERNS = [compile_bounded(pattern) for pattern in [
+    # JSON patterns
+    rb'"prompt"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    rb'"prompt"\s{0,16}:\s{0,16}\'((?:(?!"prompt")[^\']){1,MAX})\'',
+    rb'"description"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    rb'"text"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    rb'"positive_prompt"\s{0,16}:\s{0,16}"([^"]{1,MAX})"',
+    
+    # Key-value patterns
+    rb'prompt[=:]\s{0,16}([^\r\n&]{1,MAX})',
+    rb'description[=:]\s{0,16}([^\r\n&]{1,MAX})',
+    
+    # Tagged patterns
+    rb'<prompt>((?:(?!<prompt>)[^\r\n]){0,MAX}?)</prompt>',
+    rb'<description>((?:(?!<description>)[^\r\n]){0,MAX}?)</description>',
+    rb'Prompt:\s{0,16}([^\r\n]{1,MAX})',
+    rb'Generated with:\s{0,16}([^\r\n]{1,MAX})',
+    
+    # Midjourney patterns
+    rb'/imagine\s{1,16}([^\r\n]{1,MAX})',
+    rb'--ar \d{1,5}:\d{1,5}\s{1,16}([^\r\n]{1,MAX})',
+    rb'--v \d{1,3}\s{1,16}([^\r\n]{1,MAX})',
+    
+    # Stable Diffusion patterns
+    rb'Steps: \d{1,10}, Sampler: [^,]{1,64}, CFG scale: [\d\.]{1,16}, Seed: \d{1,20}',
+    rb'Negative prompt:((?:(?!Negative prompt:)[^\r\n]){0,MAX}?)Steps:',
+    
+    # Additional patterns
+    rb'parameters\s{0,16}:\s{0,16}((?:(?!parameters)[^\n]){0,MAX}?)(?:\n\n|\Z)',
+    rb'DALL-E\s{1,16}\d\s{1,16}([^\r\n]{1,MAX})'
+]]
+DEEP_SCAN_TOP_K = 10
+DEEP_SCAN_WINDOW_SIZE = 1024 * 1024
+DEEP_SCAN_UPDATE_INTERVAL = 0.1
+# Keys whose decoded text is offered as a candidate as a whole
+DEEP_SCAN_TEXT_KEYS = {'parameters', 'Description', 'Comment', 'UserComment'}
+# Upper bound on what one compressed text chunk may inflate to
+DEEP_SCAN_MAX_INFLATE = 64 * 1024 * 1024
+
+# Container parts that cannot hold prompt text and are never scanned
+PNG_NON_TEXT_CHUNKS = {
+    b'IHDR', b'PLTE', b'IDAT', b'IEND', b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP',
+    b'sBIT', b'bKGD', b'hIST', b'pHYs', b'sPLT', b'tIME', b'acTL', b'fcTL', b'fdAT'
+}
+# JPEG markers: APP0 (JFIF), APP2 (ICC), DQT, DRI and 0xC0-0xCF (SOFn, DHT, DAC)
+JPEG_NON_TEXT_MARKERS = {0xE0, 0xE2, 0xDB, 0xDD} | set(range(0xC0, 0xD0))
+WEBP_NON_TEXT_CHUNKS = {b'VP8 ', b'VP8L', b'VP8X', b'ALPH', b'ANIM', b'ANMF', b'ICCP'}
+
+# ISO-BMFF (HEIF/AVIF): major brands of AVIF files, and limits on what the
+# header parser reads - the meta box and each Exif/XMP item
+BMFF_AVIF_BRANDS = {b'avif', b'avis'}
+BMFF_MAX_META_BYTES = 4 * 1024 * 1024
+BMFF_MAX_ITEM_BYTES = 16 * 1024 * 1024
+
+# Text that marks a candidate as generator output
+PROMPT_MARKERS = ('--ar ', '--v ', '/imagine', 'Negative prompt:', 'Steps: ', 'CFG scale')
+
+# EXIF's 'YYYY:MM:DD HH:MM:SS' date format
+EXIF_DATE_PATTERN = re.compile(r'\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}')
+
+# Sections ExtractionResult.to_dict() shows ahead of AI_Metadata, per kind -
+# the order the image and video pipelines have always built them in
+SECTIONS_BEFORE_AI = {
+    'image': ('Format_Specific',),
+    'video': ('General', 'Video', 'Audio', 'Error', 'Notice'),
+}
+
+# Preview thumbnails are also the source of the perceptual hash
+THUMBNAIL_SIZE = (160, 120)
+# The folder browser keeps them here across runs, one PNG per file version
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'metaprobe', 'thumbnails')
+
+# Metadata text longer than this (workflow JSON, XMP packets, MakerNotes)
+# stays in the file as a BlobRef; results keep only a short preview of it
+BLOB_INLINE_MAX = 1024
+BLOB_PREVIEW_CHARS = 97
+
+# A1111 settings line: `Key: value` pairs separated by commas, where values
+# containing commas are double-quoted with JSON-style escapes
+SD_PARAM_PATTERN = re.compile(r'\s*([\w][\w \-/+.()]*):\s*("(?:\\.|[^\\"])*"|[^,]*)(?:,|$)')
+SD_INT_PATTERN = re.compile(r'-?\d+')
+SD_FLOAT_PATTERN = re.compile(r'-?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?')
+# Settings whose values are names even when they look numeric
+SD_STRING_PARAMS = {'Model', 'VAE', 'Version', 'Sampler', 'Schedule type', 'Hires upscaler'}
+# Settings kept as floats even when written without a decimal point
+SD_FLOAT_PARAMS = {'CFG scale', 'Denoising strength', 'Hires upscale'}
+
+# EXIF tags read by the generator detectors
+EXIF_IMAGE_DESCRIPTION = 0x010E
+EXIF_SOFTWARE = 0x0131
+EXIF_USER_COMMENT = 0x9286
+EXIF_IFD_POINTER = 0x8769
+# TIFF field types read back as text or as raw bytes
+EXIF_BYTE = 1
+EXIF_ASCII = 2
+EXIF_UNDEFINED = 7
+# Text Midjourney leaves in its prompts and descriptions
+MIDJOURNEY_MARKERS = ('--ar', '--v', '--style', 'Job ID:', '/imagine')
+
+# ComfyUI node types used to pull generation settings out of a graph
+COMFYUI_SAMPLER_TYPES = ('KSampler', 'KSamplerAdvanced', 'SamplerCustom')
+COMFYUI_CHECKPOINT_TYPES = ('CheckpointLoaderSimple', 'CheckpointLoader', 'unCLIPCheckpointLoader')
+COMFYUI_LORA_TYPES = ('LoraLoader', 'LoraLoaderModelOnly')
+
+# Widget order of the same nodes in UI-format workflows (None = not needed)
+COMFYUI_WIDGET_NAMES = {
+    'KSampler': ('seed', None, 'steps', 'cfg', 'sampler_name', 'scheduler', 'denoise'),
+    'KSamplerAdvanced': (None, 'noise_seed', None, 'steps', 'cfg', 'sampler_name', 'scheduler'),
+    'CLIPTextEncode': ('text',),
+    'CheckpointLoaderSimple': ('ckpt_name',),
+    'LoraLoader': ('lora_name', 'strength_model', 'strength_clip'),
+    'LoraLoaderModelOnly': ('lora_name', 'strength_model'),
+}
+
+@contextmanager
+def open_binary(source):
+    """Open a path for binary reading, or rewind an already open stream
+    
+    Streams (archive members) are left open for their owner to close.
+    """
+    if hasattr(source, 'read'):
+        source.seek(0)
+        yield source
+    else:
+        with open(source, 'rb') as f:
+            yield f
+
+class PrefetchedFile(io.BytesIO):
+    """The whole contents of a file, read ahead into memory
+    
+    Passed as the source of a loose file, it is parsed like the file
+    itself: unlike an archive member stream, nothing is header-only.
+    """
+    
+    def __init__(self, file_path, data):
+        super().__init__(data)
+        self.name = file_path
+        self.size = len(data)
+
+def header_only_source(source):
+    """True for an archive member stream, of which only the headers are parsed"""
+    return hasattr(source, 'read') and not isinstance(source, PrefetchedFile)
+
+def iter_file_windows(file_path, budget=None, window_size=SCAN_WINDOW_SIZE, overlap=SCAN_OVERLAP,
+                      ranges=None):
+    """Yield (offset, data, owned) windows covering a file
+    
+    Each window holds `owned` new bytes followed by up to `overlap` bytes of
+    the next window, so a match shorter than the overlap that straddles a
+    boundary is still seen whole. Report matches starting before `owned`
+    only; later ones belong to (and are found again in) the next window.
+    
+    With a byte budget only the first and last budget / 2 bytes are read;
+    alternatively `ranges` lists the (start, end) byte ranges to cover.
+    Memory use is bounded by window_size + overlap whatever the file size.
+    
+    file_path may also be an open stream, whose size is unknown: it is read
+    to the end, or only its first `budget` bytes, since finding the tail of
+    a compressed archive member means decompressing all of it.
+    """
+    with open_binary(file_path) as f:
+        size = getattr(f, 'size', None) if f is file_path else os.fstat(f.fileno()).st_size
+        if ranges is not None:
+            if size is not None:
+                ranges = [(max(0, start), min(end, size)) for start, end in ranges]
+        elif size is None:
+            ranges = [(0, float('inf') if budget is None else budget)]
+        elif budget is None or size <= budget:
+            ranges = [(0, size)]
+        else:
+            half = budget // 2
+            ranges = [(0, half), (size - half, size)]
+        
+        for range_start, range_end in ranges:
+            f.seek(range_start)
+            pos = range_start
+            carry = b''
+            while pos < range_end:
+                owned_end = min(pos + window_size, range_end)
+                read_end = min(owned_end + overlap, range_end)
+                wanted = read_end - pos - len(carry)
+                data = carry + f.read(wanted)
+                owned = owned_end - pos
+                if len(data) < len(carry) + wanted:
+                    # End of a stream (or of a file that shrank): no next window follows
+                    if data:
+                        yield pos, data, len(data)
+                    break
+                yield pos, data, owned
+                carry = data[owned:]
+                pos = owned_end
+
+def iter_json_objects(data, start_pattern=BINARY_JSON_START):
+    """Yield the JSON objects in data whose opening matches start_pattern
+    
+    One left-to-right pass over JSON_TOKEN matches braces outside strings,
+    so nested candidates are found together and each byte is tokenized
+    once. A byte that can't appear in JSON text, or nesting deeper than
+    BINARY_JSON_MAX_DEPTH, abandons the objects still open and the scan
+    resumes at the next candidate. Inner objects are yielded before the
+    ones around them.
+    """
+    tries = 0
+    pos = 0
+    while tries < BINARY_JSON_MAX_TRIES:
+        first = start_pattern.search(data, pos)
+        if not first:
+            return
+        pos = first.end()
+        # Opening offsets of the open braces
+        stack = []
+        for token in JSON_TOKEN.finditer(data, first.start()):
+            value = token.group()
+            if value == b'{':
+                if len(stack) >= BINARY_JSON_MAX_DEPTH:
+                    break
+                stack.append(token.start())
+            elif value == b'}':
+                opened = stack.pop()
+                if token.end() - opened <= BINARY_JSON_MAX and start_pattern.match(data, opened):
+                    tries += 1
+                    try:
+                        obj = json.loads(data[opened:token.end()])
+                    except (ValueError, RecursionError):
+                        obj = None
+                    if isinstance(obj, dict):
+                        yield obj
+                    if tries >= BINARY_JSON_MAX_TRIES:
+                        return
+                if not stack:
+                    break
+            elif value[0] != 0x22 or len(value) == 1:
+                # Not JSON, or a string that never closes
+                break
+        pos = max(pos, token.end())
+
+# Every byte value but ASCII letters, for bytes.translate
+NON_LETTER_BYTES = bytes(c for c in range(256) if not chr(c).isascii() or not chr(c).isalpha())
+
+def score_prompt_candidate(text):
+    """Rank deep-scan text by how much it reads like a generation prompt
+    
+    Raw length favours base64 runs and binary noise; this rewards
+    letter-heavy text split into word-sized pieces, comma-separated tag
+    lists and generator syntax, with diminishing returns for length.
+    """
+    words = text.split()
+    if not words:
+        return 0.0
+    if text.isascii():
+        # Deep-scan text is cleaned to printable ASCII; count letters in C
+        letters = len(text.encode('ascii').translate(None, NON_LETTER_BYTES))
+    else:
+        letters = sum(map(str.isalpha, text))
+    score = (letters / len(text)) * min(len(text), 2000) ** 0.5
+    
+    average_word = letters / len(words)
+    if average_word < 2 or average_word > 12:
+        score *= 0.25
+    score *= 1 + min(text.count(','), 20) / 20
+    if any(marker in text for marker in PROMPT_MARKERS):
+        score *= 1.5
+    return round(score, 1)
+
+class PromptCandidates:
+    """Bounded top-k of deep-scan matches with O(1) deduplication
+    
+    Only the texts in the heap are remembered, so memory stays bounded on
+    any file. A text that dropped out can't come back: its score was the
+    lowest in the heap, whose minimum only grows. Repeats of it are still
+    counted in total, which is therefore the number of matches offered
+    rather than of distinct ones.
+    """
+    
+    def __init__(self, top_k=DEEP_SCAN_TOP_K):
+        self.top_k = top_k
+        self.heap = []      # min-heap of (score, text), never larger than top_k
+        self.in_heap = set()
+        self.total = 0      # candidates seen
+    
+    def add(self, text):
+        """Offer a candidate; returns True if it entered the top k"""
+        # Filter very short matches and duplicates
+        if len(text) <= 15 or text in self.in_heap:
+            return False
+        self.total += 1
+        
+        entry = (score_prompt_candidate(text), text)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            _, dropped = heapq.heapreplace(self.heap, entry)
+            self.in_heap.discard(dropped)
+        else:
+            return False
+        self.in_heap.add(text)
+        return True
+    
+    def best(self):
+        """[(text, score), ...] best first"""
+        return [(text, score) for score, text in sorted(self.heap, reverse=True)]
+
+def hamming_distance(a, b):
+    """Number of differing bits between two integer hashes"""
+    return bin(a ^ b).count('1')
+
+class NearDuplicateIndex:
+    """Multi-index hash table over 64-bit perceptual hashes
+    
+    Each hash is split into four 16-bit chunks with one table per chunk.
+    Two hashes within distance d must agree on at least one chunk to within
+    d // 4 bits, so a query only probes the few chunk values that close and
+    checks those buckets instead of comparing against every stored hash.
+    """
+    
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        self.hashes = {}  # key -> hash
+    
+    def __len__(self):
+        return len(self.hashes)
+    
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+    
+    def _chunk_neighbours(self, chunk, radius):
+        """All chunk values within `radius` bits of `chunk`"""
+        values = [chunk]
+        frontier = [(chunk, -1)]
+        for _ in range(radius):
+            next_frontier = []
+            for value, last_bit in frontier:
+                # Only flip bits above the last one flipped so each value is produced once
+                for bit in range(last_bit + 1, self.CHUNK_BITS):
+                    flipped = value ^ (1 << bit)
+                    values.append(flipped)
+                    next_frontier.append((flipped, bit))
+            frontier = next_frontier
+        return values
+    
+    def add(self, key, value):
+        """Add a hash (int or hex string) under a key such as a file path"""
+        if isinstance(value, str):
+            value = int(value, 16)
+        if key in self.hashes:
+            self.remove(key)
+        self.hashes[key] = value
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(key)
+    
+    def remove(self, key):
+        value = self.hashes.pop(key, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket and key in bucket:
+                bucket.remove(key)
+                if not bucket:
+                    del table[chunk]
+    
+    def query(self, value, max_distance=6):
+        """Return [(distance, key), ...] within max_distance, nearest first"""
+        if isinstance(value, str):
+            value = int(value, 16)
+        radius = max_distance // self.CHUNKS
+        seen = set()
+        results = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for probe in self._chunk_neighbours(chunk, radius):
+                for key in table.get(probe, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming_distance(value, self.hashes[key])
+                    if distance <= max_distance:
+                        results.append((distance, key))
+        results.sort()
+        return results
+    
+    def groups(self, max_distance=6):
+        """Cluster all stored keys into groups of near-duplicates"""
+        parent = {}
+        
+        def find(key):
+            while parent.get(key, key) != key:
+                parent[key] = parent.get(parent[key], parent[key])
+                key = parent[key]
+            return key
+        
+        for key, value in self.hashes.items():
+            for _, other in self.query(value, max_distance):
+                if other != key:
+                    root_a, root_b = find(key), find(other)
+                    if root_a != root_b:
+                        parent[root_b] = root_a
+        
+        clusters = {}
+        for key in self.hashes:
+            clusters.setdefault(find(key), []).append(key)
+        return [sorted(members) for members in clusters.values() if len(members) > 1]
+
+def format_file_size(size, kind='image'):
+    """Display string for a byte count (videos are always shown in MB)"""
+    if kind == 'image' and size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.2f} MB"
+
+def inflate_bounded(data):
+    """Decompress zlib data, refusing to expand past DEEP_SCAN_MAX_INFLATE"""
+    decompressor = zlib.decompressobj()
+    return decompressor.decompress(data, DEEP_SCAN_MAX_INFLATE)
+
+def decode_png_text_chunk(chunk_type, data):
+    """Return (keyword, utf-8 text) for a tEXt, zTXt or iTXt chunk"""
+    keyword, _, rest = data.partition(b'\x00')
+    keyword = keyword.decode('latin-1')
+    if chunk_type == b'tEXt':
+        return keyword, rest.decode('latin-1').encode('utf-8')
+    if chunk_type == b'zTXt':
+        # Compression method byte, then a zlib stream of latin-1 text
+        return keyword, inflate_bounded(rest[1:]).decode('latin-1').encode('utf-8')
+    # iTXt: compression flag, method, language tag, translated keyword, text
+    compressed = rest[:1] == b'\x01'
+    _, _, rest = rest[2:].partition(b'\x00')
+    _, _, text = rest.partition(b'\x00')
+    return keyword, inflate_bounded(text) if compressed else text
+
+def decode_blob(codec, data):
+    """A BlobRef's bytes as the text Pillow would have given for them"""
+    if codec in ('tEXt', 'zTXt', 'iTXt'):
+        return decode_png_text_chunk(codec.encode('ascii'), data)[1].decode('utf-8', errors='replace')
+    if codec == 'exif-ascii':
+        # Pillow drops the terminating NUL and reads the rest as latin-1
+        return (data[:-1] if data.endswith(b'\x00') else data).decode('latin-1', errors='replace')
+    if codec == 'exif-bytes':
+        # As extract_exif_data converts byte values
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return str(data)
+    raise ValueError(f"Unknown blob codec {codec!r}")
+
+@dataclass(slots=True, frozen=True)
+class BlobRef:
+    """A large metadata value left in its file: `length` bytes at `offset`
+    
+    Results hold these in place of the text, so a file costs the same few
+    hundred bytes however much XMP or workflow JSON it carries. load()
+    reads and decodes the value when a tree node is expanded, or the
+    metadata is copied or exported; str() is the preview.
+    """
+    path: str
+    offset: int
+    length: int
+    codec: str          # 'tEXt', 'zTXt', 'iTXt', 'exif-ascii' or 'exif-bytes'
+    mtime_ns: int       # the file's modification time when the value was read
+    preview: str = ''
+    
+    def load(self):
+        """The full value; raises OSError or ValueError if the file changed since"""
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_mtime_ns != self.mtime_ns:
+                raise ValueError(f"{self.path} changed since its metadata was read")
+            f.seek(self.offset)
+            data = f.read(self.length)
+        if len(data) != self.length:
+            raise ValueError(f"{self.path} is shorter than when its metadata was read")
+        return decode_blob(self.codec, data)
+    
+    def __str__(self):
+        return f"{self.preview}... ({format_file_size(self.length)})"
+
+def load_blobs(value):
+    """Copy of a metadata dict (or list, or value) with every BlobRef loaded"""
+    if isinstance(value, BlobRef):
+        return value.load()
+    if isinstance(value, dict):
+        return {key: load_blobs(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [load_blobs(item) for item in value]
+    return value
+
+def blob_json_default(value):
+    """json.dumps default= for metadata: BlobRefs are loaded, anything else is str()"""
+    if isinstance(value, BlobRef):
+        return value.load()
+    return str(value)
+
+class BMFFImage:
+    """Stand-in for a PIL image built from HEIF/AVIF header items
+    
+    Carries just what the detectors and extract_exif_data look at: an info
+    dict (XMP) and the EXIF tags, with no pixel data behind it.
+    """
+    
+    def __init__(self, info, exif):
+        self.info = info
+        self.exif = exif
+    
+    def getexif(self):
+        return self.exif if self.exif is not None else {}
+    
+    def _getexif(self):
+        if not self.exif:
+            return None
+        # Like JpegImageFile._getexif, merge the Exif sub-IFD into IFD0
+        merged = dict(self.exif)
+        merged.update(self.exif.get_ifd(EXIF_IFD_POINTER))
+        return merged
+
+def format_exif_value(tag_name, value):
+    """Display form of an EXIF value: '2024:01:31 12:00:00' -> '2024-01-31 12:00:00'"""
+    if 'Date' in tag_name and isinstance(value, str) and EXIF_DATE_PATTERN.fullmatch(value):
+        return f"{value[:4]}-{value[5:7]}-{value[8:]}"
+    return value
+
+@dataclass(slots=True)
+class ExtractionResult:
+    """Metadata extracted from one file
+    
+    Sizes, dimensions and hashes are kept as numbers and only formatted
+    when to_dict() builds the display tree. Everything without a typed
+    field lives in `sections` (EXIF, XMP, PNG structure, video tracks...).
+    """
+    path: str
+    kind: str                       # 'image' or 'video'
+    file_size: int
+    width: int = None
+    height: int = None
+    image_format: str = None
+    mode: str = None
+    bit_depth: int = None
+    compression: str = None
+    has_palette: bool = None
+    prompt: str = None
+    ai: dict = None                 # AI_Metadata fields from the detectors
+    detector_confidence: float = None   # of the detector that produced `ai`, if one did
+    dhash: int = None
+    content_hash: str = None
+    content_mode: str = None        # 'full', 'fast' or 'member'
+    sections: dict = field(default_factory=dict)
+    
+    @property
+    def generator(self):
+        return self.ai.get("Generator") if self.ai else None
+    
+    def to_dict(self):
+        """Nested dict of display strings, as shown in the tree and JSON views"""
+        basic = {
+            "File Name": os.path.basename(self.path),
+            "File Size": format_file_size(self.file_size, self.kind),
+            "File Path": self.path,
+            "File Extension": os.path.splitext(self.path)[1].upper().replace('.', '')
+        }
+        if self.width is not None:
+            basic.update({
+                "Image Format": self.image_format,
+                "Mode": self.mode,
+                "Dimensions": f"{self.width} x {self.height} pixels",
+                "Bit Depth": str(self.bit_depth if self.bit_depth is not None else 'Unknown'),
+                "Compression": self.compression if self.compression is not None else 'Unknown',
+                "Palette": "Yes" if self.has_palette else "No"
+            })
+        
+        metadata = {"Basic": basic}
+        ai_pending = bool(self.ai)
+        for name, section in self.sections.items():
+            if ai_pending and name not in SECTIONS_BEFORE_AI[self.kind]:
+                metadata["AI_Metadata"] = self.ai
+                ai_pending = False
+            if name == "EXIF":
+                section = {tag: format_exif_value(tag, value) for tag, value in section.items()}
+            metadata[name] = section
+        if ai_pending:
+            metadata["AI_Metadata"] = self.ai
+        
+        hashes = {}
+        if self.dhash is not None:
+            hashes["dHash"] = f"{self.dhash:016x}"
+        if self.content_hash:
+            hashes["Content"] = self.content_hash
+            hashes["Content Mode"] = self.content_mode
+        if hashes:
+            metadata["Hashes"] = hashes
+        if self.detector_confidence is not None:
+            metadata["Detection"] = {"Confidence": self.detector_confidence}
+        return metadata
+    
+    def to_record(self):
+        """Flat dict of raw values for batch output and aggregation"""
+        return {
+            "path": self.path,
+            "kind": self.kind,
+            "file_size": self.file_size,
+            "width": self.width,
+            "height": self.height,
+            "format": self.image_format,
+            "mode": self.mode,
+            "generator": self.generator,
+            "prompt": self.prompt,
+            "ai": self.ai,
+            "detector_confidence": self.detector_confidence,
+            "dhash": f"{self.dhash:016x}" if self.dhash is not None else None,
+            "content_hash": self.content_hash,
+            "sections": self.sections
+        }
+    
+    def to_json(self):
+        return json.dumps(self.to_record(), default=blob_json_default)
+
+class ExtractionCache:
+    """Extraction results keyed by file content instead of path
+    
+    Copies of the same bytes under different paths are extracted once;
+    later paths only pay for the content hash and get a copy of the stored
+    result with their own path filled in. With max_entries set, the oldest
+    results are forgotten once that many are stored, which keeps
+    long-running processes bounded. The paths of each content are kept
+    apart from them, so duplicate groups outlive evicted results; a daemon
+    that must not grow bounds those with max_groups instead.
+    """
+    
+    def __init__(self, extractor, fast=False, max_entries=None, max_groups=None):
+        self.extractor = extractor
+        self.fast = fast
+        self.max_entries = max_entries
+        self.max_groups = max_groups
+        self.results = {}  # content hash -> ExtractionResult, evicted past max_entries
+        self.paths = {}    # content hash -> [file paths], evicted past max_groups
+        # Batch workers share one cache; the lock only guards the bookkeeping
+        self.lock = threading.Lock()
+    
+    def extract(self, file_path, source=None, file_size=None, content_hash=None):
+        """Return (ExtractionResult, duplicate_of) for a file or archive member
+        
+        duplicate_of is the first path seen with identical content, or None.
+        source and file_size are an open member stream to read instead, as
+        in MetadataExtractor.extract_result; "archive!member" paths are
+        opened that way. A member is keyed by compute_member_hash, from its
+        size and head, so neither a hit nor a miss reads all of it. A caller
+        that has already hashed a loose file passes content_hash, and may
+        pass its bytes as a PrefetchedFile source.
+        """
+        if source is None and not os.path.exists(file_path):
+            archive_path, member = split_archive_key(file_path)
+            if member is not None:
+                with open_archive_member(archive_path, member) as (stream, size):
+                    return self.extract(file_path, stream, size)
+        
+        if header_only_source(source):
+            content_hash, content_mode = self.extractor.compute_member_hash(source, file_size), "member"
+        else:
+            content_mode = "fast" if self.fast else "full"
+            if content_hash is None:
+                content_hash = self.extractor.compute_content_hash(file_path, self.fast, source, file_size)
+        with self.lock:
+            duplicate_of = self._add_path(content_hash, file_path)
+            cached = self.results.get(content_hash)
+        
+        if cached is not None:
+            # Sections are shared with the original; only the path differs
+            return replace(cached, path=file_path), duplicate_of
+        
+        result = self.extractor.extract_result(file_path, source, file_size)
+        # Thumbnails are only kept for the UI preview
+        self.extractor.last_thumbnail = None
+        result.content_hash = content_hash
+        result.content_mode = content_mode
+        with self.lock:
+            self.results.setdefault(content_hash, result)
+            if self.max_entries is not None:
+                while len(self.results) > self.max_entries:
+                    # Dicts keep insertion order, so the first key is the oldest
+                    del self.results[next(iter(self.results))]
+        return result, duplicate_of
+    
+    def extract_archive(self, archive_path, skip=()):
+        """Yield (key, (ExtractionResult, duplicate_of), error) for each media member of a zip or tar
+        
+        MetadataExtractor.extract_archive with every member keyed here
+        first, so copies inside archives join the duplicate groups too.
+        """
+        for key, stream, size in iter_archive_members(archive_path):
+            if key in skip:
+                continue
+            try:
+                extraction = self.extract(key, stream, size)
+            except Exception as e:
+                yield key, None, e
+            else:
+                yield key, extraction, None
+    
+    def add_known(self, file_path, content_hash):
+        """Count a path extracted by an earlier run towards the duplicate groups"""
+        with self.lock:
+            self._add_path(content_hash, file_path)
+    
+    def _add_path(self, content_hash, file_path):
+        """Record a path of a content; returns the first path seen with it, if another. Needs the lock."""
+        paths = self.paths.setdefault(content_hash, [])
+        if file_path not in paths:
+            paths.append(file_path)
+        if self.max_groups is not None:
+            while len(self.paths) > self.max_groups:
+                del self.paths[next(iter(self.paths))]
+        return paths[0] if paths[0] != file_path else None
+    
+    def duplicate_groups(self):
+        """Lists of paths that share identical content"""
+        return [paths for paths in self.paths.values() if len(paths) > 1]
+
+class AsyncBatchRunner:
+    """Asyncio front end for batch extraction on high-latency storage
+    
+    Up to `concurrency` files are in flight at once. Each one is first read
+    and content-hashed on an I/O thread; images up to prefetch_max bytes
+    are kept in memory. Only then is the file handed to a smaller pool of
+    parse workers, with its digest and bytes, so the blocking reads overlap
+    on the I/O threads and the parse workers only do CPU work. Throughput
+    follows the number of outstanding requests rather than one network
+    round-trip per file.
+    """
+    
+    def __init__(self, cache, concurrency=16, workers=None, prefetch_max=PREFETCH_MAX_BYTES):
+        self.cache = cache
+        self.concurrency = max(1, concurrency)
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.prefetch_max = prefetch_max
+    
+    def run(self, paths, on_result):
+        """Extract every path, calling on_result(path, result, error) as each finishes
+        
+        result is the (ExtractionResult, duplicate_of) tuple from the cache.
+        Results arrive in completion order, not input order.
+        """
+        import asyncio
+        asyncio.run(self._run(paths, on_result))
+    
+    async def _run(self, paths, on_result):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        loop = asyncio.get_running_loop()
+        io_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        parse_pool = ThreadPoolExecutor(max_workers=self.workers)
+        pending = set()
+        try:
+            for file_path in paths:
+                # Pull paths lazily so a million-file walk never becomes a million tasks
+                if len(pending) >= self.concurrency:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(loop.create_task(
+                    self._process(loop, io_pool, parse_pool, file_path, on_result)))
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            io_pool.shutdown(wait=True)
+            parse_pool.shutdown(wait=True)
+    
+    async def _process(self, loop, io_pool, parse_pool, file_path, on_result):
+        try:
+            source, size, content_hash = await loop.run_in_executor(io_pool, self._prefetch, file_path)
+            result = await loop.run_in_executor(parse_pool, self.cache.extract,
+                                                file_path, source, size, content_hash)
+        except Exception as e:
+            on_result(file_path, None, e)
+            return
+        on_result(file_path, result, None)
+    
+    def _prefetch(self, file_path):
+        """Read and hash a file; returns (PrefetchedFile or None, size, content hash)
+        
+        Videos and large images are only hashed, with the OS hinted to
+        fetch them: their parsers read just parts of them, by path.
+        """
+        extractor = self.cache.extractor
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if os.path.splitext(file_path)[1].lower() in SUPPORTED_IMAGE_EXT and size <= self.prefetch_max:
+                source = PrefetchedFile(file_path, f.read())
+                return source, size, extractor.compute_content_hash(file_path, self.cache.fast, source, size)
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+            return None, size, extractor.compute_content_hash(file_path, self.cache.fast, f, size)
+
+class BatchJournal:
+    """JSON lines output of a batch run that survives crashes and can be resumed
+    
+    Records are appended to the output file. Every JOURNAL_COMMIT_RECORDS
+    records or JOURNAL_COMMIT_SECONDS, the output is fsynced and one line
+    is appended (and fsynced) to the journal: the paths just made durable
+    and the output length that holds them. On resume the output is cut
+    back to the last committed length - dropping records written after it,
+    including a torn last line - and committed paths are skipped, so after
+    any crash every path is in the output exactly once.
+    """
+    
+    def __init__(self, output_path, journal_path=None, resume=False):
+        self.output_path = output_path
+        self.journal_path = journal_path or output_path + '.journal'
+        self.done = set()      # paths committed by this and earlier runs
+        self.pending = []      # paths written since the last commit
+        self.end = 0           # output length covered by the journal
+        journal_end = 0
+        if resume and os.path.exists(self.journal_path):
+            journal_end = self._replay()
+        elif resume and os.path.exists(self.output_path) and os.path.getsize(self.output_path):
+            raise ValueError(f"{self.output_path} has no journal to resume from")
+        if resume and os.path.exists(self.output_path):
+            if os.path.getsize(self.output_path) < self.end:
+                raise ValueError(f"{self.output_path} is shorter than its journal says")
+            self.output = open(self.output_path, 'r+b')
+        else:
+            if self.end:
+                raise ValueError(f"{self.output_path} is missing but its journal lists finished files")
+            self.output = open(self.output_path, 'wb')
+        # Drop whatever was written after the last commit
+        self.output.truncate(self.end)
+        self.output.seek(self.end)
+        self.journal = open(self.journal_path, 'r+b' if journal_end else 'wb')
+        self.journal.truncate(journal_end)
+        self.journal.seek(journal_end)
+        self.last_commit = time.monotonic()
+    
+    def _replay(self):
+        """Load the committed paths; returns the length of the journal's intact lines"""
+        journal_end = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    end, paths = entry["end"], entry["paths"]
+                except (ValueError, KeyError, TypeError):
+                    # A commit cut short by the crash; everything after it is ignored
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.done.update(paths)
+                self.end = end
+                journal_end += len(line)
+        return journal_end
+    
+    def records(self):
+        """The committed records, read back from the output"""
+        with open(self.output_path, 'rb') as f:
+            remaining = self.end
+            for line in f:
+                if remaining <= 0:
+                    break
+                remaining -= len(line)
+                yield json.loads(line)
+    
+    def write(self, file_path, line):
+        """Append one record; returns False for a path already written"""
+        if file_path in self.done:
+            return False
+        self.output.write(line.encode('utf-8') + b"\n")
+        self.done.add(file_path)
+        self.pending.append(file_path)
+        if (len(self.pending) >= JOURNAL_COMMIT_RECORDS
+                or time.monotonic() - self.last_commit >= JOURNAL_COMMIT_SECONDS):
+            self.commit()
+        return True
+    
+    def commit(self):
+        """Make the records written so far durable, then journal them"""
+        self.last_commit = time.monotonic()
+        if not self.pending:
+            return
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.end = self.output.tell()
+        entry = {"end": self.end, "paths": self.pending}
+        self.journal.write(json.dumps(entry).encode('utf-8') + b"\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.pending = []
+    
+    def close(self):
+        """Commit what is left and close both files"""
+        try:
+            self.commit()
+        finally:
+            self.output.close()
+            self.journal.close()
+
+class BatchMerger:
+    """One index built from the `batch` outputs of several shards
+    
+    Records pass through in the order given, each path once. Content
+    hashes are matched across every shard, so duplicate_of and the
+    duplicate groups include copies that were extracted on different
+    machines, and the stats count each file once.
+    """
+    
+    def __init__(self):
+        self.stats = LibraryStats()
+        self.by_content = {}  # content hash -> paths, first seen first
+        self.seen = set()
+        self.repeated = 0     # records skipped because their path was already added
+    
+    def add(self, record):
+        """The merged form of a record, or None for a path already added"""
+        path = record["path"]
+        if path in self.seen:
+            self.repeated += 1
+            return None
+        self.seen.add(path)
+        duplicate_of = None
+        content_hash = record.get("content_hash")
+        if content_hash:
+            paths = self.by_content.setdefault(content_hash, [])
+            duplicate_of = paths[0] if paths else None
+            paths.append(path)
+        record = dict(record, duplicate_of=duplicate_of)
+        self.stats.add(record)
+        return record
+    
+    def duplicate_groups(self):
+        """Lists of paths that share identical content, across all shards"""
+        return [paths for paths in self.by_content.values() if len(paths) > 1]
+
+# Comparison grid columns: (name, kind, AUTOMATIC1111 parameter, ComfyUI key)
+COMPARE_COLUMNS = (
+    ("generator", "text", None, None),
+    ("model", "text", "Model", "checkpoint"),
+    ("sampler", "text", "Sampler", "sampler"),
+    ("seed", "number", "Seed", "seed"),
+    ("steps", "number", "Steps", "steps"),
+    ("cfg", "number", "CFG scale", "cfg"),
+    ("width", "number", None, None),
+    ("height", "number", None, None),
+)
+
+# Numeric filters: "20", ">7", "<=30", "5..8"
+COMPARE_NUMBER_FILTER = re.compile(
+    r'^\s*(?:(<=|>=|<|>|=)?\s*(-?\d+(?:\.\d+)?)|(-?\d+(?:\.\d+)?)\s*\.\.\s*(-?\d+(?:\.\d+)?))\s*$')
+
+class ParameterTable:
+    """Generation parameters of many files, stored column by column
+    
+    Numbers live in array('d') columns with NaN for "missing"; text columns
+    are array('I') codes into a per-column list of distinct values (code 0
+    is missing). Sorting a column builds a row permutation once and caches
+    it, and filters compare codes or floats, so views over 100k rows are
+    recomputed in milliseconds without touching the original records.
+    """
+    
+    def __init__(self):
+        self.paths = []
+        self.columns = {}
+        self.categories = {}
+        self._codes = {}
+        for name, kind, _, _ in COMPARE_COLUMNS:
+            if kind == "number":
+                self.columns[name] = array('d')
+            else:
+                self.columns[name] = array('I')
+                self.categories[name] = [""]
+                self._codes[name] = {"": 0}
+        self._orders = {}
+        self._lower_paths = None
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    @classmethod
+    def from_jsonl(cls, file_path):
+        """Build a table from `batch` output"""
+        table = cls()
+        for record in iter_jsonl_records(file_path):
+            table.add(record)
+        return table
+    
+    def add(self, record):
+        """Append one file, given its to_record() dict or ExtractionResult"""
+        if isinstance(record, ExtractionResult):
+            record = record.to_record()
+        values = record_parameters(record)
+        
+        self.paths.append(record.get("path", ""))
+        for name, kind, _, _ in COMPARE_COLUMNS:
+            value = values[name]
+            if kind == "number":
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = math.nan
+                self.columns[name].append(value)
+            else:
+                value = "" if value is None else str(value)
+                codes = self._codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(self.categories[name])
+                    self.categories[name].append(value)
+                self.columns[name].append(code)
+        self._orders.clear()
+        self._lower_paths = None
+    
+    def cell(self, row, name):
+        """Display text of one cell"""
+        if name == "path":
+            return self.paths[row]
+        value = self.columns[name][row]
+        if name in self.categories:
+            return self.categories[name][value]
+        if value != value:
+            return ""
+        return str(int(value)) if value.is_integer() else f"{value:g}"
+    
+    def sort_order(self, name):
+        """Rows ordered by a column, missing values last; cached until the next add()"""
+        order = self._orders.get(name)
+        if order is not None:
+            return order
+        
+        if name == "path":
+            order = sorted(range(len(self.paths)), key=self.paths.__getitem__)
+        elif name in self.categories:
+            # Sort the distinct values once, then rows by their value's rank
+            categories = self.categories[name]
+            ranks = [0] * len(categories)
+            for rank, code in enumerate(sorted(range(1, len(categories)), key=categories.__getitem__)):
+                ranks[code] = rank
+            ranks[0] = len(categories)
+            keys = [ranks[code] for code in self.columns[name].tolist()]
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+        else:
+            # Plain lists index faster than arrays in the sort key
+            values = self.columns[name].tolist()
+            present = [row for row, value in enumerate(values) if value == value]
+            missing = [row for row, value in enumerate(values) if value != value]
+            order = sorted(present, key=values.__getitem__) + missing
+        
+        self._orders[name] = order
+        return order
+    
+    def view(self, sort=None, descending=False, filters=None, text=None):
+        """Row indices to show, sorted and filtered
+        
+        filters maps column names to a filter: a substring of the value for
+        text columns, or "20", ">7", "<=30", "5..8" for numbers. text keeps
+        rows whose path contains it (case-insensitive).
+        """
+        if sort is not None:
+            rows = self.sort_order(sort)
+            if descending:
+                # Keep missing values last when reversing
+                rows = rows[::-1]
+                if sort != "path" and rows:
+                    missing = self._missing_count(sort)
+                    rows = rows[missing:] + rows[:missing]
+        else:
+            rows = range(len(self.paths))
+        
+        # One boolean per row and filter, combined before walking the sorted rows
+        masks = [self._filter_mask(name, value) for name, value in (filters or {}).items()]
+        if text:
+            if self._lower_paths is None:
+                self._lower_paths = [path.lower() for path in self.paths]
+            needle = text.lower()
+            masks.append([needle in path for path in self._lower_paths])
+        if not masks:
+            return list(rows)
+        keep = masks[0]
+        for mask in masks[1:]:
+            keep = [a and b for a, b in zip(keep, mask)]
+        return [row for row in rows if keep[row]]
+    
+    def _missing_count(self, name):
+        column = self.columns[name]
+        if name in self.categories:
+            return column.count(0)
+        return sum(1 for value in column if value != value)
+    
+    def _filter_mask(self, name, value):
+        """Per-row booleans for one column filter; raises ValueError if it can't parse"""
+        if name not in self.columns:
+            raise ValueError(f"Unknown column: {name}")
+        values = self.columns[name].tolist()
+        
+        if name in self.categories:
+            # Match the few distinct values, then rows by code
+            needle = str(value).lower()
+            codes = {code for code, category in enumerate(self.categories[name])
+                     if category and needle in category.lower()}
+            return [code in codes for code in values]
+        
+        match = COMPARE_NUMBER_FILTER.match(str(value))
+        if not match:
+            raise ValueError(f"Bad filter for {name}: {value}")
+        op, number, low, high = match.groups()
+        if low is not None:
+            low, high = float(low), float(high)
+            return [low <= v <= high for v in values]
+        compare = {None: operator.eq, "=": operator.eq, "<": operator.lt, ">": operator.gt,
+                   "<=": operator.le, ">=": operator.ge}[op]
+        number = float(number)
+        return [compare(v, number) for v in values]
+
+def iter_jsonl_records(file_path):
+    """Records of a `batch` JSON lines file, skipping lines that aren't records"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "path" in record:
+                yield record
+
+def record_parameters(record):
+    """Values of the COMPARE_COLUMNS for one to_record() dict, None where missing
+    
+    AUTOMATIC1111 settings come from the parsed "parameters" dict, ComfyUI
+    ones from the top level of the AI metadata.
+    """
+    ai = record.get("ai") or {}
+    parameters = ai.get("parameters") if isinstance(ai.get("parameters"), dict) else {}
+    values = {}
+    for name, _, sd_key, comfy_key in COMPARE_COLUMNS:
+        if sd_key is None and comfy_key is None:
+            values[name] = record.get(name)
+        else:
+            values[name] = parameters.get(sd_key, ai.get(comfy_key))
+    return values
+
+def parse_compare_query(query):
+    """Split "model:sdxl steps:>20 forest" into ({column: filter}, path text)"""
+    filters = {}
+    words = []
+    for term in query.split():
+        name, sep, value = term.partition(':')
+        if sep and value:
+            filters[name.lower()] = value
+        else:
+            words.append(term)
+    return filters, " ".join(words)
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error
+    
+    Values land in logarithmic buckets, so any quantile is within
+    `relative_accuracy` of the true value while memory grows only with the
+    log of the value range. Two sketches with the same accuracy merge by
+    adding bucket counts, which lets workers and shards keep their own.
+    """
+    
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+    
+    def add(self, value, count=1):
+        """Add a non-negative value; a negative count removes it again"""
+        if value <= 0:
+            self.zeros += count
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[key] += count
+            if not self.buckets[key]:
+                del self.buckets[key]
+        self.count += count
+    
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        self.buckets.update(other.buckets)
+        for key in [key for key, n in self.buckets.items() if not n]:
+            del self.buckets[key]
+        self.zeros += other.zeros
+        self.count += other.count
+    
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), or None when empty"""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(key-1), gamma^key] in relative terms
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+    
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "zeros": self.zeros,
+                "count": self.count, "buckets": {str(key): n for key, n in self.buckets.items()}}
+    
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.zeros = data["zeros"]
+        sketch.count = data["count"]
+        sketch.buckets = Counter({int(key): n for key, n in data["buckets"].items()})
+        return sketch
+
+# Aggregated text fields of LibraryStats; each is a Counter of value -> files
+LIBRARY_STATS_COUNTERS = ("kinds", "formats", "generators", "models", "samplers", "resolutions")
+LIBRARY_STATS_PERCENTILES = (0.5, 0.9, 0.99)
+
+class LibraryStats:
+    """Streaming aggregates over extracted files
+    
+    Every file updates exact counters (generator, model, sampler,
+    resolution...) and a QuantileSketch of prompt lengths in O(1), so stats
+    are current after each extraction without a rescan. Files can be
+    removed again when they change, and partial stats from workers, shards
+    or earlier runs merge by addition; to_dict() / from_dict() round-trip
+    them through JSON.
+    """
+    
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.with_prompt = 0
+        for name in LIBRARY_STATS_COUNTERS:
+            setattr(self, name, Counter())
+        self.prompt_lengths = QuantileSketch()
+    
+    @staticmethod
+    def entry(record):
+        """What add() counts for a to_record() dict or ExtractionResult, as a small tuple
+        
+        (file size, prompt length, then one value per LIBRARY_STATS_COUNTERS):
+        all remove() needs to take the file out again later.
+        """
+        if isinstance(record, ExtractionResult):
+            record = record.to_record()
+        values = record_parameters(record)
+        resolution = None
+        if record.get("width") and record.get("height"):
+            resolution = f"{record['width']}x{record['height']}"
+        prompt = record.get("prompt")
+        labels = (record.get("kind"), record.get("format"), values["generator"], values["model"],
+                  values["sampler"], resolution)
+        return ((record.get("file_size") or 0, len(prompt) if prompt else 0)
+                + tuple("(none)" if value is None or value == "" else str(value) for value in labels))
+    
+    def add(self, record, count=1):
+        """Count one file, given its to_record() dict, ExtractionResult or entry()"""
+        file_size, prompt_length, *labels = record if isinstance(record, tuple) else self.entry(record)
+        self.files += count
+        self.bytes += count * file_size
+        for name, value in zip(LIBRARY_STATS_COUNTERS, labels):
+            counter = getattr(self, name)
+            counter[value] += count
+            # Partials may go negative after a remove(); only drop values that cancel out
+            if not counter[value]:
+                del counter[value]
+        
+        if prompt_length:
+            self.with_prompt += count
+            self.prompt_lengths.add(prompt_length, count)
+    
+    def remove(self, record):
+        """Undo add() for a file that changed or went away"""
+        self.add(record, -1)
+    
+    def merge(self, other):
+        """Add another partial result into this one"""
+        self.files += other.files
+        self.bytes += other.bytes
+        self.with_prompt += other.with_prompt
+        for name in LIBRARY_STATS_COUNTERS:
+            counter = getattr(self, name)
+            counter.update(getattr(other, name))
+            for value in [value for value, n in counter.items() if not n]:
+                del counter[value]
+        self.prompt_lengths.merge(other.prompt_lengths)
+        return self
+    
+    def to_dict(self):
+        data = {"files": self.files, "bytes": self.bytes, "with_prompt": self.with_prompt}
+        for name in LIBRARY_STATS_COUNTERS:
+            data[name] = dict(getattr(self, name).most_common())
+        data["prompt_lengths"] = self.prompt_lengths.to_dict()
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.files = data["files"]
+        stats.bytes = data["bytes"]
+        stats.with_prompt = data["with_prompt"]
+        for name in LIBRARY_STATS_COUNTERS:
+            setattr(stats, name, Counter(data.get(name, {})))
+        stats.prompt_lengths = QuantileSketch.from_dict(data["prompt_lengths"])
+        return stats
+    
+    def summary(self, top=10):
+        """Human-readable report: totals, top values per counter and prompt percentiles"""
+        lines = [f"Files: {self.files} ({format_file_size(self.bytes)})",
+                 f"With prompt: {self.with_prompt}"]
+        for name in LIBRARY_STATS_COUNTERS:
+            counter = getattr(self, name)
+            lines.append("")
+            lines.append(f"{name.capitalize()} ({len(counter)} distinct):")
+            for value, n in counter.most_common(top):
+                share = 100 * n / self.files if self.files else 0
+                lines.append(f"  {n:8d}  {share:5.1f}%  {value}")
+        lines.append("")
+        lines.append("Prompt length (chars):")
+        for q in LIBRARY_STATS_PERCENTILES:
+            value = self.prompt_lengths.quantile(q)
+            lines.append(f"  p{int(q * 100):<3d} {'-' if value is None else round(value)}")
+        return "\n".join(lines)
+
+def decode_exif_text(value):
+    """Decode an EXIF string value, handling UserComment's 8-byte charset prefix"""
+    if not isinstance(value, bytes):
+        return value
+    prefix, body = value[:8], value[8:]
+    if prefix == b'UNICODE\x00':
+        # Writers disagree on byte order; ASCII text has its zero byte first in big-endian
+        encoding = 'utf-16-be' if body[:1] == b'\x00' else 'utf-16-le'
+        return body.decode(encoding, errors='replace').rstrip('\x00')
+    if prefix in (b'ASCII\x00\x00\x00', b'\x00' * 8):
+        value = body
+    try:
+        return value.decode('utf-8').rstrip('\x00')
+    except UnicodeDecodeError:
+        return value.decode('latin-1').rstrip('\x00')
+
+def read_exif(img):
+    """img.getexif(), without decoding a PNG's pixels
+    
+    PngImageFile.getexif() loads the whole image when the header had no
+    eXIf chunk, in case one follows the pixel data. A PNG's EXIF is taken
+    from img.info alone instead; extract_ai_metadata_from_image puts a
+    trailing eXIf chunk there itself when it may read the whole file.
+    """
+    if getattr(img, 'format', None) == 'PNG':
+        return PILImage.Image.getexif(img)
+    return img.getexif()
+
+def read_png_exif(f):
+    """Data of a PNG's eXIf chunk as Pillow stores it, or None; seeks past every other chunk"""
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            data = f.read(length)
+            return b'Exif\x00\x00' + data if len(data) == length else None
+        if chunk_type == b'IEND':
+            return None
+        f.seek(length + 4, 1)
+
+def read_xmp_property(xmp, prop):
+    """Value of an XMP property written as an attribute or an element, or None"""
+    match = re.search(r'(?:\w+:)?' + prop + r'="([^"]*)"', xmp)
+    if match:
+        return match.group(1).strip()
+    match = re.search(r'<(\w+:)?' + prop + r'>(.*?)</\1?' + prop + r'>', xmp, re.DOTALL)
+    if match:
+        # Strip rdf:Alt / rdf:li wrappers around language alternatives
+        return re.sub(r'<[^>]+>', '', match.group(2)).strip()
+    return None
+
+class GeneratorDetector:
+    """Base class for generator detector plugins
+    
+    A detector declares the PNG/WebP info keys, EXIF tags and XMP
+    properties it needs plus a confidence score. The engine reads the union
+    of all declared fields once per image and calls detect() with
+    {"info": {...}, "exif": {tag: value}, "xmp": {property: value}}, where
+    fields the image doesn't have are simply absent.
+    """
+    
+    name = "Unknown"
+    info_keys = ()
+    exif_tags = ()
+    xmp_properties = ()
+    confidence = 0.5
+    
+    def detect(self, fields, extractor):
+        """Return AI metadata ({"Generator": ..., "prompt": ...}) or None"""
+        return None
+
+DETECTORS = []
+
+def register_detector(cls):
+    """Class decorator adding a detector to the registry"""
+    DETECTORS.append(cls())
+    return cls
+
+def detector_fields():
+    """Union of (info keys, EXIF tags, XMP properties) declared by detectors"""
+    info_keys, exif_tags, xmp_properties = set(), set(), set()
+    for detector in DETECTORS:
+        info_keys.update(detector.info_keys)
+        exif_tags.update(detector.exif_tags)
+        xmp_properties.update(detector.xmp_properties)
+    return info_keys, exif_tags, xmp_properties
+
+@register_detector
+class Automatic1111Detector(GeneratorDetector):
+    """AUTOMATIC1111-style "parameters" text (PNG chunk or JPEG UserComment)"""
+    name = "Stable Diffusion"
+    info_keys = ('parameters',)
+    exif_tags = (EXIF_USER_COMMENT,)
+    confidence = 0.95
+    
+    def detect(self, fields, extractor):
+        text = fields["info"].get('parameters')
+        if not isinstance(text, str) or not text.strip():
+            text = fields["exif"].get(EXIF_USER_COMMENT)
+            if not isinstance(text, str) or "Steps: " not in text:
+                return None
+        text = text.strip()
+        metadata = {"Generator": "Stable Diffusion", "prompt": text}
+        metadata.update(extractor.parse_sd_parameters(text))
+        return metadata
+
+@register_detector
+class ComfyUIDetector(GeneratorDetector):
+    """ComfyUI node graphs in 'prompt'/'workflow' chunks"""
+    name = "ComfyUI"
+    info_keys = ('prompt', 'workflow')
+    confidence = 0.95
+    
+    def detect(self, fields, extractor):
+        if not fields["info"]:
+            return None
+        return extractor.extract_comfyui_metadata(fields["info"]) or None
+
+@register_detector
+class MidjourneyDetector(GeneratorDetector):
+    """Midjourney prompts in the Description chunk or EXIF descriptions"""
+    name = "Midjourney"
+    info_keys = ('Description',)
+    exif_tags = (EXIF_IMAGE_DESCRIPTION, EXIF_USER_COMMENT)
+    confidence = 0.9
+    
+    def detect(self, fields, extractor):
+        for text in (fields["info"].get('Description'),
+                     fields["exif"].get(EXIF_IMAGE_DESCRIPTION),
+                     fields["exif"].get(EXIF_USER_COMMENT)):
+            if isinstance(text, str) and any(marker in text for marker in MIDJOURNEY_MARKERS):
+                return {"Generator": "Midjourney", "prompt": text}
+        return None
+
+@register_detector
+class DallEDetector(GeneratorDetector):
+    """DALL-E names itself in the EXIF Software tag"""
+    name = "DALL-E"
+    exif_tags = (EXIF_SOFTWARE, EXIF_IMAGE_DESCRIPTION, EXIF_USER_COMMENT)
+    confidence = 0.9
+    
+    def detect(self, fields, extractor):
+        if "DALL-E" not in str(fields["exif"].get(EXIF_SOFTWARE, '')):
+            return None
+        metadata = {"Generator": "DALL-E"}
+        for tag in (EXIF_IMAGE_DESCRIPTION, EXIF_USER_COMMENT):
+            desc = fields["exif"].get(tag)
+            if isinstance(desc, str) and len(desc) > 10:
+                metadata["prompt"] = desc
+                break
+        return metadata
+
+@register_detector
+class IPTCDigitalSourceDetector(GeneratorDetector):
+    """XMP marked as generated with IPTC's trainedAlgorithmicMedia source type"""
+    name = "IPTC Digital Source Type"
+    xmp_properties = ('DigitalSourceType', 'CreatorTool', 'description')
+    confidence = 0.5
+    
+    def detect(self, fields, extractor):
+        if "trainedAlgorithmicMedia" not in fields["xmp"].get('DigitalSourceType', ''):
+            return None
+        metadata = {"Generator": fields["xmp"].get('CreatorTool') or "AI Generator (IPTC source type)"}
+        if fields["xmp"].get('description'):
+            metadata["prompt"] = fields["xmp"]['description']
+        return metadata
+
+@register_detector
+class GenericPromptKeyDetector(GeneratorDetector):
+    """Any other text chunk commonly used for prompts"""
+    name = "AI Image Generator"
+    info_keys = ('parameters', 'prompt', 'sd-metadata', 'ai_metadata')
+    confidence = 0.2
+    
+    def detect(self, fields, extractor):
+        for key in self.info_keys:
+            if key in fields["info"]:
+                return {"Generator": "AI Image Generator", "prompt": str(fields["info"][key])}
+        return None
+
+class MetadataExtractor:
+    """Metadata extraction shared by the UI and command-line modes
+    
+    Nothing in here touches Kivy, so it can run outside the app.
+    """
+    
+    # (file_path, thumbnail) of the last processed image, reused for the preview
+    last_thumbnail = None
+    # Decode pixels for the dHash and preview thumbnail; off where neither is used
+    perceptual_hash = True
+    # Bytes of each file the binary fallbacks may scan (None = whole file)
+    scan_budget = None
+    # Video parse depth ('quick', 'normal' or 'full') and per-file timeout in seconds,
+    # see metaprobe_mediainfo
+    mediainfo_depth = 'normal'
+    mediainfo_timeout = 30.0
+    
+    def extract_file(self, file_path):
+        """Extract a file's (metadata dict, ai_prompt) for display"""
+        result = self.extract_result(file_path)
+        return result.to_dict(), result.prompt
+    
+    def extract_result(self, file_path, source=None, file_size=None):
+        """Dispatch a file to the image or video pipeline by its extension
+        
+        source is an open stream to read instead of file_path, which then
+        only names the result; "archive!member" paths are opened this way.
+        """
+        if source is None and not os.path.exists(file_path):
+            archive_path, member = split_archive_key(file_path)
+            if member is not None:
+                with open_archive_member(archive_path, member) as (stream, size):
+                    return self.extract_result(file_path, stream, size)
+        
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext in BMFF_IMAGE_EXT:
+            return self.extract_bmff_result(file_path, file_ext, source, file_size)
+        if file_ext in SUPPORTED_IMAGE_EXT:
+            return self.extract_image_result(file_path, file_ext, source, file_size)
+        if file_ext in SUPPORTED_VIDEO_EXT:
+            return self.extract_video_result(file_path, file_ext, source, file_size)
+        raise ValueError(f"Unsupported file type - {file_ext}")
+    
+    def extract_archive(self, archive_path, skip=()):
+        """Yield (key, ExtractionResult, error) for every media member of a zip or tar
+        
+        Members are parsed straight from the archive stream, header first:
+        pixel data isn't decoded (so there is no dHash) and binary
+        fallbacks read only the first ARCHIVE_HEADER_BYTES of a member.
+        Members whose key is in `skip` are passed over unread.
+        """
+        for key, stream, size in iter_archive_members(archive_path):
+            if key in skip:
+                continue
+            try:
+                result = self.extract_result(key, stream, size)
+            except Exception as e:
+                yield key, None, e
+            else:
+                yield key, result, None
+    
+    def compute_content_hash(self, file_path, fast=False, source=None, file_size=None):
+        """BLAKE2b of the file contents, read in fixed-size blocks
+        
+        In fast mode only the size, the first and the last FAST_HASH_SPAN
+        bytes are hashed - enough to tell copies apart from different
+        files in practice at a fraction of the I/O on large videos.
+        source and file_size are an open stream to hash instead.
+        """
+        if source is not None:
+            with open_binary(source) as f:
+                return self._hash_stream(f, file_size, fast)
+        if not os.path.exists(file_path):
+            archive_path, member = split_archive_key(file_path)
+            if member is not None:
+                with open_archive_member(archive_path, member) as (stream, size):
+                    return self._hash_stream(stream, size, fast)
+        with open(file_path, 'rb') as f:
+            return self._hash_stream(f, os.fstat(f.fileno()).st_size, fast)
+    
+    def compute_member_hash(self, source, file_size):
+        """Content key of an archive member: its size and first FAST_HASH_SPAN bytes
+        
+        The fast hash without the tail, which would mean decompressing the
+        whole member; the parser reads the head anyway. Keys of members
+        only match other members, never a loose file's hash.
+        """
+        digest = hashlib.blake2b(digest_size=16, person=b'member')
+        digest.update(struct.pack('>Q', file_size))
+        with open_binary(source) as f:
+            digest.update(f.read(FAST_HASH_SPAN))
+        return digest.hexdigest()
+    
+    def _hash_stream(self, f, size, fast):
+        digest = hashlib.blake2b(digest_size=16)
+        if fast:
+            digest.update(struct.pack('>Q', size))
+            digest.update(f.read(FAST_HASH_SPAN))
+            if size > FAST_HASH_SPAN:
+                f.seek(max(FAST_HASH_SPAN, size - FAST_HASH_SPAN))
+                digest.update(f.read(FAST_HASH_SPAN))
+        else:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def process_image(self, file_path, file_ext):
+        """Process image files - extract ALL possible metadata"""
+        result = self.extract_image_result(file_path, file_ext)
+        return result.to_dict(), result.prompt
+    
+    def extract_image_result(self, file_path, file_ext, source=None, file_size=None):
+        """Extract an image's metadata into an ExtractionResult
+        
+        With an archive member stream as source only the headers are parsed
+        (see extract_archive); a PrefetchedFile is parsed in full.
+        """
+        header_only = header_only_source(source)
+        source = file_path if source is None else source
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        # Basic file info
+        result = ExtractionResult(path=file_path, kind='image', file_size=file_size)
+        # Everything that isn't a typed field goes into named sections
+        metadata = result.sections
+        
+        if have_pil():
+            try:
+                # Open the image with PIL
+                img = PILImage.open(source)
+                
+                # Add basic image info
+                result.image_format = img.format
+                result.mode = img.mode
+                result.width, result.height = img.width, img.height
+                result.bit_depth = getattr(img, 'bits', None)
+                result.compression = getattr(img, 'compression', None)
+                result.has_palette = bool(getattr(img, 'palette', None))
+                
+                # Extract ALL format-specific data first
+                if hasattr(img, 'info'):
+                    format_info = {}
+                    for key, value in img.info.items():
+                        if isinstance(value, (str, int, float, bool, type(None))):
+                            format_info[key] = value
+                        elif isinstance(value, bytes):
+                            try:
+                                # Try to decode bytes as UTF-8
+                                decoded = value.decode('utf-8', errors='replace')
+                                if len(decoded) > 100:
+                                    format_info[key] = f"{decoded[:100]}... (truncated)"
+                                else:
+                                    format_info[key] = decoded
+                            except:
+                                format_info[key] = f"{str(type(value))} ({len(value)} bytes)"
+                        else:
+                            format_info[key] = f"{str(type(value))}"
+                    
+                    if format_info:
+                        metadata["Format_Specific"] = format_info
+                
+                # Check if this is a Midjourney image based on filename patterns
+                if 'Job ID:' in os.path.basename(file_path) or '_' in os.path.basename(file_path):
+                    parts = os.path.basename(file_path).split('_')
+                    if len(parts) >= 3:
+                        # Looks like a Midjourney naming pattern
+                        result.ai = {"Generator": "Midjourney (from filename)"}
+                
+                # Extract AI metadata and prompt
+                ai_metadata, prompt = self.extract_ai_metadata_from_image(img, source)
+                result.detector_confidence = ai_metadata.pop("Detector_Confidence", None)
+                
+                if ai_metadata:
+                    # Merge with any existing AI metadata
+                    if result.ai:
+                        result.ai.update(ai_metadata)
+                    else:
+                        result.ai = ai_metadata
+                    
+                if prompt:
+                    result.prompt = prompt
+                
+                # Extract EXIF data - get ALL possible EXIF tags
+                exif_data = self.extract_exif_data(img)
+                if exif_data:
+                    metadata["EXIF"] = exif_data
+                
+                # Extract ICC Profile data if available
+                if "icc_profile" in img.info:
+                    try:
+                        metadata["ICC_Profile"] = {"Present": "Yes", "Size": f"{len(img.info['icc_profile'])} bytes"}
+                    except:
+                        metadata["ICC_Profile"] = {"Present": "Yes", "Size": "Unknown"}
+                
+                # Extract XMP data
+                if "XML:com.adobe.xmp" in img.info:
+                    metadata["XMP_Metadata"] = self.extract_xmp_data(img.info["XML:com.adobe.xmp"])
+                
+                # For PNG files, extract additional chunk information
+                if file_ext.lower() == '.png':
+                    # Use binary mode to investigate PNG chunks
+                    with open_binary(source) as f:
+                        f.seek(8)  # Skip PNG signature
+                        
+                        chunks = []
+                        while True:
+                            try:
+                                chunk_len = struct.unpack('>I', f.read(4))[0]
+                                chunk_type = f.read(4).decode('ascii')
+                                
+                                # Walking past the pixel data would decompress all of a member
+                                if header_only and chunk_type == 'IDAT':
+                                    chunks.append({"Type": chunk_type, "Length": chunk_len})
+                                    break
+                                
+                                # Skip data but record info
+                                f.seek(chunk_len, 1)  # Skip data
+                                f.seek(4, 1)  # Skip CRC
+                                
+                                chunks.append({"Type": chunk_type, "Length": chunk_len})
+                                
+                                if chunk_type == 'IEND':
+                                    break
+                            except:
+                                break
+                        
+                        if chunks:
+                            metadata["PNG_Structure"] = {
+                                "Chunk_Count": len(chunks),
+                                "Chunks": chunks
+                            }
+                            if header_only:
+                                metadata["PNG_Structure"]["Scope"] = "Header chunks up to the first IDAT"
+                
+                # Large text stays in the file; the result only points at it
+                if not header_only:
+                    self.defer_large_values(file_path, metadata)
+                
+                # Perceptual hash from the same reduced decode the preview uses
+                if not header_only and self.perceptual_hash:
+                    thumbnail = self.create_thumbnail(source)
+                    result.dhash = self.compute_dhash(thumbnail)
+                    self.last_thumbnail = (file_path, thumbnail)
+            
+            except Exception as e:
+                metadata["Error"] = {"Processing Error": str(e)}
+        
+        return result
+    
+    def extract_bmff_result(self, file_path, file_ext, source=None, file_size=None):
+        """Extract an AVIF/HEIC image's metadata from its ISO-BMFF boxes alone
+        
+        Only the top-level box headers, the meta box and the Exif/XMP item
+        extents are read - a few KB for typical files. Image data is never
+        decoded, so no codec plugin is needed (and there is no dHash).
+        """
+        source = file_path if source is None else source
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        result = ExtractionResult(path=file_path, kind='image', file_size=file_size)
+        metadata = result.sections
+        
+        try:
+            with open_binary(source) as f:
+                bmff = self.read_bmff_items(f, file_size)
+        except (struct.error, ValueError) as e:
+            metadata["Error"] = {"Processing Error": f"Invalid ISO-BMFF file: {e}"}
+            return result
+        
+        result.image_format = 'AVIF' if bmff["brand"] in BMFF_AVIF_BRANDS else 'HEIF'
+        result.width, result.height = bmff["width"], bmff["height"]
+        metadata["ISOBMFF"] = {
+            "Major_Brand": bmff["brand"].decode('latin-1'),
+            "Compatible_Brands": [brand.decode('latin-1') for brand in bmff["compatible_brands"]],
+            "Primary_Item": bmff["primary_item"],
+            "Items": [f"{item_id}: {item_type}" for item_id, item_type in bmff["items"]],
+            "Bytes_Read": bmff["bytes_read"]
+        }
+        
+        info = {}
+        if bmff["xmp"] is not None:
+            info["XML:com.adobe.xmp"] = bmff["xmp"]
+            metadata["XMP_Metadata"] = self.extract_xmp_data(bmff["xmp"])
+        exif = None
+        if bmff["exif"] is not None and have_pil():
+            try:
+                exif = PILImage.Exif()
+                exif.load(bmff["exif"])
+            except Exception as e:
+                exif = None
+                metadata["Error"] = {"EXIF Error": str(e)}
+        img = BMFFImage(info, exif)
+        
+        exif_data = self.extract_exif_data(img)
+        if exif_data:
+            metadata["EXIF"] = exif_data
+        
+        # Same detectors as other images; the fallback only scans the items already read
+        detected = self.detect_generator(img)
+        if detected:
+            result.detector_confidence = detected.pop("Detector_Confidence")
+            result.ai = detected
+            result.prompt = detected.get("prompt")
+            return result
+        blocks = [bmff["exif"], bmff["xmp"] and bmff["xmp"].encode('utf-8')]
+        blocks.extend(data for _, data in bmff["mime"])
+        for data in blocks:
+            if not data:
+                continue
+            bin_metadata, bin_prompt = self.extract_metadata_from_binary(data)
+            if bin_metadata:
+                result.ai = dict(result.ai or {}, **bin_metadata)
+            if bin_prompt:
+                result.prompt = bin_prompt
+                break
+        return result
+    
+    def read_bmff_items(self, f, size):
+        """Parse the boxes of an ISO-BMFF (HEIF/AVIF) file that describe its items
+        
+        Returns a dict with the brand, compatible_brands, primary_item, the
+        primary image's width/height (from its ispe property), items as
+        (id, type) pairs, exif (the TIFF block of the Exif item), xmp (the
+        XMP packet text), mime (other (content type, data) items), the
+        top-level boxes as (type, start, end) and bytes_read.
+        """
+        bmff = {"brand": b'', "compatible_brands": [], "primary_item": None, "items": [],
+                "width": None, "height": None, "exif": None, "xmp": None, "mime": [],
+                "boxes": [], "bytes_read": 0}
+        meta = None
+        
+        # Top-level boxes: only headers, plus the small ftyp and meta payloads
+        pos = 0
+        while pos + 8 <= size:
+            f.seek(pos)
+            header = f.read(16)
+            bmff["bytes_read"] += len(header)
+            box_size, box_type = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if box_size == 1:
+                box_size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif box_size == 0:
+                box_size = size - pos
+            if box_size < header_size:
+                raise ValueError(f"bad {box_type!r} box size at offset {pos}")
+            bmff["boxes"].append((box_type, pos, min(pos + box_size, size)))
+            
+            if box_type in (b'ftyp', b'meta'):
+                length = box_size - header_size
+                if length > BMFF_MAX_META_BYTES:
+                    raise ValueError(f"{box_type!r} box too large ({length} bytes)")
+                f.seek(pos + header_size)
+                data = f.read(length)
+                bmff["bytes_read"] += len(data)
+                if box_type == b'ftyp':
+                    bmff["brand"] = data[:4]
+                    bmff["compatible_brands"] = [data[i:i + 4] for i in range(8, len(data) - 3, 4)]
+                elif meta is None:
+                    meta = data
+            pos += box_size
+        
+        if not bmff["brand"]:
+            raise ValueError("no ftyp box")
+        if meta is None:
+            return bmff
+        
+        # meta is a full box: version and flags come before its children
+        item_types, mime_types, locations = {}, {}, {}
+        properties, associations, idat = [], {}, b''
+        for box_type, start, end in self._bmff_children(meta, 4, len(meta)):
+            if box_type == b'pitm':
+                bmff["primary_item"] = struct.unpack_from('>H' if meta[start] == 0 else '>I',
+                                                          meta, start + 4)[0]
+            elif box_type == b'iinf':
+                self._parse_iinf(meta, start, end, item_types, mime_types)
+            elif box_type == b'iloc':
+                self._parse_iloc(meta, start, end, locations)
+            elif box_type == b'iprp':
+                self._parse_iprp(meta, start, end, properties, associations)
+            elif box_type == b'idat':
+                idat = meta[start:end]
+        
+        bmff["items"] = [(item_id, item_type.decode('latin-1'))
+                         for item_id, item_type in sorted(item_types.items())]
+        
+        # Primary image size from its ispe property; any ispe will do without a pitm
+        candidates = associations.get(bmff["primary_item"], range(len(properties)))
+        for index in candidates:
+            if index < len(properties) and properties[index][0] == b'ispe':
+                bmff["width"], bmff["height"] = properties[index][1]
+                break
+        
+        for item_id, item_type in item_types.items():
+            if item_type == b'Exif':
+                data = self._read_bmff_item(f, size, locations.get(item_id), idat, bmff)
+                if data and len(data) >= 4:
+                    # The payload starts with the offset of the TIFF header
+                    tiff_start = 4 + struct.unpack_from('>I', data)[0]
+                    bmff["exif"] = data[tiff_start:] if tiff_start < len(data) else None
+            elif item_type == b'mime':
+                data = self._read_bmff_item(f, size, locations.get(item_id), idat, bmff)
+                if not data:
+                    continue
+                if mime_types.get(item_id) == 'application/rdf+xml':
+                    bmff["xmp"] = data.decode('utf-8', errors='replace')
+                else:
+                    bmff["mime"].append((mime_types.get(item_id), data))
+        return bmff
+    
+    def _bmff_children(self, data, start, end):
+        """Yield (type, payload start, payload end) for the boxes in data[start:end]"""
+        pos = start
+        while pos + 8 <= end:
+            box_size, box_type = struct.unpack_from('>I4s', data, pos)
+            header_size = 8
+            if box_size == 1:
+                box_size = struct.unpack_from('>Q', data, pos + 8)[0]
+                header_size = 16
+            elif box_size == 0:
+                box_size = end - pos
+            if box_size < header_size or pos + box_size > end:
+                return
+            yield box_type, pos + header_size, pos + box_size
+            pos += box_size
+    
+    def _parse_iinf(self, meta, start, end, item_types, mime_types):
+        """Item types (and content types of mime items) from an iinf box"""
+        version = meta[start]
+        pos = start + (6 if version == 0 else 8)
+        for box_type, infe_start, infe_end in self._bmff_children(meta, pos, end):
+            if box_type != b'infe':
+                continue
+            infe_version = meta[infe_start]
+            pos = infe_start + 4
+            if infe_version < 2:
+                # Versions 0 and 1 predate item types; their items are described by MIME type
+                item_id = struct.unpack_from('>H', meta, pos)[0]
+                pos += 4
+                item_type = b'mime'
+                name_end = meta.index(b'\x00', pos, infe_end)
+                pos = name_end + 1
+            else:
+                if infe_version == 2:
+                    item_id = struct.unpack_from('>H', meta, pos)[0]
+                    pos += 2
+                else:
+                    item_id = struct.unpack_from('>I', meta, pos)[0]
+                    pos += 4
+                item_type = meta[pos + 2:pos + 6]
+                pos += 6
+                # Skip the item name
+                pos = meta.index(b'\x00', pos, infe_end) + 1
+            item_types[item_id] = item_type
+            if item_type == b'mime' and pos < infe_end:
+                type_end = meta.find(b'\x00', pos, infe_end)
+                mime_types[item_id] = meta[pos:type_end if type_end != -1 else infe_end].decode(
+                    'ascii', errors='replace')
+    
+    def _parse_iloc(self, meta, start, end, locations):
+        """Item locations from an iloc box: {item_id: (construction method, [(offset, length)])}"""
+        version = meta[start]
+        sizes = meta[start + 4]
+        offset_size, length_size = sizes >> 4, sizes & 0x0F
+        sizes = meta[start + 5]
+        base_offset_size = sizes >> 4
+        index_size = sizes & 0x0F if version in (1, 2) else 0
+        pos = start + 6
+        
+        def read_uint(width):
+            nonlocal pos
+            value = int.from_bytes(meta[pos:pos + width], 'big')
+            pos += width
+            return value
+        
+        item_count = read_uint(2 if version < 2 else 4)
+        for _ in range(item_count):
+            if pos >= end:
+                break
+            item_id = read_uint(2 if version < 2 else 4)
+            construction_method = read_uint(2) & 0x0F if version in (1, 2) else 0
+            read_uint(2)  # data_reference_index
+            base_offset = read_uint(base_offset_size)
+            extents = []
+            for _ in range(read_uint(2)):
+                read_uint(index_size)
+                extent_offset = read_uint(offset_size)
+                extents.append((base_offset + extent_offset, read_uint(length_size)))
+            locations[item_id] = (construction_method, extents)
+    
+    def _parse_iprp(self, meta, start, end, properties, associations):
+        """Item properties (ispe sizes only) and their associations from an iprp box"""
+        for box_type, child_start, child_end in self._bmff_children(meta, start, end):
+            if box_type == b'ipco':
+                for prop_type, prop_start, prop_end in self._bmff_children(meta, child_start, child_end):
+                    if prop_type == b'ispe' and prop_end - prop_start >= 12:
+                        properties.append((prop_type, struct.unpack_from('>II', meta, prop_start + 4)))
+                    else:
+                        properties.append((prop_type, None))
+            elif box_type == b'ipma':
+                version, flags = meta[child_start], int.from_bytes(meta[child_start + 1:child_start + 4], 'big')
+                pos = child_start + 4
+                entry_count = struct.unpack_from('>I', meta, pos)[0]
+                pos += 4
+                for _ in range(entry_count):
+                    if version < 1:
+                        item_id = struct.unpack_from('>H', meta, pos)[0]
+                        pos += 2
+                    else:
+                        item_id = struct.unpack_from('>I', meta, pos)[0]
+                        pos += 4
+                    indices = []
+                    count = meta[pos]
+                    pos += 1
+                    for _ in range(count):
+                        if flags & 1:
+                            value = struct.unpack_from('>H', meta, pos)[0] & 0x7FFF
+                            pos += 2
+                        else:
+                            value = meta[pos] & 0x7F
+                            pos += 1
+                        # Property indices are 1-based; 0 means "no property"
+                        if value:
+                            indices.append(value - 1)
+                    associations[item_id] = indices
+    
+    def _read_bmff_item(self, f, size, location, idat, bmff):
+        """Concatenate an item's extents, from the file or from the idat box"""
+        if location is None:
+            return None
+        construction_method, extents = location
+        if construction_method not in (0, 1):
+            # Method 2 builds items from other items; nothing we need is stored that way
+            return None
+        parts = []
+        total = 0
+        for offset, length in extents:
+            if construction_method == 1:
+                part = idat[offset:offset + length if length else len(idat)]
+            else:
+                if offset >= size:
+                    return None
+                if not length:
+                    length = size - offset
+                length = min(length, BMFF_MAX_ITEM_BYTES - total)
+                f.seek(offset)
+                part = f.read(length)
+                bmff["bytes_read"] += len(part)
+            parts.append(part)
+            total += len(part)
+            if total >= BMFF_MAX_ITEM_BYTES:
+                break
+        return b''.join(parts)
+    
+    def extract_xmp_data(self, xmp_text):
+        """Summarise an XMP packet: creator, description, rights and AI markers"""
+        xmp_data = {"Present": "Yes"}
+        
+        # Try to extract key XMP fields
+        xmp_data["Raw"] = xmp_text[:100] + "... (truncated)" if len(xmp_text) > 100 else xmp_text
+        
+        # Extract creator information
+        creator_match = re.search(r'<dc:creator>(.*?)</dc:creator>', xmp_text, re.DOTALL)
+        if creator_match:
+            xmp_data["Creator"] = creator_match.group(1).strip()
+        
+        # Extract description
+        desc_match = re.search(r'<dc:description>(.*?)</dc:description>', xmp_text, re.DOTALL)
+        if desc_match:
+            xmp_data["Description"] = desc_match.group(1).strip()
+        
+        # Extract rights
+        rights_match = re.search(r'<dc:rights>(.*?)</dc:rights>', xmp_text, re.DOTALL)
+        if rights_match:
+            xmp_data["Rights"] = rights_match.group(1).strip()
+        
+        # Look for AI-specific fields
+        if "trainedAlgorithmicMedia" in xmp_text:
+            xmp_data["AI_Generated"] = "Yes"
+        
+        # Extract digital source type
+        source_match = re.search(r'DigitalSourceType="([^"]+)"', xmp_text)
+        if source_match:
+            xmp_data["Digital_Source_Type"] = source_match.group(1).strip()
+        
+        # Look for GUID
+        guid_match = re.search(r'DigImageGUID="([^"]+)"', xmp_text)
+        if guid_match:
+            xmp_data["Image_GUID"] = guid_match.group(1).strip()
+        
+        return xmp_data
+    
+    def process_video(self, file_path, file_ext):
+        """Process video files"""
+        result = self.extract_video_result(file_path, file_ext)
+        return result.to_dict(), result.prompt
+    
+    def extract_video_result(self, file_path, file_ext, source=None, file_size=None):
+        """Extract a video's metadata into an ExtractionResult"""
+        source = file_path if source is None else source
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        # Basic file info
+        result = ExtractionResult(path=file_path, kind='video', file_size=file_size)
+        metadata = result.sections
+        
+        # Extract video metadata
+        if have_mediainfo():
+            try:
+                # Parsed in a worker process: a file that hangs or crashes libmediainfo
+                # costs its timeout, not the app or the rest of a batch
+                from metaprobe_mediainfo import shared_pool
+                metadata.update(shared_pool().parse(source, self.mediainfo_depth, self.mediainfo_timeout))
+            except Exception as e:
+                metadata["Error"] = {"MediaInfo Error": str(e)}
+        else:
+            metadata["Notice"] = {"Limited Information": "Install pymediainfo for more detailed video metadata."}
+        
+        # Try to extract AI metadata from binary data
+        try:
+            # Read the first chunk of the file to check for metadata in headers
+            with open_binary(source) as f:
+                # Read a large chunk to capture metadata in the header
+                file_header = f.read(32768)  # 32KB should be enough for most headers
+            
+            # Look for JSON data or prompt patterns
+            ai_metadata, prompt = self.extract_metadata_from_binary(file_header)
+            
+            if ai_metadata:
+                result.ai = ai_metadata
+                
+            if prompt:
+                result.prompt = prompt
+        
+        except Exception as e:
+            if "Error" not in metadata:
+                metadata["Error"] = {}
+            metadata["Error"]["Binary Analysis Error"] = str(e)
+        
+        return result
+    
+    def extract_ai_metadata_from_image(self, img, file_path):
+        """Extract AI metadata from image file
+        
+        Registered generator detectors run first, against only the fields
+        they declare; the file's raw bytes are scanned only when none of
+        them recognises the image. file_path may be an open archive member,
+        of which only the first ARCHIVE_HEADER_BYTES are scanned.
+        """
+        budget = self.scan_budget
+        if header_only_source(file_path):
+            budget = min(budget or ARCHIVE_HEADER_BYTES, ARCHIVE_HEADER_BYTES)
+        metadata = {}
+        prompt = None
+        
+        # Pillow reaches an eXIf chunk after the pixel data only by decoding them;
+        # seek to it instead (see read_exif), unless only the headers may be read
+        if getattr(img, 'format', None) == 'PNG' and "exif" not in img.info and not header_only_source(file_path):
+            with open_binary(file_path) as f:
+                exif = read_png_exif(f)
+            if exif:
+                img.info["exif"] = exif
+        
+        # Check Author field - Often indicates AI generator
+        if hasattr(img, 'info') and img.info.get('Author'):
+            metadata["Author"] = img.info['Author']
+        
+        # 0. Ask the detector registry - highest priority
+        detected = self.detect_generator(img)
+        if detected:
+            metadata.update(detected)
+            return metadata, detected.get("prompt")
+        
+        # 1. Check for Stable Diffusion metadata, scanning the file window by window
+        sd_match = None
+        for _, data, owned in iter_file_windows(file_path, budget):
+            sd_match = SD_BINARY_PATTERN.search(data)
+            if sd_match and sd_match.start() < owned:
+                break
+            sd_match = None
+        
+        if sd_match:
+            prompt_text = sd_match.group(1).decode('utf-8', errors='ignore').strip()
+            metadata["Generator"] = "Stable Diffusion"
+            metadata["prompt"] = prompt_text
+            prompt = prompt_text
+            
+            # Split the block into prompts and typed generation parameters
+            metadata.update(self.parse_sd_parameters(prompt_text))
+            
+            return metadata, prompt
+        
+        # 2. As a last resort, try to find AI patterns in binary data
+        if not prompt:
+            for _, data, _ in iter_file_windows(file_path, budget):
+                bin_metadata, bin_prompt = self.extract_metadata_from_binary(data)
+                if bin_metadata:
+                    metadata.update(bin_metadata)
+                if bin_prompt:
+                    prompt = bin_prompt
+                    break
+                
+        return metadata, prompt
+    
+    def detect_generator(self, img):
+        """Run every registered detector in one pass; returns the most confident match
+        
+        The detector's confidence comes under "Detector_Confidence"; the
+        image pipelines move it out of AI_Metadata into
+        ExtractionResult.detector_confidence.
+        """
+        fields = self.read_detector_fields(img)
+        best = None
+        for detector in DETECTORS:
+            try:
+                result = detector.detect(fields, self)
+            except Exception:
+                continue
+            if result and (best is None or detector.confidence > best[0]):
+                best = (detector.confidence, result)
+        
+        if best is None:
+            return {}
+        result = dict(best[1])
+        result["Detector_Confidence"] = best[0]
+        return result
+    
+    def read_detector_fields(self, img):
+        """Read just the info keys, EXIF tags and XMP properties detectors declare"""
+        info_keys, exif_tags, xmp_properties = detector_fields()
+        info = getattr(img, 'info', None) or {}
+        fields = {
+            "info": {key: info[key] for key in info_keys if key in info},
+            "exif": {},
+            "xmp": {}
+        }
+        
+        if exif_tags and hasattr(img, 'getexif'):
+            exif = read_exif(img)
+            missing = [tag for tag in exif_tags if tag not in exif]
+            # Only parse the Exif sub-IFD when a declared tag isn't in IFD0
+            sub_ifd = exif.get_ifd(EXIF_IFD_POINTER) if missing and EXIF_IFD_POINTER in exif else {}
+            for tag in exif_tags:
+                value = exif.get(tag, sub_ifd.get(tag))
+                if value:
+                    fields["exif"][tag] = decode_exif_text(value)
+        
+        xmp = info.get('XML:com.adobe.xmp') or info.get('xmp')
+        if xmp_properties and xmp:
+            if isinstance(xmp, bytes):
+                xmp = xmp.decode('utf-8', errors='replace')
+            for prop in xmp_properties:
+                value = read_xmp_property(xmp, prop)
+                if value is not None:
+                    fields["xmp"][prop] = value
+        
+        return fields
+    
+    def extract_metadata_from_binary(self, binary_data):
+        """Extract metadata from binary file data"""
+        metadata = {}
+        prompt = None
+        
+        # Embedded JSON, matched bracket by bracket
+        for json_data in iter_json_objects(binary_data):
+            for key in ("prompt", "positive_prompt"):
+                if key in json_data:
+                    metadata["Generator"] = "AI Generator (from JSON)"
+                    metadata["prompt"] = json_data[key]
+                    prompt = json_data[key]
+                    return metadata, prompt
+        
+        # Prompt patterns
+        for pattern in BINARY_PROMPT_PATTERNS:
+            for match in pattern.finditer(binary_data):
+                text = match.group(1).decode('utf-8', errors='ignore')
+                # Clean up the text
+                text = re.sub(r'[^\x20-\x7E]', ' ', text).strip()
+                if len(text) > 15:  # Filter out very short matches
+                    metadata["Generator"] = "AI Generator (from binary data)"
+                    metadata["prompt"] = text
+                    prompt = text
+                    return metadata, prompt
+        
+        return metadata, prompt
+    
+    def parse_sd_parameters(self, text):
+        """Tokenize an AUTOMATIC1111 "parameters" block in a single pass
+        
+        Returns positive_prompt, negative_prompt and a "parameters" dict of
+        the settings line with quoted values unwrapped and numbers converted,
+        so results can be filtered without re-parsing strings.
+        """
+        result = {}
+        text = text.strip()
+        
+        # The settings line is the last line starting with "Steps: "
+        if text.startswith("Steps: "):
+            params_start = 0
+        else:
+            params_start = text.rfind("\nSteps: ")
+            params_start = params_start + 1 if params_start != -1 else -1
+        
+        if params_start != -1:
+            params_line = text[params_start:]
+            prompts = text[:params_start]
+        else:
+            params_line = ""
+            prompts = text
+        
+        neg_start = prompts.find("Negative prompt:")
+        if neg_start != -1:
+            result["positive_prompt"] = prompts[:neg_start].strip()
+            result["negative_prompt"] = prompts[neg_start + len("Negative prompt:"):].strip()
+        else:
+            result["positive_prompt"] = prompts.strip()
+        
+        if not params_line:
+            return result
+        
+        parameters = {}
+        for match in SD_PARAM_PATTERN.finditer(params_line):
+            key = match.group(1).strip()
+            value = match.group(2).strip()
+            
+            if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    value = value[1:-1]
+            
+            if key.endswith(" hashes") and value:
+                # "name: hash, name: hash" -> {name: hash}
+                hashes = {}
+                for item in value.split(","):
+                    name, sep, item_hash = item.rpartition(":")
+                    if sep:
+                        hashes[name.strip()] = item_hash.strip()
+                value = hashes or value
+            elif key == "Size" or key == "Hires resize":
+                width, sep, height = value.partition("x")
+                if sep and width.isdigit() and height.isdigit():
+                    prefix = "" if key == "Size" else "Hires "
+                    parameters[prefix + "Width"] = int(width)
+                    parameters[prefix + "Height"] = int(height)
+            elif "hash" not in key.lower() and key not in SD_STRING_PARAMS:
+                if SD_INT_PATTERN.fullmatch(value):
+                    value = float(value) if key in SD_FLOAT_PARAMS else int(value)
+                elif SD_FLOAT_PATTERN.fullmatch(value):
+                    value = float(value)
+            
+            parameters[key] = value
+        
+        if parameters:
+            result["parameters"] = parameters
+        return result
+    
+    def extract_comfyui_metadata(self, info):
+        """Extract structured generation settings from a ComfyUI node graph
+        
+        The API-format 'prompt' graph is preferred since its node inputs are
+        named; the UI 'workflow' graph is only parsed when no usable 'prompt'
+        chunk is present, so each image costs a single json.loads.
+        """
+        nodes = None
+        
+        prompt_text = info.get('prompt')
+        if prompt_text:
+            try:
+                graph = json.loads(prompt_text)
+            except (TypeError, ValueError):
+                graph = None
+            if isinstance(graph, dict):
+                nodes = {}
+                for node_id, node in graph.items():
+                    if isinstance(node, dict) and 'class_type' in node:
+                        nodes[str(node_id)] = (node['class_type'], node.get('inputs') or {})
+        
+        if not nodes and info.get('workflow'):
+            try:
+                graph = json.loads(info['workflow'])
+            except (TypeError, ValueError):
+                graph = None
+            if isinstance(graph, dict) and isinstance(graph.get('nodes'), list):
+                nodes = self._comfyui_nodes_from_workflow(graph)
+        
+        if not nodes:
+            return {}
+        
+        # Index nodes by class type once; every lookup below goes through it
+        by_type = {}
+        for node_id, (class_type, _) in nodes.items():
+            by_type.setdefault(class_type, []).append(node_id)
+        
+        metadata = {
+            "Generator": "ComfyUI",
+            "node_count": len(nodes),
+            "node_types": sorted(by_type)
+        }
+        
+        # Sampler settings come from the first sampler node in the graph
+        sampler_id = next((node_id for class_type in COMFYUI_SAMPLER_TYPES
+                           for node_id in by_type.get(class_type, [])), None)
+        if sampler_id is not None:
+            inputs = nodes[sampler_id][1]
+            for key, name in (('sampler_name', 'sampler'), ('scheduler', 'scheduler'),
+                               ('steps', 'steps'), ('cfg', 'cfg'), ('denoise', 'denoise')):
+                value = inputs.get(key)
+                if value is not None and not isinstance(value, list):
+                    metadata[name] = value
+            seed = inputs.get('seed', inputs.get('noise_seed'))
+            if seed is not None and not isinstance(seed, list):
+                metadata["seed"] = seed
+            
+            positive = self._comfyui_text_from(nodes, inputs.get('positive'))
+            negative = self._comfyui_text_from(nodes, inputs.get('negative'))
+            if positive:
+                metadata["positive_prompt"] = positive
+                metadata["prompt"] = positive
+            if negative:
+                metadata["negative_prompt"] = negative
+        
+        # Without a sampler fall back to the first text encoder's text
+        if "prompt" not in metadata:
+            for node_id in by_type.get('CLIPTextEncode', []):
+                text = nodes[node_id][1].get('text')
+                if isinstance(text, str) and text.strip():
+                    metadata["prompt"] = text.strip()
+                    break
+        
+        for class_type in COMFYUI_CHECKPOINT_TYPES:
+            for node_id in by_type.get(class_type, []):
+                ckpt_name = nodes[node_id][1].get('ckpt_name')
+                if isinstance(ckpt_name, str):
+                    metadata["checkpoint"] = ckpt_name
+                    break
+            if "checkpoint" in metadata:
+                break
+        
+        loras = []
+        for class_type in COMFYUI_LORA_TYPES:
+            for node_id in by_type.get(class_type, []):
+                inputs = nodes[node_id][1]
+                if not isinstance(inputs.get('lora_name'), str):
+                    continue
+                lora = {"name": inputs['lora_name']}
+                for key in ('strength_model', 'strength_clip'):
+                    if key in inputs and not isinstance(inputs[key], list):
+                        lora[key] = inputs[key]
+                loras.append(lora)
+        if loras:
+            metadata["loras"] = loras
+        
+        return metadata
+    
+    def _comfyui_text_from(self, nodes, ref, depth=0):
+        """Follow a conditioning link upstream to the text that produced it"""
+        # Links are [source_node_id, output_index]
+        if not isinstance(ref, list) or not ref or depth > 16:
+            return None
+        node = nodes.get(str(ref[0]))
+        if node is None:
+            return None
+        
+        class_type, inputs = node
+        text = inputs.get('text')
+        if isinstance(text, str):
+            return text.strip()
+        # SDXL encoders split the prompt across text_g/text_l
+        if isinstance(inputs.get('text_g'), str):
+            return inputs['text_g'].strip()
+        if isinstance(text, list):
+            return self._comfyui_text_from(nodes, text, depth + 1)
+        
+        # Conditioning combine/concat/set-area nodes: gather every upstream text
+        texts = []
+        for key in sorted(inputs):
+            if key.startswith('conditioning'):
+                upstream = self._comfyui_text_from(nodes, inputs[key], depth + 1)
+                if upstream and upstream not in texts:
+                    texts.append(upstream)
+        return ", ".join(texts) if texts else None
+    
+    def _comfyui_nodes_from_workflow(self, workflow):
+        """Convert a UI-format workflow into {id: (class_type, inputs)}
+        
+        Only the fields used by extract_comfyui_metadata are mapped: widget
+        values by their position for the well-known node types, and linked
+        inputs as [source_id, slot] like in the API format.
+        """
+        link_sources = {}
+        for link in workflow.get('links') or []:
+            # [link_id, from_node, from_slot, to_node, to_slot, type]
+            if isinstance(link, list) and len(link) >= 3:
+                link_sources[link[0]] = [str(link[1]), link[2]]
+        
+        nodes = {}
+        for node in workflow['nodes']:
+            if not isinstance(node, dict) or 'type' not in node:
+                continue
+            class_type = node['type']
+            widgets = node.get('widgets_values') or []
+            inputs = {}
+            if isinstance(widgets, list):
+                for key, value in zip(COMFYUI_WIDGET_NAMES.get(class_type, ()), widgets):
+                    if key:
+                        inputs[key] = value
+            for slot in node.get('inputs') or []:
+                if isinstance(slot, dict) and slot.get('link') in link_sources:
+                    inputs[slot.get('name')] = link_sources[slot['link']]
+            nodes[str(node.get('id'))] = (class_type, inputs)
+        return nodes
+    
+    def create_thumbnail(self, file_path):
+        """Decode an image file at preview size, JPEGs at reduced scale
+        
+        The file (or PrefetchedFile) is opened afresh: draft() and
+        thumbnail() shrink the image they are called on, which must not be
+        one a caller still reads.
+        """
+        with open_image(file_path) as img:
+            # draft() lets the JPEG decoder skip most of the DCT work; it must be
+            # called before the pixels are loaded and is a no-op for other formats
+            img.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+            img.thumbnail(THUMBNAIL_SIZE)
+            img.load()
+        return img
+    
+    def compute_dhash(self, img):
+        """64-bit difference hash: brightness gradients of a 9x8 grayscale image"""
+        pixels = img.convert('L').resize((9, 8), PILImage.BILINEAR).tobytes()
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                value = (value << 1) | (left > pixels[row * 9 + col + 1])
+        return value
+    
+    def deep_scan_file(self, file_path, on_update=None, top_k=DEEP_SCAN_TOP_K):
+        """Search a whole file for prompt-like text
+        
+        Text-bearing parts of the container (text chunks, EXIF, XMP,
+        comments) are decoded and scanned first; pixel data is skipped and
+        only regions of unknown purpose are scanned as raw bytes.
+        
+        Returns a PromptCandidates holding the best top_k distinct matches.
+        on_update(candidates, bytes_scanned) is called after every region
+        or window that changed the ranking, so callers can show results early.
+        """
+        candidates = PromptCandidates(top_k)
+        text_regions, raw_ranges = self.map_file_regions(file_path)
+        
+        for key, data in text_regions:
+            changed = False
+            # Values of well-known keys are prompts in their own right
+            if key in DEEP_SCAN_TEXT_KEYS:
+                text = re.sub(r'[^\x20-\x7E]', ' ', data.decode('utf-8', errors='ignore')).strip()
+                changed = candidates.add(text)
+            if self._scan_for_candidates(data, len(data), candidates):
+                changed = True
+            if changed and on_update:
+                on_update(candidates, 0)
+        
+        for offset, data, owned in iter_file_windows(file_path, window_size=DEEP_SCAN_WINDOW_SIZE,
+                                                     ranges=raw_ranges):
+            if self._scan_for_candidates(data, owned, candidates) and on_update:
+                on_update(candidates, offset + owned)
+        
+        return candidates
+    
+    def _scan_for_candidates(self, data, owned, candidates):
+        """Offer every pattern match starting before `owned` to the candidates"""
+        changed = False
+        for pattern in DEEP_SCAN_PATTERNS:
+            for match in pattern.finditer(data):
+                # Matches starting in the overlap are picked up by the next window
+                if match.start() >= owned:
+                    break
+                text = match.group(1) if pattern.groups else match.group(0)
+                # Clean up the text
+                text = re.sub(r'[^\x20-\x7E]', ' ', text.decode('utf-8', errors='ignore')).strip()
+                if candidates.add(text):
+                    changed = True
+        return changed
+    
+    def defer_large_values(self, file_path, sections):
+        """Swap section text longer than BLOB_INLINE_MAX for BlobRefs into the file
+        
+        The XMP packet, of which XMP_Metadata only keeps the start, becomes
+        a reference to the whole packet. The file is only walked when some
+        value is that large; values not found by locate_blobs stay inline.
+        """
+        large = [(name, key) for name in ('Format_Specific', 'EXIF', 'XMP_Metadata')
+                 for key, value in sections.get(name, {}).items()
+                 if isinstance(value, str) and len(value) > BLOB_INLINE_MAX]
+        if str(sections.get('XMP_Metadata', {}).get('Raw', '')).endswith('... (truncated)'):
+            large.append(('XMP_Metadata', 'Raw'))
+        if not large:
+            return
+        try:
+            blobs = self.locate_blobs(file_path)
+        except (OSError, ValueError, struct.error):
+            return
+        for name, key in large:
+            blob = blobs.get((name, key))
+            if blob is not None:
+                sections[name][key] = replace(blob, preview=sections[name][key][:BLOB_PREVIEW_CHARS])
+    
+    def locate_blobs(self, file_path):
+        """Where the text values of a PNG, JPEG or WebP live, without reading them
+        
+        Returns {(section, key): BlobRef} for PNG text chunks ahead of the
+        image data (Format_Specific, plus XMP_Metadata/Raw for the XMP
+        packet) and for text and byte-valued EXIF fields (EXIF). Where a
+        key repeats, the last one wins, as in Pillow.
+        """
+        blobs = {}
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            
+            def add(section, key, offset, length, codec):
+                blobs[(section, key)] = BlobRef(file_path, offset, length, codec, stat.st_mtime_ns)
+            
+            exif = None
+            signature = f.read(12)
+            if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+                pos, text = 8, True
+                while pos + 12 <= size:
+                    f.seek(pos)
+                    length, chunk_type = struct.unpack('>I4s', f.read(8))
+                    data_start = pos + 8
+                    if chunk_type == b'IDAT':
+                        # Pillow reads the text chunks after the image data only on load()
+                        text = False
+                    elif text and chunk_type in (b'tEXt', b'zTXt', b'iTXt'):
+                        keyword = f.read(min(length, 80)).partition(b'\x00')[0].decode('latin-1')
+                        add('Format_Specific', keyword, data_start, length, chunk_type.decode('ascii'))
+                        if keyword == 'XML:com.adobe.xmp':
+                            add('XMP_Metadata', 'Raw', data_start, length, chunk_type.decode('ascii'))
+                    elif chunk_type == b'eXIf':
+                        exif = (data_start, length)
+                    elif chunk_type == b'IEND':
+                        break
+                    pos = data_start + length + 4
+            elif signature.startswith(b'\xff\xd8'):
+                pos = 2
+                while pos + 4 <= size:
+                    f.seek(pos)
+                    marker, length = struct.unpack('>2sH', f.read(4))
+                    if marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+                        break
+                    if marker[1] == 0xE1 and f.read(6) == b'Exif\x00\x00':
+                        exif = (pos + 10, length - 8)
+                        break
+                    pos += 2 + length
+            elif signature[:4] == b'RIFF' and signature[8:12] == b'WEBP':
+                pos = 12
+                while pos + 8 <= size:
+                    f.seek(pos)
+                    fourcc, length = struct.unpack('<4sI', f.read(8))
+                    if fourcc == b'EXIF':
+                        skip = 6 if f.read(6) == b'Exif\x00\x00' else 0
+                        exif = (pos + 8 + skip, length - skip)
+                        break
+                    pos += 8 + length + (length & 1)
+            
+            if exif is not None:
+                start, length = exif
+                f.seek(start)
+                self._locate_exif_blobs(f.read(length), start, add)
+        return blobs
+    
+    def _locate_exif_blobs(self, data, start, add):
+        """Report the text and byte-valued fields of IFD0 and the Exif IFD to add()
+        
+        Offsets in a TIFF block are relative to its start, which is at
+        `start` in the file. Fields of 4 bytes or less sit in the entry itself
+        and are never large, so only out-of-line values are reported.
+        """
+        order = '<' if data[:2] == b'II' else '>'
+        pending, seen = [struct.unpack(order + 'I', data[4:8])[0]], set()
+        while pending:
+            ifd = pending.pop(0)
+            if ifd in seen or ifd + 2 > len(data):
+                continue
+            seen.add(ifd)
+            for index in range(struct.unpack(order + 'H', data[ifd:ifd + 2])[0]):
+                entry = ifd + 2 + 12 * index
+                if entry + 12 > len(data):
+                    break
+                tag, kind, count, value = struct.unpack(order + 'HHII', data[entry:entry + 12])
+                if tag == EXIF_IFD_POINTER:
+                    pending.append(value)
+                elif kind in (EXIF_BYTE, EXIF_ASCII, EXIF_UNDEFINED) and count > 4 and value + count <= len(data):
+                    codec = 'exif-ascii' if kind == EXIF_ASCII else 'exif-bytes'
+                    add('EXIF', ExifTags.TAGS.get(tag, str(tag)), start + value, count, codec)
+    
+    def map_file_regions(self, file_path):
+        """Split a file into decoded text regions and raw byte ranges to scan
+        
+        Returns ([(key, text_bytes), ...], [(start, end), ...]). Containers
+        we don't understand come back as a single raw range.
+        """
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            signature = f.read(12)
+            try:
+                if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+                    return self._png_regions(f, size)
+                if signature.startswith(b'\xff\xd8'):
+                    return self._jpeg_regions(f, size)
+                if signature[:4] == b'RIFF' and signature[8:12] == b'WEBP':
+                    return self._webp_regions(f, size)
+                if signature[4:8] == b'ftyp':
+                    return self._bmff_regions(f, size)
+            except (struct.error, ValueError, zlib.error):
+                pass
+        return [], [(0, size)]
+    
+    def _png_regions(self, f, size):
+        """Text and raw regions of a PNG; compressed text chunks are inflated"""
+        texts, raw = [], []
+        pos = 8
+        while pos + 12 <= size:
+            f.seek(pos)
+            length, chunk_type = struct.unpack('>I4s', f.read(8))
+            data_start, data_end = pos + 8, pos + 8 + length
+            if data_end + 4 > size:
+                # Truncated chunk - scan whatever is left
+                break
+            
+            if chunk_type in (b'tEXt', b'zTXt', b'iTXt'):
+                f.seek(data_start)
+                key, text = decode_png_text_chunk(chunk_type, f.read(length))
+                texts.append((key, text))
+            elif chunk_type == b'eXIf':
+                f.seek(data_start)
+                texts.extend(self._exif_texts(f.read(length)))
+            elif chunk_type not in PNG_NON_TEXT_CHUNKS:
+                raw.append((data_start, data_end))
+            
+            pos = data_end + 4
+            if chunk_type == b'IEND':
+                break
+        
+        # Anything appended after IEND (or a truncated tail)
+        if pos < size:
+            raw.append((pos, size))
+        return texts, raw
+    
+    def _jpeg_regions(self, f, size):
+        """Text and raw regions of a JPEG; entropy-coded scan data is skipped"""
+        texts, raw = [], []
+        pos = 2
+        while pos + 4 <= size:
+            f.seek(pos)
+            marker = f.read(2)
+            if marker[0] != 0xFF:
+                break
+            code = marker[1]
+            if code == 0xFF:
+                # Fill byte
+                pos += 1
+                continue
+            if code in (0x01, 0xD8) or 0xD0 <= code <= 0xD7:
+                pos += 2
+                continue
+            if code == 0xD9:
+                pos += 2
+                break
+            if code == 0xDA:
+                # Image data runs to the end-of-image marker
+                pos = self._find_jpeg_end(f, pos, size)
+                break
+            
+            length = struct.unpack('>H', f.read(2))[0]
+            data_start, data_end = pos + 4, pos + 2 + length
+            if code == 0xE1 or code == 0xFE:
+                f.seek(data_start)
+                data = f.read(data_end - data_start)
+                if data.startswith(b'Exif\x00\x00'):
+                    texts.extend(self._exif_texts(data[6:]))
+                elif data.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
+                    texts.append(('XMP', data.partition(b'\x00')[2]))
+                elif data.startswith(b'http://ns.adobe.com/xmp/extension/\x00'):
+                    # GUID (32) + full length (4) + offset (4) precede the packet
+                    texts.append(('XMP', data.partition(b'\x00')[2][40:]))
+                elif code == 0xFE:
+                    texts.append(('Comment', data))
+                else:
+                    raw.append((data_start, data_end))
+            elif code not in JPEG_NON_TEXT_MARKERS:
+                raw.append((data_start, data_end))
+            pos = data_end
+        
+        if pos < size:
+            raw.append((pos, size))
+        return texts, raw
+    
+    def _find_jpeg_end(self, f, pos, size):
+        """Offset just past the last EOI marker, searching back from the file end"""
+        end = size
+        while end > pos:
+            start = max(pos, end - SCAN_WINDOW_SIZE)
+            f.seek(start)
+            found = f.read(end - start + 1).rfind(b'\xff\xd9')
+            if found != -1:
+                return start + found + 2
+            end = start
+        return size
+    
+    def _webp_regions(self, f, size):
+        """Text and raw regions of a WebP; bitstream chunks are skipped"""
+        texts, raw = [], []
+        pos = 12
+        while pos + 8 <= size:
+            f.seek(pos)
+            fourcc, length = struct.unpack('<4sI', f.read(8))
+            data_start, data_end = pos + 8, pos + 8 + length
+            if fourcc == b'EXIF':
+                data = f.read(length)
+                texts.extend(self._exif_texts(data[6:] if data.startswith(b'Exif\x00\x00') else data))
+            elif fourcc == b'XMP ':
+                texts.append(('XMP', f.read(length)))
+            elif fourcc not in WEBP_NON_TEXT_CHUNKS:
+                raw.append((data_start, min(data_end, size)))
+            # Chunks are padded to an even size
+            pos = data_end + (length & 1)
+        if pos < size:
+            raw.append((pos, size))
+        return texts, raw
+    
+    def _bmff_regions(self, f, size):
+        """Text and raw regions of a HEIF/AVIF; the mdat box (image data) is skipped
+        
+        Exif, XMP and other MIME items are read by their extents, so the
+        parts of mdat that hold metadata are still scanned.
+        """
+        bmff = self.read_bmff_items(f, size)
+        texts = []
+        if bmff["exif"]:
+            texts.extend(self._exif_texts(bmff["exif"]))
+        if bmff["xmp"]:
+            texts.append(('XMP', bmff["xmp"].encode('utf-8')))
+        texts.extend((content_type or 'mime', data) for content_type, data in bmff["mime"])
+        raw = [(start, end) for box_type, start, end in bmff["boxes"] if box_type != b'mdat']
+        return texts, raw
+    
+    def _exif_texts(self, exif):
+        """Scan targets for a TIFF/EXIF block: the block itself, plus a
+        UNICODE UserComment decoded from UTF-16, which raw patterns miss"""
+        texts = [('EXIF', exif)]
+        marker = exif.find(b'UNICODE\x00')
+        if marker != -1:
+            start = marker + 8
+            end = start
+            while end + 1 < len(exif) and exif[end:end + 2] != b'\x00\x00':
+                end += 2
+            # Writers disagree on byte order; ASCII text has its zero byte first in big-endian
+            if exif[start:start + 1] == b'\x00' and exif[start + 1:start + 2] != b'\x00':
+                encoding = 'utf-16-be'
+            elif exif[start + 1:start + 2] == b'\x00':
+                encoding = 'utf-16-le'
+            else:
+                encoding = 'utf-16-le' if exif[:2] == b'II' else 'utf-16-be'
+            comment = exif[start:end].decode(encoding, errors='ignore')
+            texts.append(('UserComment', comment.encode('utf-8')))
+        return texts
+    
+    def extract_exif_data(self, img):
+        """Extract EXIF data from an image"""
+        if getattr(img, 'format', None) == 'PNG':
+            # PngImageFile._getexif(), minus the load() that decodes the pixels (see read_exif)
+            if "exif" not in img.info and "Raw profile type exif" not in img.info:
+                return {}
+            exif = read_exif(img)._get_merged_dict()
+        else:
+            exif = img._getexif() if hasattr(img, '_getexif') else None
+        if not exif:
+            return {}
+        
+        processed_exif = {}
+        
+        for tag_id, value in exif.items():
+            # Get tag name if available
+            tag_name = ExifTags.TAGS.get(tag_id, str(tag_id))
+            
+            # Dates are kept as written; ExtractionResult formats them for display
+            
+            # Convert byte arrays to strings where possible
+            if isinstance(value, bytes):
+                try:
+                    value = value.decode('utf-8')
+                except UnicodeDecodeError:
+                    value = str(value)
+            
+            processed_exif[tag_name] = value
+        
+        return processed_exif
+
+def iter_media_files(paths, extensions=None, archives=False):
+    """Yield supported media files from a mix of file and folder paths
+    
+    With archives=True zip and tar files are yielded too, for the caller
+    to pass to MetadataExtractor.extract_archive.
+    """
+    if extensions is None:
+        extensions = SUPPORTED_IMAGE_EXT + SUPPORTED_VIDEO_EXT
+    
+    def wanted(name):
+        return (os.path.splitext(name)[1].lower() in extensions
+                or (archives and is_archive(name)))
+    
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if wanted(filename):
+                        yield os.path.join(dirpath, filename)
+        elif wanted(path):
+            yield path
+
+def shard_of(path, count):
+    """Shard (0 to count - 1) of a path, the same on every machine and run"""
+    key = path.replace('\\', '/').encode('utf-8', errors='surrogateescape')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') % count
+
+def folder_media_files(folder, extensions=None):
+    """Sorted paths of the supported media files directly inside a folder"""
+    if extensions is None:
+        extensions = SUPPORTED_IMAGE_EXT + SUPPORTED_VIDEO_EXT
+    with os.scandir(folder) as entries:
+        return sorted(entry.path for entry in entries
+                      if os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file())
+
+def approximate_size(value):
+    """Rough bytes held by a result's values: dicts, lists, strings and numbers"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(item) for item in value)
+    return size
+
+class NeighbourPrefetcher:
+    """Extraction results of the files next to the current one, made ahead of time
+    
+    focus() names the file being shown; one background thread then
+    extracts its folder neighbours, nearest first, and drops the plan as
+    soon as focus moves on. Results are kept least recently used first and
+    evicted past max_bytes, and only handed out while the file's size and
+    modification time are unchanged. With a ThumbnailCache, each file's
+    thumbnail is stored too, from the same decode.
+    """
+    
+    def __init__(self, extractor, thumbnails=None, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND,
+                 max_bytes=PREFETCH_MAX_BYTES):
+        self.extractor = extractor
+        self.thumbnails = thumbnails
+        self.ahead = ahead
+        self.behind = behind
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()  # path -> (version, ExtractionResult, approximate bytes)
+        self.bytes = 0
+        self.wanted = []  # paths still to extract for the current focus, nearest first
+        self.listing = (None, None, [])  # folder, its mtime, its media files
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+    
+    def neighbours(self, file_path):
+        """(previous, next) media files in file_path's folder; None past either end"""
+        files = self._folder_files(os.path.dirname(os.path.abspath(file_path)))
+        index = self._index(files, os.path.abspath(file_path))
+        if index is None:
+            return None, None
+        return (files[index - 1] if index > 0 else None,
+                files[index + 1] if index + 1 < len(files) else None)
+    
+    def focus(self, file_path):
+        """Start prefetching around the file now being shown"""
+        files = self._folder_files(os.path.dirname(os.path.abspath(file_path)))
+        index = self._index(files, os.path.abspath(file_path))
+        wanted = []
+        if index is not None:
+            # Next, previous, then further out in the direction of travel
+            for distance in range(1, max(self.ahead, self.behind) + 1):
+                if distance <= self.ahead and index + distance < len(files):
+                    wanted.append(files[index + distance])
+                if distance <= self.behind and index - distance >= 0:
+                    wanted.append(files[index - distance])
+        with self.lock:
+            self.wanted = wanted
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+    
+    def get(self, file_path):
+        """The prefetched ExtractionResult of a file, or None"""
+        file_path = os.path.abspath(file_path)
+        try:
+            version = self._version(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.results.get(file_path)
+            if entry is None or entry[0] != version:
+                return None
+            self.results.move_to_end(file_path)
+            return entry[1]
+    
+    def _folder_files(self, folder):
+        # Adding or removing a file changes the folder's modification time
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            with self.lock:
+                if self.listing[:2] == (folder, mtime):
+                    return self.listing[2]
+            files = [os.path.abspath(path) for path in folder_media_files(folder)]
+        except OSError:
+            return []
+        with self.lock:
+            self.listing = (folder, mtime, files)
+        return files
+    
+    def _index(self, files, file_path):
+        position = bisect.bisect_left(files, file_path)
+        return position if position < len(files) and files[position] == file_path else None
+    
+    def _version(self, file_path):
+        stat = os.stat(file_path)
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.wanted:
+                    self.wakeup.wait()
+                file_path = self.wanted.pop(0)
+                entry = self.results.get(file_path)
+            try:
+                version = self._version(file_path)
+                if entry is not None and entry[0] == version:
+                    continue
+                result = self.extractor.extract_result(file_path)
+                thumbnail, self.extractor.last_thumbnail = self.extractor.last_thumbnail, None
+                if self.thumbnails is not None and thumbnail and thumbnail[0] == file_path:
+                    self.thumbnails.put(file_path, thumbnail[1])
+            except Exception:
+                # The file is extracted again, and its error shown, when it is opened
+                continue
+            self._store(file_path, version, result)
+    
+    def _store(self, file_path, version, result):
+        size = approximate_size(result.to_record())
+        with self.lock:
+            previous = self.results.pop(file_path, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self.results[file_path] = (version, result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.results) > 1:
+                _, (_, _, evicted) = self.results.popitem(last=False)
+                self.bytes -= evicted
+
+class ThumbnailCache:
+    """Preview thumbnails kept on disk between runs
+    
+    Each entry is a PNG named by a hash of the file's absolute path,
+    modification time and size, so an edited file misses and is decoded
+    afresh. Decoding goes through MetadataExtractor.create_thumbnail, which
+    reads JPEGs at reduced scale. Entries are written to a temporary name
+    and renamed, so concurrent writers and readers never see half a file.
+    """
+    
+    def __init__(self, extractor, directory=THUMBNAIL_CACHE_DIR):
+        self.extractor = extractor
+        self.directory = directory
+    
+    def entry_path(self, file_path):
+        """Where the thumbnail of the file's current version is (or would be) stored"""
+        stat = os.stat(file_path)
+        key = f"{os.path.abspath(file_path)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        digest = hashlib.blake2b(key.encode('utf-8', errors='surrogateescape'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.png')
+    
+    def get(self, file_path):
+        """Path of the file's thumbnail, decoding and storing it on a miss
+        
+        Returns None for files without a preview: videos, and images Pillow
+        cannot decode.
+        """
+        entry = self.entry_path(file_path)
+        if os.path.exists(entry):
+            return entry
+        if os.path.splitext(file_path)[1].lower() not in SUPPORTED_IMAGE_EXT or not have_pil():
+            return None
+        try:
+            return self._store(entry, self.extractor.create_thumbnail(file_path))
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            return None
+    
+    def put(self, file_path, thumbnail):
+        """Store an already decoded thumbnail; returns its path"""
+        return self._store(self.entry_path(file_path), thumbnail)
+    
+    def _store(self, entry, thumbnail):
+        import tempfile
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if thumbnail.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                    thumbnail = thumbnail.convert('RGBA')
+                thumbnail.save(f, format='PNG')
+            os.replace(temp_path, entry)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return entry
+
+def is_archive(path):
+    """True for zip and (compressed) tar file names"""
+    return path.lower().endswith(ARCHIVE_EXT)
+
+def split_archive_key(key):
+    """Split "archive.zip!dir/member.png" into (archive path, member name)
+    
+    Returns (key, None) for plain paths. The first "!" that follows an
+    existing archive file is the separator, so "!" in names is harmless.
+    """
+    start = 0
+    while True:
+        index = key.find(ARCHIVE_MEMBER_SEP, start)
+        if index < 0:
+            return key, None
+        archive_path = key[:index]
+        if is_archive(archive_path) and os.path.isfile(archive_path):
+            return archive_path, key[index + 1:]
+        start = index + 1
+
+def iter_archive_members(archive_path, extensions=None):
+    """Yield (key, stream, size) for each media member of a zip or tar, in archive order
+    
+    Members are decompressed as they are read; nothing is unpacked to disk.
+    Each stream is closed when the next member is requested, and tar
+    archives - compressed ones included - are read front to back only once:
+    their members come wrapped in a SpooledMemberStream.
+    """
+    if extensions is None:
+        extensions = SUPPORTED_IMAGE_EXT + SUPPORTED_VIDEO_EXT
+    prefix = archive_path + ARCHIVE_MEMBER_SEP
+    
+    if archive_path.lower().endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in extensions:
+                    continue
+                with archive.open(info) as stream:
+                    yield prefix + info.filename, stream, info.file_size
+    else:
+        import tarfile
+        with tarfile.open(archive_path, 'r:*') as archive:
+            # Iterating reads headers lazily instead of indexing the whole archive first
+            for info in archive:
+                if not info.isfile() or os.path.splitext(info.name)[1].lower() not in extensions:
+                    continue
+                with archive.extractfile(info) as stream, spooled_member(stream, info.size) as spooled:
+                    yield prefix + info.name, spooled, info.size
+
+class SpooledMemberStream(io.RawIOBase):
+    """A tar member that is cheap to seek back in
+    
+    A compressed tar is one stream, so seeking back inside a member
+    rewinds to the start of the archive and decompresses everything
+    before the member again. Here the member is read forward only, as far
+    as reads and seeks need it, and kept in a spool that later seeks use.
+    """
+    
+    def __init__(self, source, size):
+        import tempfile
+        self.source = source
+        self.size = size
+        self.spool = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MEMORY)
+        self.filled = 0
+        self.pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.pos
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+    
+    def readinto(self, buffer):
+        end = min(self.pos + len(buffer), self.size)
+        if end > self.filled:
+            self.spool.seek(self.filled)
+            while self.filled < end:
+                block = self.source.read(min(HASH_BLOCK_SIZE, end - self.filled))
+                if not block:
+                    break
+                self.spool.write(block)
+                self.filled += len(block)
+        self.spool.seek(self.pos)
+        data = self.spool.read(max(0, min(end, self.filled) - self.pos))
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+    
+    def close(self):
+        self.spool.close()
+        super().close()
+
+def spooled_member(stream, size):
+    """A buffered SpooledMemberStream over a tar member"""
+    return io.BufferedReader(SpooledMemberStream(stream, size))
+
+@contextmanager
+def open_archive_member(archive_path, member):
+    """Open one archive member as (stream, size); raises KeyError if it's missing"""
+    if archive_path.lower().endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive_path) as archive:
+            info = archive.getinfo(member)
+            with archive.open(info) as stream:
+                yield stream, info.file_size
+    else:
+        import tarfile
+        with tarfile.open(archive_path, 'r:*') as archive:
+            info = archive.getmember(member)
+            stream = archive.extractfile(info)
+            if stream is None:
+                raise KeyError(f"{member} is not a regular file")
+            with stream, spooled_member(stream, info.size) as spooled:
+                yield spooled, info.size
@@ -0,0 +1,146 @@
+"""Golden-output equivalence checks for MetaProbe's extractors
+
+A faster parser is only an improvement if it gives the same answers.
+This file, run as a script against a source tree, feeds every corpus file
+through that tree's process_image / extract_ai_metadata_from_image /
+process_video and prints one JSON line per file: the outputs flattened to
+"section/field" keys and the best time of each call. Running it for a
+reference tree (or loading a saved golden file) and for the candidate
+tree gives two such records per file to diff field by field. Records
+made relative to the corpus folder can be committed with it; the test
+suite checks tests/fixtures/golden.jsonl that way.
+"""
+import os
+import sys
+import json
+import time
+
+GOLDEN_IMAGE_FUNCTIONS = ('process_image', 'extract_ai_metadata_from_image')
+GOLDEN_VIDEO_FUNCTIONS = ('process_video',)
+# Default budgets: mean milliseconds per file over all functions timed for it
+GOLDEN_BUDGETS_MS = {
+    '.png': 100, '.jpg': 100, '.jpeg': 100, '.webp': 100,
+    '.avif': 100, '.heic': 100, '.heif': 100,
+    '.mp4': 2000, '.mov': 2000, '.webm': 2000,
+}
+
+def flatten(value, prefix='', out=None):
+    """{"EXIF": {"Make": "x"}} -> {"EXIF/Make": "x"}; lists are indexed by position"""
+    if out is None:
+        out = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(item, f"{prefix}/{key}" if prefix else str(key), out)
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            flatten(item, f"{prefix}/{index}" if prefix else str(index), out)
+    else:
+        if hasattr(value, 'load'):
+            # A BlobRef stands for the value it reads back from the file
+            value = value.load()
+        # Round-trip through JSON so both sides compare what a record would store
+        out[prefix] = json.loads(json.dumps(value, default=str))
+    return out
+
+def record_file(extractor, file_path, repeat):
+    """Outputs and best-of-repeat timings of one file"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    video = file_ext in ('.mp4', '.mov', '.webm')
+    record = {"path": file_path, "format": file_ext, "outputs": {}, "ms": {}}
+    for name in GOLDEN_VIDEO_FUNCTIONS if video else GOLDEN_IMAGE_FUNCTIONS:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                if name == 'extract_ai_metadata_from_image':
+                    from PIL import Image
+                    with Image.open(file_path) as img:
+                        output = extractor.extract_ai_metadata_from_image(img, file_path)
+                else:
+                    output = getattr(extractor, name)(file_path, file_ext)
+            except Exception as e:
+                output = {"Exception": f"{type(e).__name__}: {e}"}
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+            extractor.last_thumbnail = None
+        if isinstance(output, tuple):
+            # Each of these returns (metadata, prompt)
+            output = dict(zip(("metadata", "prompt"), output))
+        record["outputs"][name] = flatten(output)
+        record["ms"][name] = round(best, 3)
+    return record
+
+def collect_outputs(paths, tree=None, repeat=3):
+    """Records of the given files as extracted by the source tree at `tree`
+    
+    The tree (default: this one) must contain metaprobe_core.py, or be
+    a checkout from before it existed with only MetaProbe.py (which needs
+    Kivy installed to import). Its extractor runs in a fresh interpreter
+    so neither side warms the other's caches.
+    """
+    import subprocess
+    tree = os.path.abspath(tree or os.path.dirname(os.path.abspath(__file__)))
+    if not any(os.path.isfile(os.path.join(tree, name)) for name in ('metaprobe_core.py', 'MetaProbe.py')):
+        raise ValueError(f"{tree} has neither metaprobe_core.py nor MetaProbe.py")
+    command = [sys.executable, os.path.abspath(__file__), tree, str(repeat)]
+    process = subprocess.run(command, input="\n".join(os.path.abspath(path) for path in paths),
+                             capture_output=True, text=True)
+    if process.returncode:
+        raise ValueError(f"extraction with {tree} failed: {process.stderr.strip().splitlines()[-1:]}")
+    return {record["path"]: record for record in map(json.loads, process.stdout.splitlines())}
+
+def compare_records(reference, candidate):
+    """Field-level differences as (function, field, reference value, candidate value)
+    
+    A field missing on one side is reported with None there.
+    """
+    differences = []
+    missing = object()
+    for name, expected in reference["outputs"].items():
+        actual = candidate["outputs"].get(name, {})
+        for field in list(expected) + [field for field in actual if field not in expected]:
+            a, b = expected.get(field, missing), actual.get(field, missing)
+            if a != b:
+                differences.append((name, field, None if a is missing else a, None if b is missing else b))
+    return differences
+
+def relative_path(value, root):
+    """`value` relative to the folder `root` if it is a path inside it, else unchanged"""
+    prefix = os.path.join(os.path.abspath(root), '')
+    if isinstance(value, str) and value.startswith(prefix):
+        return value[len(prefix):]
+    return value
+
+def relative_record(record, root):
+    """The record with paths inside `root` made relative, so it holds wherever the corpus is checked out"""
+    outputs = {name: {field: relative_path(value, root) for field, value in output.items()}
+               for name, output in record["outputs"].items()}
+    return dict(record, path=relative_path(record["path"], root), outputs=outputs)
+
+def load_extractor(tree):
+    """The extractor of the source tree on sys.path at `tree`
+    
+    Before metaprobe_core.py, the extraction methods lived on the Kivy
+    widget MetaProbe.MetadataDisplay; it is created without __init__, so
+    no widgets are built.
+    """
+    if os.path.isfile(os.path.join(tree, 'metaprobe_core.py')):
+        from metaprobe_core import MetadataExtractor
+        return MetadataExtractor()
+    from MetaProbe import MetadataDisplay
+    return MetadataDisplay.__new__(MetadataDisplay)
+
+def worker_main(tree, repeat):
+    """Record every file named on stdin with the extractor of `tree`"""
+    sys.path.insert(0, tree)
+    # Anything the extractor prints goes to stderr; stdout carries only the records
+    records, sys.stdout = sys.stdout, sys.stderr
+    extractor = load_extractor(tree)
+    for line in sys.stdin:
+        file_path = line.strip()
+        if file_path:
+            print(json.dumps(record_file(extractor, file_path, repeat)), file=records, flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(worker_main(sys.argv[1], int(sys.argv[2])))
@@ -0,0 +1,190 @@
+"""Process-isolated pymediainfo parsing for MetaProbe
+
+libmediainfo runs in long-lived worker processes (this file run as a
+script), one request at a time each. A file that hangs the parser costs
+only its timeout: the worker is killed and the next file gets a fresh
+one. A crashing parser takes down only its worker, never the app or a
+batch. Workers are reused across files and replaced after
+MEDIAINFO_MAX_TASKS parses to bound any leaks in the native library.
+
+Protocol: one JSON request line on stdin, optionally followed by `length`
+raw bytes of an in-memory file; one JSON response line on stdout.
+"""
+import os
+import sys
+import io
+import json
+import queue
+import threading
+
+# libmediainfo parse_speed per depth: quick reads little more than the
+# container headers, full walks the whole file (pymediainfo's default is 0.5)
+MEDIAINFO_DEPTHS = {'quick': 0.0, 'normal': 0.5, 'full': 1.0}
+MEDIAINFO_TIMEOUT = 30.0
+MEDIAINFO_MAX_TASKS = 500
+# Archive members are sent to the worker in memory, up to this many bytes
+MEDIAINFO_MAX_STREAM_BYTES = 64 * 1024 * 1024
+# Tracks reported, first of each type
+MEDIAINFO_TRACK_TYPES = ('General', 'Video', 'Audio')
+
+class MediaInfoError(Exception):
+    """Parsing failed, timed out or crashed its worker"""
+
+def media_info_sections(media_info):
+    """The General, Video and Audio tracks of a parse as plain dicts"""
+    sections = {}
+    for track_type in MEDIAINFO_TRACK_TYPES:
+        track = next((track for track in media_info.tracks if track.track_type == track_type), None)
+        if track:
+            data = {}
+            for attr_name in dir(track):
+                if not attr_name.startswith('_') and not callable(getattr(track, attr_name)):
+                    value = getattr(track, attr_name)
+                    if value and not attr_name.startswith('parse_'):
+                        data[attr_name] = value
+            sections[track_type] = data
+    return sections
+
+class MediaInfoWorker:
+    """One worker process and a thread reading its responses"""
+    
+    def __init__(self):
+        import subprocess
+        self.tasks = 0
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        self.responses = queue.Queue()
+        threading.Thread(target=self._read_responses, daemon=True).start()
+    
+    def _read_responses(self):
+        for line in self.process.stdout:
+            self.responses.put(line)
+        # End of output: the worker exited or crashed
+        self.responses.put(None)
+    
+    def request(self, header, data, timeout):
+        """Send one request and wait up to timeout seconds for its response"""
+        try:
+            self.process.stdin.write(json.dumps(header).encode('utf-8') + b"\n")
+            if data:
+                self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except OSError:
+            raise MediaInfoError(f"MediaInfo worker exited (code {self.process.poll()})")
+        try:
+            line = self.responses.get(timeout=timeout)
+        except queue.Empty:
+            raise MediaInfoError(f"MediaInfo timed out after {timeout:g} s")
+        if line is None:
+            raise MediaInfoError(f"MediaInfo crashed (worker exit code {self.process.wait()})")
+        self.tasks += 1
+        return json.loads(line)
+    
+    def stop(self):
+        """Kill the worker; safe to call on one that already exited"""
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+class MediaInfoPool:
+    """Reusable MediaInfo worker processes, started on demand
+    
+    Each calling thread borrows an idle worker (or starts one), so there
+    are never more processes than threads parsing at once.
+    """
+    
+    def __init__(self, max_tasks=MEDIAINFO_MAX_TASKS):
+        self.max_tasks = max_tasks
+        self.idle = []
+        self.lock = threading.Lock()
+        self.closed = False
+    
+    def parse(self, source, depth='normal', timeout=MEDIAINFO_TIMEOUT):
+        """Parse a path or an open file; returns {track type: {field: value}}
+        
+        Raises MediaInfoError on a parse error, a timeout or a crash.
+        """
+        header = {"speed": MEDIAINFO_DEPTHS[depth]}
+        data = None
+        if hasattr(source, 'read'):
+            source.seek(0)
+            data = source.read(MEDIAINFO_MAX_STREAM_BYTES)
+            header["length"] = len(data)
+        else:
+            header["path"] = os.path.abspath(source)
+        
+        with self.lock:
+            worker = self.idle.pop() if self.idle else None
+        if worker is None:
+            worker = MediaInfoWorker()
+        try:
+            response = worker.request(header, data, timeout)
+        except BaseException:
+            # Hung, crashed or interrupted mid-request - never reuse it
+            worker.stop()
+            raise
+        
+        with self.lock:
+            if self.closed or worker.tasks >= self.max_tasks:
+                worker.stop()
+            else:
+                self.idle.append(worker)
+        if "error" in response:
+            raise MediaInfoError(response["error"])
+        return response["sections"]
+    
+    def close(self):
+        """Stop the idle workers; busy ones stop when their request ends"""
+        with self.lock:
+            self.closed = True
+            workers, self.idle = self.idle, []
+        for worker in workers:
+            worker.stop()
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def shared_pool():
+    """The process-wide pool, created on first use and closed at exit"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            import atexit
+            _shared_pool = MediaInfoPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
+
+def worker_main():
+    """Serve parse requests from stdin until it closes"""
+    # Keep the protocol stream to ourselves; stray prints go to stderr
+    responses = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+    requests = sys.stdin.buffer
+    while True:
+        line = requests.readline()
+        if not line:
+            return 0
+        request = json.loads(line)
+        source = request.get("path")
+        if source is None:
+            source = io.BytesIO(requests.read(request["length"]))
+        try:
+            import pymediainfo
+            media_info = pymediainfo.MediaInfo.parse(source, parse_speed=request["speed"])
+            response = {"sections": media_info_sections(media_info)}
+        except Exception as e:
+            response = {"error": str(e)}
+        responses.write(json.dumps(response, default=str) + "\n")
+        responses.flush()
+
+if __name__ == '__main__':
+    sys.exit(worker_main())
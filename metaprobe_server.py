@@ -0,0 +1,444 @@
+"""Long-lived MetaProbe extraction daemon
+
+`python metaprobe_cli.py serve` listens on a Unix domain socket and answers
+JSON-RPC 2.0 requests, one JSON object per line:
+    
+    {"jsonrpc": "2.0", "id": 1, "method": "extract", "params": {"path": "a.png"}}
+
+Methods: extract, deep_scan, batch, stats, library_stats. Results stay cached between
+requests (keyed by path, size and mtime, then by content), so workers that
+used to start a process per file only pay for a socket round-trip.
+
+Requests on one connection are pipelined: they run concurrently and
+responses are written as they finish, matched to requests by id. Each
+connection has at most `max_in_flight` requests running; beyond that the
+server stops reading, so a client that floods the socket blocks on its own
+writes instead of growing the server's memory.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import inspect
+import tempfile
+import threading
+from collections import OrderedDict
+
+from metaprobe_core import (
+    MetadataExtractor, ExtractionCache, LibraryStats, DEEP_SCAN_TOP_K, have_pil, have_mediainfo,
+    iter_media_files, is_archive, split_archive_key, load_blobs
+)
+from metaprobe_mediainfo import MEDIAINFO_TIMEOUT
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+EXTRACTION_ERROR = -32000
+
+MAX_IN_FLIGHT = 64
+CACHE_ENTRIES = 10000
+# Longest request line accepted; batch requests carry whole path lists
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+def default_socket_path():
+    """Per-user socket path, preferring XDG_RUNTIME_DIR over the temp dir"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, 'getuid') else os.getlogin()
+    return os.path.join(runtime_dir, f"metaprobe-{user}.sock")
+
+class RPCError(Exception):
+    """Error reported to the client as a JSON-RPC error object"""
+    
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class MetaProbeServer:
+    """Unix-socket daemon serving extraction requests from warm caches"""
+    
+    def __init__(self, socket_path=None, workers=None, max_in_flight=MAX_IN_FLIGHT,
+                 cache_entries=CACHE_ENTRIES, fast_hash=False, scan_budget=None,
+                 video_depth='normal', video_timeout=MEDIAINFO_TIMEOUT):
+        self.socket_path = socket_path or default_socket_path()
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_in_flight = max(1, max_in_flight)
+        self.cache_entries = cache_entries
+        
+        self.extractor = MetadataExtractor()
+        self.extractor.scan_budget = scan_budget
+        self.extractor.mediainfo_depth = video_depth
+        self.extractor.mediainfo_timeout = video_timeout
+        self.cache = ExtractionCache(self.extractor, fast=fast_hash, max_entries=cache_entries,
+                                    max_groups=cache_entries)
+        # (path) -> (size, mtime_ns, ExtractionResult); skips even the content hash
+        self.recent = OrderedDict()
+        self.lock = threading.Lock()
+        # Library stats: one partial per worker thread, merged when asked for
+        self.partials = []
+        self.local = threading.local()
+        # path -> (version, LibraryStats.entry) counted in the stats, least recent first
+        self.counted = OrderedDict()
+        
+        self.methods = {
+            "extract": self.rpc_extract,
+            "deep_scan": self.rpc_deep_scan,
+            "batch": self.rpc_batch,
+            "stats": self.rpc_stats,
+            "library_stats": self.rpc_library_stats,
+        }
+        self.started = time.time()
+        self.counters = {"requests": 0, "errors": 0, "cache_hits": 0, "cache_misses": 0}
+        self.in_flight = 0
+        self.connections = 0
+        self.pool = None
+        self.listening = False
+    
+    def serve_forever(self):
+        """Run until interrupted; removes the socket file on exit"""
+        import asyncio
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Never remove the socket of another server we refused to replace
+            if self.listening and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+    
+    async def _serve(self):
+        import asyncio
+        import signal
+        from concurrent.futures import ThreadPoolExecutor
+        
+        # Load the optional dependencies now rather than on the first request
+        have_pil()
+        have_mediainfo()
+        self._remove_stale_socket()
+        
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path,
+                                                 limit=MAX_REQUEST_BYTES)
+        self.listening = True
+        os.chmod(self.socket_path, 0o600)
+        
+        stop = asyncio.get_running_loop().create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, stop.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+        print(f"MetaProbe serving on {self.socket_path} ({self.workers} workers)", file=sys.stderr)
+        try:
+            async with server:
+                await stop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _remove_stale_socket(self):
+        """Remove a socket file left behind by a crashed server, refuse to steal a live one"""
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)
+        else:
+            raise RuntimeError(f"A server is already listening on {self.socket_path}")
+        finally:
+            probe.close()
+    
+    async def _handle_connection(self, reader, writer):
+        import asyncio
+        self.connections += 1
+        slots = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                # Backpressure: don't read the next request until a slot is free
+                await slots.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    slots.release()
+                    await self._send(writer, write_lock,
+                                     self._error(None, INVALID_REQUEST, "Request line too long"))
+                    break
+                if not line:
+                    slots.release()
+                    break
+                if not line.strip():
+                    slots.release()
+                    continue
+                task = asyncio.get_running_loop().create_task(
+                    self._respond(line, writer, write_lock, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+    
+    async def _respond(self, line, writer, write_lock, slots):
+        import asyncio
+        self.in_flight += 1
+        try:
+            response = await self._dispatch(asyncio.get_running_loop(), line)
+            if response is not None:
+                await self._send(writer, write_lock, response)
+        except ConnectionError:
+            pass
+        finally:
+            self.in_flight -= 1
+            slots.release()
+    
+    async def _send(self, writer, write_lock, response):
+        data = json.dumps(response, default=str).encode('utf-8') + b"\n"
+        async with write_lock:
+            writer.write(data)
+            await writer.drain()
+    
+    async def _dispatch(self, loop, line):
+        """Run one request line; returns the response object, or None for notifications"""
+        self.counters["requests"] += 1
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self.counters["errors"] += 1
+            return self._error(None, PARSE_ERROR, f"Parse error: {e}")
+        
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            self.counters["errors"] += 1
+            return self._error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        params = request.get("params", {})
+        method = self.methods.get(request["method"])
+        
+        try:
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "params must be an object")
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+            result = await loop.run_in_executor(self.pool, self._call, method, params)
+        except RPCError as e:
+            self.counters["errors"] += 1
+            response = self._error(request_id, e.code, str(e))
+        else:
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        
+        # Requests without an id are notifications and never get a response
+        return response if "id" in request else None
+    
+    def _call(self, method, params):
+        try:
+            return method(**params)
+        except RPCError:
+            raise
+        except Exception as e:
+            raise RPCError(EXTRACTION_ERROR, str(e))
+    
+    def _error(self, request_id, code, message):
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+    
+    def extract_cached(self, file_path):
+        """ExtractionResult for a file, reusing earlier work while the file is unchanged"""
+        # Archive members are as fresh as their archive
+        stat = os.stat(split_archive_key(file_path)[0])
+        with self.lock:
+            entry = self.recent.get(file_path)
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                self.recent.move_to_end(file_path)
+                self.counters["cache_hits"] += 1
+                return entry[2]
+            self.counters["cache_misses"] += 1
+        
+        result, _ = self.cache.extract(file_path)
+        with self.lock:
+            self.recent[file_path] = (stat.st_size, stat.st_mtime_ns, result)
+            self.recent.move_to_end(file_path)
+            while len(self.recent) > self.cache_entries:
+                self.recent.popitem(last=False)
+        self.count_in_stats(file_path, (stat.st_size, stat.st_mtime_ns), result)
+        return result
+    
+    def count_in_stats(self, file_path, version, result):
+        """Add a file to the library stats, replacing an older version of it
+        
+        Only the small LibraryStats.entry() of each file is kept, for the
+        cache_entries most recent paths. A path forgotten past that stays
+        in the stats, but is counted again if it is extracted again.
+        """
+        entry = LibraryStats.entry(result)
+        with self.lock:
+            previous = self.counted.get(file_path)
+            if previous is not None and previous[0] == version:
+                self.counted.move_to_end(file_path)
+                return
+            self.counted[file_path] = (version, entry)
+            self.counted.move_to_end(file_path)
+            while len(self.counted) > self.cache_entries:
+                self.counted.popitem(last=False)
+        
+        partial = getattr(self.local, 'stats', None)
+        if partial is None:
+            partial = self.local.stats = (LibraryStats(), threading.Lock())
+            with self.lock:
+                self.partials.append(partial)
+        # Only this thread writes its partial, so its lock is contended only while merging
+        stats, lock = partial
+        with lock:
+            if previous is not None:
+                stats.remove(previous[1])
+            stats.add(entry)
+    
+    def rpc_extract(self, path, raw=True):
+        """Metadata of one file: the flat record, or the display tree with raw=False"""
+        result = self.extract_cached(path)
+        # Large values are read back from the file here, on the worker thread
+        return load_blobs(result.to_record() if raw else result.to_dict())
+    
+    def rpc_deep_scan(self, path, top_k=DEEP_SCAN_TOP_K):
+        """Best prompt-like strings anywhere in the file"""
+        candidates = self.extractor.deep_scan_file(path, top_k=top_k)
+        return [{"text": text, "score": score} for text, score in candidates.best()]
+    
+    def rpc_batch(self, paths, raw=True):
+        """Extract files and folders; one request, one response with every record
+        
+        Files are extracted on the calling worker thread so a large batch
+        never starves the single-file requests queued behind it.
+        """
+        records = []
+        errors = []
+        by_content = {}
+        for file_path in iter_media_files(paths, archives=True):
+            if is_archive(file_path):
+                try:
+                    stat = os.stat(file_path)
+                    version = (stat.st_size, stat.st_mtime_ns)
+                    for key, extraction, error in self.cache.extract_archive(file_path):
+                        if error is not None:
+                            errors.append({"path": key, "error": str(error)})
+                        else:
+                            result = extraction[0]
+                            self.count_in_stats(key, version, result)
+                            records.append(result.to_record() if raw else result.to_dict())
+                            by_content.setdefault(result.content_hash, []).append(key)
+                except Exception as e:
+                    errors.append({"path": file_path, "error": str(e)})
+                continue
+            try:
+                result = self.extract_cached(file_path)
+                record = load_blobs(result.to_record() if raw else result.to_dict())
+            except Exception as e:
+                errors.append({"path": file_path, "error": str(e)})
+                continue
+            records.append(record)
+            by_content.setdefault(result.content_hash, []).append(file_path)
+        duplicates = [group for group in by_content.values() if len(group) > 1]
+        return {"results": records, "errors": errors, "duplicates": duplicates}
+    
+    def rpc_stats(self):
+        """Server counters and cache sizes"""
+        with self.lock:
+            recent = len(self.recent)
+        return dict(self.counters,
+                    uptime=round(time.time() - self.started, 3),
+                    in_flight=self.in_flight,
+                    connections=self.connections,
+                    workers=self.workers,
+                    cached_files=recent,
+                    cached_contents=len(self.cache.results))
+
+    def rpc_library_stats(self, summary=False, top=10):
+        """Aggregates over every file extracted so far; a text report with summary=True"""
+        stats = LibraryStats()
+        with self.lock:
+            partials = list(self.partials)
+        for partial, lock in partials:
+            with lock:
+                stats.merge(partial)
+        return stats.summary(top) if summary else stats.to_dict()
+
+class MetaProbeClient:
+    """Blocking client for the extraction daemon
+        
+        with MetaProbeClient() as client:
+            record = client.call("extract", path="image.png")
+    """
+    
+    def __init__(self, socket_path=None, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path or default_socket_path())
+        self.stream = self.sock.makefile('rwb')
+        self.next_id = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+    
+    def call(self, method, **params):
+        """Send one request and return its result; raises RPCError on error responses"""
+        result = self.call_many([(method, params)])[0]
+        if isinstance(result, RPCError):
+            raise result
+        return result
+    
+    def call_many(self, requests, window=MAX_IN_FLIGHT):
+        """Pipeline (method, params) requests and return their results in order
+        
+        Up to `window` requests are outstanding at once; the server works on
+        them concurrently and may answer out of order. Reading responses
+        while sending keeps both sides from blocking on full socket buffers.
+        Failed requests have an RPCError in their place, so one bad file
+        doesn't lose the results of the others.
+        """
+        ids = []
+        responses = {}
+        for method, params in requests:
+            if len(ids) - len(responses) >= window:
+                self._read_response(responses)
+            self.next_id += 1
+            ids.append(self.next_id)
+            message = {"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}
+            self.stream.write(json.dumps(message).encode('utf-8') + b"\n")
+            self.stream.flush()
+        while len(responses) < len(ids):
+            self._read_response(responses)
+        
+        results = []
+        for request_id in ids:
+            response = responses[request_id]
+            if "error" in response:
+                results.append(RPCError(response["error"]["code"], response["error"]["message"]))
+            else:
+                results.append(response["result"])
+        return results
+    
+    def _read_response(self, responses):
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        responses[response.get("id")] = response
@@ -0,0 +1,360 @@
+"""Metadata stripping and rewriting for MetaProbe
+
+PNGs and JPEGs are rewritten by walking their chunks and segments: pixel
+data is copied byte for byte and never decoded, the chosen text, EXIF and
+XMP entries are dropped or replaced, and the new file takes the place of
+the old one atomically.
+"""
+import os
+import struct
+import zlib
+import tempfile
+from dataclasses import dataclass, field
+
+from metaprobe_core import MetadataExtractor, iter_media_files
+
+STRIP_EXT = ['.png', '.jpg', '.jpeg']
+# What `strip` can remove; everything by default
+#   text    - PNG tEXt/zTXt/iTXt chunks (prompts, workflows) and JPEG comments
+#   exif    - PNG eXIf chunks and JPEG APP1 Exif segments (orientation is kept)
+#   xmp     - XMP packets (PNG iTXt XML:com.adobe.xmp, JPEG APP1 XMP and extensions)
+#   iptc    - JPEG APP13 Photoshop/IPTC segments
+#   trailer - bytes appended after PNG IEND or JPEG EOI
+STRIP_CATEGORIES = ('text', 'exif', 'xmp', 'iptc', 'trailer')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_XMP_KEYWORD = 'XML:com.adobe.xmp'
+EXIF_ORIENTATION = 0x0112
+# Read/write block size when the kernel can't copy ranges itself
+COPY_BLOCK_SIZE = 1024 * 1024
+
+@dataclass
+class StripPlan:
+    """What to remove from each file and what to write in its place"""
+    drop: frozenset = frozenset(STRIP_CATEGORIES)
+    # Text keywords left alone even when their category is dropped
+    keep_keys: frozenset = frozenset()
+    # keyword -> text written instead of any existing entry (PNG text chunk, JPEG comment)
+    set_text: dict = field(default_factory=dict)
+
+@dataclass
+class StripResult:
+    """Outcome for one file; sizes in bytes"""
+    path: str
+    output: str
+    removed: list = field(default_factory=list)
+    added: list = field(default_factory=list)
+    size_before: int = 0
+    size_after: int = 0
+    
+    @property
+    def changed(self):
+        return bool(self.removed or self.added)
+
+def exif_orientation(tiff):
+    """Orientation tag from the first IFD of a TIFF/EXIF block (1 if absent)"""
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, value_type, _, value = struct.unpack(order + 'HHI4s', tiff[entry:entry + 12])
+            if tag == EXIF_ORIENTATION and value_type == 3:
+                return struct.unpack(order + 'H', value[:2])[0]
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+def orientation_exif(orientation):
+    """A minimal big-endian TIFF block holding only the orientation tag"""
+    return b'MM' + struct.pack('>HIHHHIHHI', 42, 8, 1, EXIF_ORIENTATION, 3, 1, orientation, 0, 0)
+
+def stripped_exif(tiff):
+    """What a dropped TIFF/EXIF block is replaced by: its orientation alone, or nothing"""
+    orientation = exif_orientation(tiff)
+    return orientation_exif(orientation) if orientation != 1 else None
+
+def png_chunk(chunk_type, data):
+    """Serialize a PNG chunk with its length and CRC"""
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def png_text_chunk(keyword, text):
+    """tEXt chunk for Latin-1 text, uncompressed iTXt for anything else"""
+    try:
+        return png_chunk(b'tEXt', keyword.encode('latin-1') + b'\x00' + text.encode('latin-1'))
+    except UnicodeEncodeError:
+        return png_chunk(b'iTXt', keyword.encode('latin-1') + b'\x00\x00\x00\x00\x00' + text.encode('utf-8'))
+
+def jpeg_segment(code, data):
+    """Serialize a JPEG marker segment"""
+    if len(data) > 0xFFFD:
+        raise ValueError(f"{len(data)} bytes do not fit in one JPEG segment")
+    return struct.pack('>BBH', 0xFF, code, len(data) + 2) + data
+
+def iter_strip_targets(paths, output_dir=None):
+    """Yield (source, destination) for the PNGs and JPEGs under paths
+    
+    Without output_dir files are rewritten in place; with it, each folder's
+    layout is recreated under output_dir.
+    """
+    for path in paths:
+        for file_path in iter_media_files([path], STRIP_EXT):
+            if output_dir is None:
+                yield file_path, file_path
+            elif os.path.isdir(path):
+                yield file_path, os.path.join(output_dir, os.path.relpath(file_path, path))
+            else:
+                yield file_path, os.path.join(output_dir, os.path.basename(file_path))
+
+class MetadataStripper:
+    """Rewrites PNG and JPEG metadata without touching the image data
+    
+    Each file is mapped to a list of pieces - (start, end) byte ranges of
+    the original to copy verbatim and bytes objects for new chunks - and
+    then written to a temporary file beside the destination, fsynced and
+    renamed over it. Ranges are copied by the kernel where it can.
+    """
+    
+    def __init__(self, plan, dry_run=False, workers=8):
+        self.plan = plan
+        self.dry_run = dry_run
+        self.workers = workers
+        self.extractor = MetadataExtractor()
+    
+    def run(self, targets, on_result):
+        """Strip (source, destination) pairs on a thread pool
+        
+        on_result(source, StripResult, error) is called per file in
+        completion order. Only a few files per worker are queued at once,
+        so arbitrarily large folders stream through.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        
+        def report(future):
+            source = pending.pop(future)
+            try:
+                on_result(source, future.result(), None)
+            except (OSError, ValueError, struct.error) as e:
+                on_result(source, None, e)
+        
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for source, destination in targets:
+                if len(pending) >= self.workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(future)
+                pending[executor.submit(self.strip_file, source, destination)] = source
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report(future)
+    
+    def strip_file(self, file_path, output_path=None):
+        """Strip one file into output_path (default: in place)"""
+        output_path = output_path or file_path
+        result = StripResult(file_path, output_path)
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            signature = f.read(8)
+            if signature == PNG_SIGNATURE:
+                pieces = self._png_pieces(f, stat.st_size, result)
+            elif signature.startswith(b'\xff\xd8'):
+                pieces = self._jpeg_pieces(f, stat.st_size, result)
+            else:
+                raise ValueError("not a PNG or JPEG file")
+            
+            result.size_before = stat.st_size
+            result.size_after = sum(len(piece) if isinstance(piece, bytes) else piece[1] - piece[0]
+                                    for piece in pieces)
+            same_file = os.path.abspath(output_path) == os.path.abspath(file_path)
+            if not self.dry_run and (result.changed or not same_file):
+                self._write(f, pieces, output_path, stat.st_mode)
+        return result
+    
+    def _keep(self, pieces, start, end):
+        """Add a byte range of the original, merging it with the previous one"""
+        if start >= end:
+            return
+        if pieces and isinstance(pieces[-1], tuple) and pieces[-1][1] == start:
+            pieces[-1] = (pieces[-1][0], end)
+        else:
+            pieces.append((start, end))
+    
+    def _dropped(self, category, key=None):
+        """True if an entry of this category (and text key) is to be removed"""
+        if key is not None and key in self.plan.keep_keys:
+            return False
+        return category in self.plan.drop
+    
+    def _png_pieces(self, f, size, result):
+        """Pieces of a stripped PNG; new text chunks go before the first IDAT"""
+        pieces = [(0, 8)]
+        inserted = False
+        pos = 8
+        while pos + 12 <= size:
+            f.seek(pos)
+            length, chunk_type = struct.unpack('>I4s', f.read(8))
+            end = pos + 12 + length
+            if end > size:
+                # Truncated chunk - keep whatever is there
+                break
+            
+            if not inserted and chunk_type in (b'IDAT', b'IEND'):
+                for keyword, text in self.plan.set_text.items():
+                    pieces.append(png_text_chunk(keyword, text))
+                    result.added.append(f"text {keyword}")
+                inserted = True
+            
+            name = chunk_type.decode('latin-1')
+            if chunk_type in (b'tEXt', b'zTXt', b'iTXt'):
+                keyword = f.read(min(length, 80)).partition(b'\x00')[0].decode('latin-1')
+                category = 'xmp' if keyword == PNG_XMP_KEYWORD else 'text'
+                if keyword in self.plan.set_text or self._dropped(category, keyword):
+                    result.removed.append(f"{name} {keyword}")
+                else:
+                    self._keep(pieces, pos, end)
+            elif chunk_type == b'eXIf' and self._dropped('exif'):
+                tiff = f.read(length)
+                replacement = stripped_exif(tiff)
+                if replacement == tiff:
+                    # Stripped before, down to its orientation
+                    self._keep(pieces, pos, end)
+                else:
+                    result.removed.append(name)
+                    if replacement:
+                        pieces.append(png_chunk(b'eXIf', replacement))
+                        result.added.append("EXIF orientation")
+            else:
+                self._keep(pieces, pos, end)
+            
+            pos = end
+            if chunk_type == b'IEND':
+                if pos < size and self._dropped('trailer'):
+                    result.removed.append(f"{size - pos} bytes after IEND")
+                    return pieces
+                break
+        
+        self._keep(pieces, pos, size)
+        return pieces
+    
+    def _jpeg_pieces(self, f, size, result):
+        """Pieces of a stripped JPEG; new comments go after the APPn segments"""
+        pieces = [(0, 2)]
+        inserted = False
+        ended = False
+        pos = 2
+        while pos + 4 <= size:
+            f.seek(pos)
+            marker = f.read(2)
+            if marker[0] != 0xFF:
+                break
+            code = marker[1]
+            if code == 0xFF:
+                # Fill byte
+                self._keep(pieces, pos, pos + 1)
+                pos += 1
+                continue
+            if code in (0x01, 0xD8) or 0xD0 <= code <= 0xD7:
+                self._keep(pieces, pos, pos + 2)
+                pos += 2
+                continue
+            
+            if not inserted and not 0xE0 <= code <= 0xEF:
+                for key, text in self.plan.set_text.items():
+                    comment = text if key == 'Comment' else f"{key}: {text}"
+                    pieces.append(jpeg_segment(0xFE, comment.encode('utf-8')))
+                    result.added.append(f"comment {key}")
+                inserted = True
+            
+            if code == 0xD9:
+                self._keep(pieces, pos, pos + 2)
+                pos += 2
+                ended = True
+                break
+            if code == 0xDA:
+                # Scan data (and any later scans of a progressive JPEG) run to the end-of-image marker
+                end = self.extractor._find_jpeg_end(f, pos, size)
+                self._keep(pieces, pos, end)
+                pos = end
+                ended = True
+                break
+            
+            length = struct.unpack('>H', f.read(2))[0]
+            end = pos + 2 + length
+            category = key = None
+            if code in (0xE1, 0xED, 0xFE):
+                data = f.read(length - 2)
+                if code == 0xFE:
+                    category, key, label = 'text', 'Comment', "comment"
+                elif data.startswith(b'Exif\x00\x00'):
+                    replacement = stripped_exif(data[6:])
+                    # Unless it was stripped before, down to its orientation
+                    if replacement != data[6:]:
+                        category, label = 'exif', "APP1 Exif"
+                elif data.startswith((b'http://ns.adobe.com/xap/1.0/\x00',
+                                      b'http://ns.adobe.com/xmp/extension/\x00')):
+                    category, label = 'xmp', "APP1 XMP"
+                elif code == 0xED and data.startswith(b'Photoshop 3.0\x00'):
+                    category, label = 'iptc', "APP13 IPTC"
+            
+            if category is not None and (key in self.plan.set_text or self._dropped(category, key)):
+                result.removed.append(label)
+                if category == 'exif' and replacement:
+                    pieces.append(jpeg_segment(0xE1, b'Exif\x00\x00' + replacement))
+                    result.added.append("EXIF orientation")
+            else:
+                self._keep(pieces, pos, end)
+            pos = end
+        
+        if ended and pos < size and self._dropped('trailer'):
+            result.removed.append(f"{size - pos} bytes after EOI")
+            return pieces
+        self._keep(pieces, pos, size)
+        return pieces
+    
+    def _write(self, f, pieces, output_path, mode):
+        """Write pieces to a temporary file beside output_path, then rename it over"""
+        directory = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(output_path) + '.',
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for piece in pieces:
+                    if isinstance(piece, bytes):
+                        out.write(piece)
+                    else:
+                        out.flush()
+                        self._copy_range(f, out, piece[0], piece[1])
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(temp_path, mode & 0o7777)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _copy_range(self, f, out, start, end):
+        """Copy bytes [start, end) of f to the current position of out"""
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        while start < end and copy_file_range is not None:
+            try:
+                copied = copy_file_range(f.fileno(), out.fileno(), end - start, start)
+            except OSError:
+                # Unsupported here (old kernel, other filesystem); finish with plain reads
+                break
+            if copied == 0:
+                raise ValueError("file shrank while it was being rewritten")
+            start += copied
+        
+        f.seek(start)
+        while start < end:
+            block = f.read(min(COPY_BLOCK_SIZE, end - start))
+            if not block:
+                raise ValueError("file shrank while it was being rewritten")
+            out.write(block)
+            start += len(block)
@@ -0,0 +1,12 @@
+"""Shared setup for the MetaProbe test suite
+
+The modules under test live at the repository root, next to this
+folder, and are imported from there.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,177 @@
+"""Reading media straight from zip archives"""
+import io
+import os
+import struct
+import tarfile
+import zipfile
+
+import pytest
+
+PIL = pytest.importorskip('PIL')
+from PIL import Image, PngImagePlugin
+
+from metaprobe_core import MetadataExtractor, ExtractionCache, ARCHIVE_HEADER_BYTES, FAST_HASH_SPAN
+
+# A member may cost its headers plus the two bounded binary scans, never its pixel data
+MEMBER_READ_LIMIT = 2 * ARCHIVE_HEADER_BYTES + 64 * 1024
+MEMBER_SIDE = 1024
+
+class CountingFile(io.FileIO):
+    """A file that counts the bytes read through it"""
+    bytes_read = 0
+    
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+def noise_image():
+    """Random pixels, which no codec can shrink much"""
+    return Image.frombytes('RGB', (MEMBER_SIDE, MEMBER_SIDE), os.urandom(MEMBER_SIDE * MEMBER_SIDE * 3))
+
+def move_exif_after_idat(path):
+    """Rewrite a PNG with its eXIf chunk after the pixel data, as some writers store it"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    chunks, pos = [], 8
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunks.append((chunk_type, data[pos:pos + length + 12]))
+        pos += length + 12
+    order = {b'eXIf': 1, b'IEND': 2}
+    chunks.sort(key=lambda chunk: order.get(chunk[0], 0))
+    with open(path, 'wb') as f:
+        f.write(data[:8] + b''.join(chunk for _, chunk in chunks))
+
+def write_member(path, kind):
+    image = noise_image()
+    if kind == 'png':
+        image.save(path)
+    elif kind == 'png-parameters':
+        info = PngImagePlugin.PngInfo()
+        info.add_text('parameters', 'a cat\nSteps: 20, Sampler: Euler, CFG scale: 7, Seed: 1')
+        image.save(path, pnginfo=info)
+    elif kind == 'png-trailing-exif':
+        exif = Image.Exif()
+        exif[0x0131] = 'DALL-E 3'
+        image.save(path, exif=exif.tobytes())
+        move_exif_after_idat(path)
+    else:
+        image.save(path, quality=95)
+
+def count_archive_reads(monkeypatch):
+    """From now on, count the bytes read from each zip or tar opened; returns the counting files"""
+    opened = []
+    real_zipfile, real_tar_open = zipfile.ZipFile, tarfile.open
+    
+    def counting_file(path):
+        raw = CountingFile(path)
+        opened.append(raw)
+        return io.BufferedReader(raw)
+    
+    monkeypatch.setattr(zipfile, 'ZipFile',
+                        lambda path, *args, **kwargs: real_zipfile(counting_file(path), *args, **kwargs))
+    monkeypatch.setattr(tarfile, 'open',
+                        lambda path, mode='r', **kwargs: real_tar_open(fileobj=counting_file(path), mode=mode, **kwargs))
+    return opened
+
+@pytest.mark.parametrize('kind, file_name', [
+    ('png', 'plain.png'),
+    ('png-parameters', 'parameters.png'),
+    ('png-trailing-exif', 'exif.png'),
+    ('jpeg', 'photo.jpg'),
+])
+def test_member_is_parsed_from_its_headers(tmp_path, monkeypatch, kind, file_name):
+    member = tmp_path / file_name
+    write_member(member, kind)
+    archive = tmp_path / 'library.zip'
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as out:
+        out.write(member, file_name)
+    
+    opened = count_archive_reads(monkeypatch)
+    results = list(MetadataExtractor().extract_archive(str(archive)))
+    for raw in opened:
+        raw.close()
+    
+    assert [(key, error) for key, _, error in results] == [(f"{archive}!{file_name}", None)]
+    assert os.path.getsize(member) > 2 * MEMBER_READ_LIMIT
+    assert sum(raw.bytes_read for raw in opened) < MEMBER_READ_LIMIT
+    result = results[0][1]
+    assert (result.width, result.height) == (MEMBER_SIDE, MEMBER_SIDE)
+    assert result.dhash is None
+    if kind == 'png-parameters':
+        assert result.prompt.startswith('a cat')
+
+def test_members_are_keyed_into_duplicate_groups(tmp_path):
+    loose = tmp_path / 'a.png'
+    write_member(loose, 'png-parameters')
+    with zipfile.ZipFile(tmp_path / 'pack.zip', 'w') as out:
+        out.write(loose, 'copies/a.png')
+    with tarfile.open(tmp_path / 'pack.tar.gz', 'w:gz') as out:
+        out.add(loose, 'a.png')
+    cache = ExtractionCache(MetadataExtractor())
+    
+    result, _ = cache.extract(str(loose))
+    members = list(cache.extract_archive(str(tmp_path / 'pack.zip')))
+    members += list(cache.extract_archive(str(tmp_path / 'pack.tar.gz')))
+    
+    assert [error for _, _, error in members] == [None, None]
+    (zip_key, (zip_result, _), _), (tar_key, (tar_result, tar_duplicate_of), _) = members
+    assert (zip_result.path, tar_result.path) == (zip_key, tar_key)
+    assert zip_result.content_hash == tar_result.content_hash != result.content_hash
+    assert zip_result.content_mode == "member"
+    assert tar_duplicate_of == zip_key
+    assert cache.duplicate_groups() == [[zip_key, tar_key]]
+    # An "archive!member" path is keyed the same way
+    assert cache.extract(tar_key)[0].content_hash == tar_result.content_hash
+
+def test_cached_members_read_only_their_heads(tmp_path, monkeypatch):
+    member = tmp_path / 'plain.png'
+    write_member(member, 'png')
+    archive = tmp_path / 'library.zip'
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as out:
+        out.write(member, 'plain.png')
+    cache = ExtractionCache(MetadataExtractor())
+    
+    opened = count_archive_reads(monkeypatch)
+    first = list(cache.extract_archive(str(archive)))
+    first_read = sum(raw.bytes_read for raw in opened)
+    second = list(cache.extract_archive(str(archive)))
+    second_read = sum(raw.bytes_read for raw in opened) - first_read
+    for raw in opened:
+        raw.close()
+    
+    assert first[0][1][0].content_hash == second[0][1][0].content_hash
+    assert os.path.getsize(member) > 2 * (MEMBER_READ_LIMIT + FAST_HASH_SPAN)
+    assert first_read < MEMBER_READ_LIMIT + FAST_HASH_SPAN
+    assert second_read < FAST_HASH_SPAN + 16 * 1024
+
+def test_compressed_tar_is_read_once(tmp_path, monkeypatch):
+    archive = tmp_path / 'library.tar.gz'
+    with tarfile.open(archive, 'w:gz') as out:
+        for index in range(2):
+            member = tmp_path / f'{index}.png'
+            write_member(member, 'png')
+            out.add(member, member.name)
+    
+    opened = count_archive_reads(monkeypatch)
+    members = list(ExtractionCache(MetadataExtractor()).extract_archive(str(archive)))
+    for raw in opened:
+        raw.close()
+    
+    # Keying and parsing seek back within members; that must not rewind the archive
+    assert [error for _, _, error in members] == [None, None]
+    assert sum(raw.bytes_read for raw in opened) < os.path.getsize(archive) + 64 * 1024
+
+def test_loose_png_exif_after_the_pixels_is_read_without_decoding(tmp_path, monkeypatch):
+    loose = tmp_path / 'exif.png'
+    write_member(loose, 'png-trailing-exif')
+    loads = []
+    real_load = PngImagePlugin.PngImageFile.load
+    monkeypatch.setattr(PngImagePlugin.PngImageFile, 'load', lambda img: loads.append(img) or real_load(img))
+    
+    with Image.open(loose) as img:
+        metadata, _ = MetadataExtractor().extract_ai_metadata_from_image(img, str(loose))
+    
+    assert metadata["Generator"] == "DALL-E"
+    assert loads == []
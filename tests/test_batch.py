@@ -0,0 +1,36 @@
+"""Asynchronous batch extraction"""
+import os
+
+import pytest
+
+pytest.importorskip('PIL')
+from PIL import Image, PngImagePlugin
+
+from metaprobe_core import MetadataExtractor, ExtractionCache, AsyncBatchRunner
+
+def test_parse_workers_only_use_the_prefetched_bytes(tmp_path, monkeypatch):
+    paths = []
+    for index in range(6):
+        info = PngImagePlugin.PngInfo()
+        info.add_text('parameters', f'a cat number {index}\nSteps: 20, Sampler: Euler, Seed: {index}')
+        path = tmp_path / f'{index}.png'
+        Image.new('RGB', (64, 64), (index * 40, 0, 0)).save(path, pnginfo=info)
+        paths.append(str(path))
+    (tmp_path / 'copy.png').write_bytes((tmp_path / '0.png').read_bytes())
+    paths.append(str(tmp_path / 'copy.png'))
+    cache = ExtractionCache(MetadataExtractor())
+    runner = AsyncBatchRunner(cache, concurrency=4, workers=2)
+    # Once read and hashed on the I/O threads, the files are gone: parsing must not need them
+    prefetch = runner._prefetch
+    monkeypatch.setattr(runner, '_prefetch', lambda path: (prefetch(path), os.remove(path))[0])
+    results = {}
+    
+    runner.run(paths, lambda path, result, error: results.setdefault(path, (result, error)))
+    
+    assert sorted(results) == sorted(paths)
+    for (result, _), error in results.values():
+        assert error is None
+        assert "Error" not in result.sections
+        assert result.dhash is not None
+        assert result.prompt.startswith('a cat number')
+    assert [sorted(group) for group in cache.duplicate_groups()] == [sorted([paths[0], paths[-1]])]
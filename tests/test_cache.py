@@ -0,0 +1,40 @@
+"""Content-hash deduplication in ExtractionCache"""
+import pytest
+
+pytest.importorskip('PIL')
+from PIL import Image
+
+from metaprobe_core import MetadataExtractor, ExtractionCache
+
+def write_images(folder, colours):
+    paths = []
+    for name, colour in colours:
+        path = folder / name
+        Image.new('RGB', (16, 16), colour).save(path)
+        paths.append(str(path))
+    return paths
+
+def test_groups_outlive_evicted_results(tmp_path):
+    a, b, c = write_images(tmp_path, [('a.png', 'red'), ('b.png', 'green'), ('c.png', 'blue')])
+    copy = tmp_path / 'copy_of_a.png'
+    copy.write_bytes(open(a, 'rb').read())
+    cache = ExtractionCache(MetadataExtractor(), max_entries=1)
+    
+    for path in (a, b, c):
+        cache.extract(path)
+    result, duplicate_of = cache.extract(str(copy))
+    cache.extract(a)
+    
+    assert len(cache.results) == 1
+    assert duplicate_of == a
+    assert result.path == str(copy)
+    assert cache.duplicate_groups() == [[a, str(copy)]]
+
+def test_max_groups_bounds_the_path_groups(tmp_path):
+    paths = write_images(tmp_path, [(f'{i}.png', (i, 0, 0)) for i in range(4)])
+    cache = ExtractionCache(MetadataExtractor(), max_entries=2, max_groups=2)
+    
+    for path in paths:
+        cache.extract(path)
+    
+    assert sorted(path for group in cache.paths.values() for path in group) == paths[2:]
@@ -0,0 +1,17 @@
+"""Top-k bookkeeping of the deep scan"""
+import random
+
+from metaprobe_core import PromptCandidates, score_prompt_candidate
+
+def test_top_k_stays_bounded_and_exact():
+    rng = random.Random(0)
+    words = ['masterpiece', 'portrait', 'a cat', 'cinematic', 'lighting', 'detailed', 'blurry', 'x']
+    texts = [' '.join(rng.choice(words) for _ in range(rng.randrange(3, 12))) for _ in range(5000)]
+    candidates = PromptCandidates(top_k=5)
+    for text in texts + texts:
+        candidates.add(text)
+    
+    distinct = {text for text in texts if len(text) > 15}
+    expected = sorted(((score_prompt_candidate(text), text) for text in distinct), reverse=True)[:5]
+    assert candidates.best() == [(text, score) for score, text in expected]
+    assert len(candidates.in_heap) == 5
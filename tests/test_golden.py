@@ -0,0 +1,89 @@
+"""Extractor outputs on the committed corpus against recorded goldens
+
+fixtures/golden.jsonl holds the outputs of this tree: any change to
+them must come with the goldens re-recorded, so it shows up in review.
+Re-record with
+
+    python metaprobe_cli.py golden tests/fixtures/media -o tests/fixtures/golden.jsonl --relative-to tests/fixtures/media
+
+fixtures/baseline.jsonl holds the outputs of the extractor before the
+parser rewrite, recorded from the baseline commit's MetaProbe.py (the
+golden command runs such a tree's MetadataDisplay; it needs Kivy):
+
+    git worktree add ../metaprobe-baseline 13e0e66
+    python metaprobe_cli.py golden tests/fixtures/media -o tests/fixtures/baseline.jsonl --relative-to tests/fixtures/media --tree ../metaprobe-baseline
+
+Outputs may only differ from it as BASELINE_CHANGES allows. Each
+format's mean time per file must also stay within GOLDEN_BUDGETS_MS.
+"""
+import fnmatch
+import json
+import os
+import re
+
+import pytest
+
+pytest.importorskip('PIL')
+
+from conftest import ROOT
+from metaprobe_core import MetadataExtractor, iter_media_files
+from metaprobe_golden import record_file, compare_records, relative_record, GOLDEN_BUDGETS_MS
+
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+CORPUS = os.path.join(FIXTURES, 'media')
+# Timed runs of each call, best kept, as the golden command does by default
+BUDGET_REPEAT = 3
+# Intended differences from the baseline: (file name pattern, field pattern, why)
+BASELINE_CHANGES = (
+    ('*', r'metadata/Hashes/dHash', "user-028 adds the perceptual hash"),
+    ('*', r'metadata/(Detection/Confidence|Detector_Confidence)', "user-034 reports the detector's confidence"),
+    ('a1111.png', r'(metadata/(AI_Metadata/)?)?(Generator|positive_prompt|negative_prompt|parameters/.+)',
+     "user-027 tokenizes A1111 parameters"),
+    ('comfyui.png', r'(metadata/(AI_Metadata/)?)?(Generator|prompt|positive_prompt|negative_prompt|node_count'
+                    r'|node_types/\d+|sampler|scheduler|steps|cfg|denoise|seed|checkpoint|loras/.+)',
+     "user-026 parses ComfyUI graphs"),
+    ('usercomment.jpg', r'(metadata/(AI_Metadata/)?)?(Generator|prompt|positive_prompt|parameters/.+)',
+     "user-034 detects A1111 parameters in a JPEG UserComment"),
+)
+
+def load_records(file_name):
+    with open(os.path.join(FIXTURES, file_name), 'r', encoding='utf-8') as f:
+        return {record["path"]: record for record in map(json.loads, f)}
+
+@pytest.fixture(scope='module')
+def current():
+    extractor = MetadataExtractor()
+    records = (record_file(extractor, file_path, 1) for file_path in iter_media_files([CORPUS]))
+    return {record["path"]: record for record in (relative_record(r, CORPUS) for r in records)}
+
+def allowed(file_name, field):
+    return any(fnmatch.fnmatch(file_name, files) and re.fullmatch(fields, field)
+               for files, fields, _ in BASELINE_CHANGES)
+
+def test_goldens_cover_the_corpus(current):
+    assert sorted(load_records('golden.jsonl')) == sorted(load_records('baseline.jsonl')) == sorted(current)
+
+def test_outputs_match_the_goldens(current):
+    golden = load_records('golden.jsonl')
+    differences = {path: compare_records(golden[path], record) for path, record in current.items()}
+    assert {path: found for path, found in differences.items() if found} == {}
+
+def test_outputs_differ_from_the_baseline_only_as_intended(current):
+    baseline = load_records('baseline.jsonl')
+    unexpected = {}
+    for path, record in current.items():
+        for name, field, before, after in compare_records(baseline[path], record):
+            if not allowed(path, field):
+                unexpected.setdefault(path, []).append((name, field, before, after))
+    assert unexpected == {}
+
+def test_formats_stay_within_their_budgets():
+    extractor = MetadataExtractor()
+    times = {}
+    for file_path in iter_media_files([CORPUS]):
+        record = record_file(extractor, file_path, BUDGET_REPEAT)
+        times.setdefault(record["format"], []).append(sum(record["ms"].values()))
+    
+    means = {file_ext: sum(ms) / len(ms) for file_ext, ms in times.items()}
+    assert sorted(means) == ['.jpg', '.png', '.webp']
+    assert {file_ext: mean for file_ext, mean in means.items() if mean > GOLDEN_BUDGETS_MS[file_ext]} == {}
@@ -0,0 +1,55 @@
+"""Scan time of the binary matchers on adversarial inputs
+
+The files in fixtures/scan are inputs that used to make the matchers
+backtrack: pattern prefixes repeated without their closers, unbalanced
+braces and quotes, and random bytes sprinkled with prefixes. The
+generated inputs are the ones of the scan-check command, at a smaller
+size so the suite stays quick.
+"""
+import os
+import random
+import time
+
+import pytest
+
+from conftest import ROOT
+from metaprobe_core import MetadataExtractor
+from metaprobe_cli import scan_check_inputs, scan_check_scanners
+
+SCAN_FIXTURES = os.path.join(ROOT, 'tests', 'fixtures', 'scan')
+# Same budget as the scan-check command; the slowest scan takes about half of it
+SCAN_BUDGET_MS_PER_MB = 500
+SCAN_INPUT_SIZE = 128 * 1024
+SCAN_RUNS = 3
+
+SCANNERS = scan_check_scanners(MetadataExtractor())
+
+def ms_per_mb(scan, data):
+    """Best of SCAN_RUNS timings of scan(data), in milliseconds per MB"""
+    best = None
+    for _ in range(SCAN_RUNS):
+        start = time.perf_counter()
+        scan(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000 * 1024 * 1024 / len(data)
+
+def slow_scans(inputs):
+    """(scanner, input, ms/MB) of each scan of the (name, data) inputs over budget"""
+    over = []
+    for name, data in inputs:
+        for scanner, scan in SCANNERS:
+            elapsed = ms_per_mb(scan, data)
+            if elapsed > SCAN_BUDGET_MS_PER_MB:
+                over.append((scanner, name, round(elapsed)))
+    return over
+
+@pytest.mark.parametrize('file_name', sorted(os.listdir(SCAN_FIXTURES)))
+def test_fixture_scans_within_budget(file_name):
+    with open(os.path.join(SCAN_FIXTURES, file_name), 'rb') as f:
+        data = f.read()
+    assert slow_scans([(file_name, data)]) == []
+
+def test_generated_scans_within_budget():
+    inputs = scan_check_inputs(random.Random(0), SCAN_INPUT_SIZE, 2)
+    assert slow_scans(inputs) == []
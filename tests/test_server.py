@@ -0,0 +1,115 @@
+"""The JSON-RPC extraction daemon, run on a temporary Unix socket"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('PIL')
+from PIL import Image, PngImagePlugin
+
+from conftest import ROOT
+from metaprobe_server import MetaProbeServer, MetaProbeClient, RPCError
+
+def write_library(folder):
+    """Three images with prompts, one of them twice; returns their paths"""
+    folder.mkdir()
+    paths = []
+    for index in range(3):
+        info = PngImagePlugin.PngInfo()
+        info.add_text('parameters', f'a cat number {index}\nSteps: 20, Sampler: Euler, Seed: {index}')
+        path = folder / f'{index}.png'
+        Image.new('RGB', (32, 32), (index * 80, 0, 0)).save(path, pnginfo=info)
+        paths.append(str(path))
+    (folder / 'copy.png').write_bytes((folder / '0.png').read_bytes())
+    return paths + [str(folder / 'copy.png')]
+
+def wait_for_socket(socket_path, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert process.poll() is None, process.stderr.read()
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            return
+        except OSError:
+            time.sleep(0.05)
+        finally:
+            probe.close()
+    raise TimeoutError(f"server did not listen on {socket_path}")
+
+@pytest.fixture
+def server(tmp_path):
+    """(socket path, library paths) of a server running in its own process"""
+    paths = write_library(tmp_path / 'library')
+    socket_path = str(tmp_path / 'metaprobe.sock')
+    process = subprocess.Popen([sys.executable, 'metaprobe_cli.py', 'serve', '--socket', socket_path],
+                               cwd=ROOT, stderr=subprocess.PIPE, text=True)
+    try:
+        wait_for_socket(socket_path, process)
+        yield socket_path, paths
+    finally:
+        process.terminate()
+        process.wait(timeout=20)
+    assert not os.path.exists(socket_path)
+
+def test_extract_is_cached_between_requests(server):
+    socket_path, paths = server
+    with MetaProbeClient(socket_path, timeout=30) as client:
+        first = client.call("extract", path=paths[1])
+        again = client.call("extract", path=paths[1])
+        tree = client.call("extract", path=paths[1], raw=False)
+        stats = client.call("stats")
+    
+    assert first == again
+    assert first["prompt"].startswith('a cat number 1')
+    assert tree["Basic"]["File Name"] == '1.png'
+    assert (stats["cache_hits"], stats["cache_misses"]) == (2, 1)
+    assert stats["requests"] == 4
+
+def test_batch_reports_records_and_duplicates(server):
+    socket_path, paths = server
+    folder = os.path.dirname(paths[0])
+    with MetaProbeClient(socket_path, timeout=30) as client:
+        batch = client.call("batch", paths=[folder, os.path.join(folder, 'missing.png')])
+        library = client.call("library_stats")
+    
+    assert sorted(record["path"] for record in batch["results"]) == sorted(paths)
+    assert [sorted(group) for group in batch["duplicates"]] == [sorted([paths[0], paths[3]])]
+    assert [error["path"] for error in batch["errors"]] == [os.path.join(folder, 'missing.png')]
+    assert library["files"] == 4
+
+def test_pipelined_requests_are_answered_in_order(server):
+    socket_path, paths = server
+    missing = paths[0] + '.gone.png'
+    requests = [("extract", {"path": paths[index % 3]}) for index in range(30)]
+    requests.insert(7, ("extract", {"path": missing}))
+    requests.append(("no_such_method", {}))
+    with MetaProbeClient(socket_path, timeout=30) as client:
+        results = client.call_many(requests, window=8)
+    
+    assert len(results) == len(requests)
+    for (_, params), result in zip(requests, results):
+        if params.get("path", missing) == missing:
+            assert isinstance(result, RPCError)
+        else:
+            assert result["path"] == params["path"]
+
+def test_stats_count_each_file_version_once(tmp_path):
+    paths = write_library(tmp_path / 'library')
+    server = MetaProbeServer(str(tmp_path / 'unused.sock'), cache_entries=2)
+    
+    for path in paths[:2] + paths[:2]:
+        server.extract_cached(path)
+    Image.new('RGB', (8, 8)).save(paths[1])
+    os.utime(paths[1], ns=(1, 1))
+    server.extract_cached(paths[1])
+    
+    stats = server.rpc_library_stats()
+    assert (stats["files"], stats["with_prompt"]) == (2, 1)
+    assert stats["resolutions"] == {"32x32": 1, "8x8": 1}
+    server.extract_cached(paths[2])
+    assert list(server.counted) == paths[1:3]
+    assert all(isinstance(entry, tuple) for _, entry in server.counted.values())
@@ -0,0 +1,34 @@
+"""Import-time guarantees of the headless modules
+
+Each module is imported in a fresh interpreter: this one has usually
+loaded Pillow for other tests already.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+# Only imported the first time a file needs them
+LAZY_MODULES = ('kivy', 'PIL', 'pymediainfo')
+
+def modules_loaded_by(statement):
+    """The LAZY_MODULES in sys.modules after running `statement` in a new interpreter"""
+    probe = f"import sys\n{statement}\nprint(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return [module for module in output.strip().split(',') if module]
+
+@pytest.mark.parametrize('module', ['metaprobe_core', 'metaprobe_cli', 'metaprobe_server',
+                                    'metaprobe_strip', 'metaprobe_golden'])
+def test_import_loads_no_heavy_dependency(module):
+    assert modules_loaded_by(f"import {module}") == []
+
+def test_extractor_construction_is_lazy():
+    assert modules_loaded_by("import metaprobe_core\nmetaprobe_core.MetadataExtractor()") == []
+
+def test_pillow_is_loaded_on_first_image():
+    statement = ("import metaprobe_core\n"
+                 "metaprobe_core.have_pil()")
+    assert modules_loaded_by(statement) == ['PIL']